@@ -0,0 +1,265 @@
+'''Benchmark the examples per phase and compare the results.
+
+Usage:
+
+    python -m devtools.benchmark run [--examples laplace,...] [--sizes small,...] [--repeat N] [--output results.json]
+    python -m devtools.benchmark compare base.json results.json [--threshold 1.2] [--mintime .05]
+
+Every benchmark case runs an example from ``examples/`` with fixed parameters
+and a mesh size in a separate Python process. The wall time of a case is
+divided over the phases ``mesh``, ``basis``, ``simplify``, ``assembly``,
+``solve``, ``export`` and ``other`` by instrumenting the corresponding nutils
+functions. Nested phases are accounted exclusively, e.g. the simplification of
+integrals during assembly counts as ``simplify`` only. Per phase the increase
+of the peak resident memory of the process is recorded as well. With
+``--repeat`` every case is run multiple times and the minimum per phase is
+reported. Examples that iterate until convergence are stopped after a fixed
+number of solves, see ``MAXSOLVES``.
+'''
+
+import argparse, contextlib, functools, importlib.util, inspect, json, platform, subprocess, sys, tempfile, time, typing
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Mapping, Sequence, Tuple
+from . import log
+
+try:
+  from resource import getrusage, RUSAGE_SELF
+except ImportError:
+  _peak_memory = lambda: 0
+else:
+  _peak_memory = lambda: getrusage(RUSAGE_SELF).ru_maxrss << 10 if sys.platform != 'darwin' else getrusage(RUSAGE_SELF).ru_maxrss
+
+EXAMPLES = Path(__file__).parent.parent/'examples'
+PHASES = 'mesh', 'basis', 'simplify', 'assembly', 'solve', 'export', 'other'
+SIZES = 'small', 'medium', 'large'
+
+# Benchmark cases: example name -> (mesh sizes per entry of `SIZES`, function
+# returning the keyword arguments for `main` given the example module and the
+# mesh size).
+CASES: Mapping[str, Tuple[Tuple[int, int, int], Callable[[Any, int], Dict[str, Any]]]] = {
+  'laplace': ((8, 32, 128), lambda m, n: dict(nelems=n, etype='square', btype='std', degree=1)),
+  'drivencavity': ((4, 8, 16), lambda m, n: dict(nelems=n, etype='square', reynolds=100, degree=3)),
+  'cylinderflow': ((6, 12, 24), lambda m, n: dict(nelems=n, degree=3, reynolds=100, rotation=0, timestep=.1, maxradius=25, seed=0, endtime=.2)),
+  'cahnhilliard': ((16, 32, 64), lambda m, n: dict(nelems=n, etype='square', btype='std', degree=2, epsilon=None, contactangle=90, timestep=1, mtol=0, seed=0, circle=False, stab=m.stab.linear)),
+  'elasticity': ((8, 32, 96), lambda m, n: dict(nelems=n, etype='square', btype='std', degree=1, poisson=.25)),
+  'platewithhole': ((4, 8, 16), lambda m, n: dict(nelems=n, etype='square', btype='spline', degree=2, traction=.1, maxrefine=2, radius=.5, poisson=.3)),
+  'adaptivity': ((2, 4, 6), lambda m, n: dict(nrefine=n, btype='h-std', etype='square', degree=2)),
+}
+
+# Number of calls to `solver.optimize` after which a case is stopped, for
+# examples that iterate until a convergence criterion is met rather than for a
+# fixed number of time steps.
+MAXSOLVES: Mapping[str, int] = {
+  'cahnhilliard': 3,
+}
+
+class _Stop(Exception):
+  pass
+
+class Phases:
+  '''Exclusive wall time and peak memory increase per phase.'''
+
+  def __init__(self) -> None:
+    self.time = dict.fromkeys(PHASES, 0.)
+    self.memory = dict.fromkeys(PHASES, 0)
+    self._stack = []
+    self._time = 0.
+    self._memory = 0
+
+  @property
+  def current(self) -> typing.Optional[str]:
+    return self._stack[-1] if self._stack else None
+
+  def _flush(self) -> None:
+    now, peak = time.perf_counter(), _peak_memory()
+    if self._stack:
+      self.time[self.current] += now - self._time
+      self.memory[self.current] += peak - self._memory
+    self._time, self._memory = now, peak
+
+  @contextlib.contextmanager
+  def __call__(self, phase: str) -> Iterator[None]:
+    self._flush()
+    self._stack.append(phase)
+    try:
+      yield
+    finally:
+      self._flush()
+      self._stack.pop()
+
+  def wrap(self, func: Callable, phase: str) -> Callable:
+    '''Return a wrapper of ``func`` that runs in ``phase``.'''
+
+    if inspect.isgeneratorfunction(inspect.unwrap(func)): # context manager such as export.mplfigure
+      @contextlib.contextmanager
+      @functools.wraps(func)
+      def wrapper(*args, **kwargs):
+        with self(phase):
+          cm = func(*args, **kwargs)
+          value = cm.__enter__()
+        try:
+          yield value
+        except:
+          with self(phase):
+            if not cm.__exit__(*sys.exc_info()):
+              raise
+        else:
+          with self(phase):
+            cm.__exit__(None, None, None)
+    else:
+      @functools.wraps(func)
+      def wrapper(*args, **kwargs):
+        if self.current == phase: # shortcut for recursive calls
+          return func(*args, **kwargs)
+        with self(phase):
+          return func(*args, **kwargs)
+    return wrapper
+
+  def instrument(self) -> None:
+    '''Wrap the nutils functions that mark the phases.'''
+
+    from nutils import mesh, topology, sample, evaluable, matrix, export
+    targets = [(mesh, name, 'mesh') for name, func in vars(mesh).items() if inspect.isfunction(func) and func.__module__ == mesh.__name__ and not name.startswith('_')]
+    targets += [(cls, 'basis', 'basis') for cls in vars(topology).values() if isinstance(cls, type) and 'basis' in vars(cls)]
+    targets += [(sample, '_optimized_for_numpy', 'simplify'), (evaluable, 'derivative', 'simplify')]
+    targets += [(sample, 'eval_integrals_sparse', 'assembly')]
+    targets += [(matrix.Matrix, 'solve', 'solve')]
+    targets += [(export, name, 'export') for name in ('mplfigure', 'triplot', 'vtk', 'vtu', 'pvd')]
+    for obj, name, phase in targets:
+      setattr(obj, name, self.wrap(getattr(obj, name), phase))
+
+def _load_example(name: str):
+  spec = importlib.util.spec_from_file_location('examples.'+name, str(EXAMPLES/(name+'.py')))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+def run_case(example: str, size: int) -> Dict[str, Any]:
+  '''Run a single benchmark case in the current process.'''
+
+  import treelog
+  phases = Phases()
+  phases.instrument()
+  module = _load_example(example)
+  kwargs = CASES[example][1](module, size)
+  if example in MAXSOLVES:
+    from nutils import solver
+    optimize = solver.optimize
+    nsolves = 0
+    @functools.wraps(optimize)
+    def capped(*args, **kwargs):
+      nonlocal nsolves
+      if nsolves == MAXSOLVES[example]:
+        raise _Stop
+      nsolves += 1
+      return optimize(*args, **kwargs)
+    solver.optimize = capped
+  with tempfile.TemporaryDirectory() as outdir, treelog.set(treelog.DataLog(outdir)):
+    start = time.perf_counter()
+    with phases('other'):
+      try:
+        module.main(**kwargs)
+      except _Stop:
+        pass
+    total = time.perf_counter() - start
+  return dict(example=example, size=size, time=total, peak_memory=_peak_memory(), phases={phase: dict(time=phases.time[phase], memory=phases.memory[phase]) for phase in PHASES})
+
+def _run_subprocess(example: str, size: int) -> Dict[str, Any]:
+  with tempfile.TemporaryDirectory() as tmpdir:
+    output = Path(tmpdir)/'case.json'
+    subprocess.run([sys.executable, '-m', 'devtools.benchmark', '_case', example, str(size), str(output)], cwd=str(EXAMPLES.parent), check=True)
+    return json.loads(output.read_text())
+
+def _combine(results: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+  combined = dict(results[0])
+  combined['time'] = min(result['time'] for result in results)
+  combined['peak_memory'] = min(result['peak_memory'] for result in results)
+  combined['phases'] = {phase: {key: min(result['phases'][phase][key] for result in results) for key in ('time', 'memory')} for phase in PHASES}
+  return combined
+
+def run(examples: Sequence[str], sizes: Sequence[str], repeat: int, output: str) -> None:
+  import nutils, numpy
+  results = []
+  for example in examples:
+    for size in sizes:
+      n = CASES[example][0][SIZES.index(size)]
+      log.info('{} {} (size {})'.format(example, size, n))
+      result = _combine([_run_subprocess(example, n) for i in range(repeat)])
+      result['label'] = size
+      log.debug('  total: {:.3f}s, peak memory: {:,}M'.format(result['time'], result['peak_memory'] >> 20))
+      for phase in PHASES:
+        log.debug('  {}: {:.3f}s, {:+,}M'.format(phase, result['phases'][phase]['time'], result['phases'][phase]['memory'] >> 20))
+      results.append(result)
+  try:
+    commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=str(EXAMPLES.parent), capture_output=True, check=True).stdout.decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    commit = None
+  data = dict(nutils=nutils.version, commit=commit, python=platform.python_version(), numpy=numpy.__version__, platform=platform.platform(), timestamp=time.time(), results=results)
+  with open(output, 'w') as f:
+    json.dump(data, f, indent=2)
+  log.info('results written to {}'.format(output))
+
+def compare(base: str, new: str, threshold: float, mintime: float) -> bool:
+  '''Compare two result files and return ``True`` if there are regressions.
+
+  A phase regresses if its time increases by more than a factor
+  ``threshold``, ignoring differences smaller than ``mintime`` seconds.'''
+
+  with open(base) as f:
+    baseresults = {(result['example'], result['size']): result for result in json.load(f)['results']}
+  with open(new) as f:
+    newresults = json.load(f)['results']
+  regressions = False
+  for result in newresults:
+    key = result['example'], result['size']
+    if key not in baseresults:
+      log.debug('{} {}: not in {}'.format(*key, base))
+      continue
+    baseresult = baseresults[key]
+    lines = []
+    for name, t0, t1 in [('total', baseresult['time'], result['time'])] + [(phase, baseresult['phases'][phase]['time'], result['phases'][phase]['time']) for phase in PHASES]:
+      regressed = t1 - t0 > mintime and t1 > t0 * threshold
+      regressions |= regressed
+      lines.append((regressed, '  {:8s} {:8.3f}s -> {:8.3f}s ({:+.0f}%){}'.format(name, t0, t1, 100*(t1/t0-1) if t0 else 0, ' REGRESSION' if regressed else '')))
+    if any(regressed for regressed, line in lines):
+      log.warning('{} {}:\n'.format(*key) + '\n'.join(line for regressed, line in lines))
+    else:
+      log.info('{} {}:\n'.format(*key) + '\n'.join(line for regressed, line in lines))
+  return regressions
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='benchmark the examples per phase and compare the results')
+  subparsers = parser.add_subparsers(dest='command')
+  subparsers.required = True
+  parser_run = subparsers.add_parser('run', help='run the benchmarks')
+  parser_run.add_argument('--examples', default=','.join(CASES), help='comma separated list of examples; default: all')
+  parser_run.add_argument('--sizes', default='small,medium', help='comma separated list of sizes ({}); default: small,medium'.format(', '.join(SIZES)))
+  parser_run.add_argument('--repeat', type=int, default=1, help='number of runs per case, reporting the minimum; default: 1')
+  parser_run.add_argument('--output', default='benchmark.json', help='output file; default: benchmark.json')
+  parser_compare = subparsers.add_parser('compare', help='compare two result files')
+  parser_compare.add_argument('base', help='result file to compare against')
+  parser_compare.add_argument('new', help='result file to compare')
+  parser_compare.add_argument('--threshold', type=float, default=1.2, help='relative time increase that is flagged as a regression; default: 1.2')
+  parser_compare.add_argument('--mintime', type=float, default=.05, help='ignore time increases smaller than this many seconds; default: .05')
+  parser_case = subparsers.add_parser('_case')
+  parser_case.add_argument('example')
+  parser_case.add_argument('size', type=int)
+  parser_case.add_argument('output')
+  args = parser.parse_args()
+
+  if args.command == 'run':
+    examples = args.examples.split(',')
+    sizes = args.sizes.split(',')
+    for example in examples:
+      if example not in CASES:
+        raise SystemExit('unknown example: {}'.format(example))
+    for size in sizes:
+      if size not in SIZES:
+        raise SystemExit('unknown size: {}'.format(size))
+    run(examples, sizes, args.repeat, args.output)
+  elif args.command == 'compare':
+    if compare(args.base, args.new, args.threshold, args.mintime):
+      raise SystemExit('performance regressions found')
+  elif args.command == '_case':
+    with open(args.output, 'w') as f:
+      json.dump(run_case(args.example, args.size), f)
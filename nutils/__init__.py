@@ -31,6 +31,7 @@ long_version = ('{} "{}"' if version_name else '{}').format(version, version_nam
 __all__ = [
   'cache',
   'cli',
+  'distributed',
   'element',
   'elementseq',
   'evaluable',
@@ -0,0 +1,155 @@
+# Copyright (c) 2014 Evalf
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+Collection of performance data for the ``perfreport`` option of
+:func:`nutils.cli.setup`. The functions of this module are no-ops unless a
+:class:`Report` is active.
+"""
+
+from . import util
+import sys, time, contextlib, collections, treelog
+
+try:
+  from resource import getrusage, RUSAGE_SELF
+except ImportError:
+  _peak_rss = lambda: None
+else:
+  _peak_rss = lambda: getrusage(RUSAGE_SELF).ru_maxrss << 10 if sys.platform != 'darwin' else getrusage(RUSAGE_SELF).ru_maxrss
+
+_report = util.settable(None)
+
+class _Context:
+
+  def __init__(self, title):
+    self.title = title
+    self.children = []
+    self._time = time.perf_counter()
+    self._rss = _peak_rss()
+    self.time = None
+    self.rss = None
+
+  def close(self):
+    self.time = time.perf_counter() - self._time
+    peak_rss = _peak_rss()
+    self.rss = peak_rss and dict(peak=peak_rss, increase=peak_rss - self._rss)
+
+  def asdict(self):
+    return dict(title=self.title, time=self.time, rss=self.rss, contexts=[child.asdict() for child in self.children])
+
+class Report(treelog.NullLog):
+  '''Performance data of a run.
+
+  The report is a log that records the wall time and the peak resident memory
+  of every context and iteration, which should be added to the active logs
+  (e.g. via :func:`treelog.add`) alongside activating it via :func:`active`.
+  Additionally it collects the accumulated times of :func:`timer` phases, the
+  cache statistics of :func:`count` and the iterations of :func:`solver`.
+  '''
+
+  def __init__(self):
+    self.root = _Context(None)
+    self._stack = [self.root]
+    self.phases = collections.defaultdict(lambda: dict(time=0., count=0))
+    self.counts = collections.defaultdict(collections.Counter)
+    self.solvers = []
+
+  def pushcontext(self, title):
+    context = _Context(title)
+    self._stack[-1].children.append(context)
+    self._stack.append(context)
+
+  def popcontext(self):
+    self._stack.pop().close()
+
+  def recontext(self, title):
+    # Iterators rename their context for every item; every item is recorded
+    # as a separate context to obtain timings per iteration.
+    self.popcontext()
+    self.pushcontext(title)
+
+  def asdict(self):
+    while len(self._stack) > 1:
+      self.popcontext()
+    self.root.close()
+    return dict(
+      time=self.root.time,
+      rss=self.root.rss,
+      contexts=[child.asdict() for child in self.root.children],
+      phases=dict(self.phases),
+      solvers=self.solvers,
+      cache={name: dict(counts, rate=counts['hits'] / (counts['hits'] + counts['misses']) if counts['hits'] + counts['misses'] else None) for name, counts in self.counts.items()})
+
+@contextlib.contextmanager
+def active(report):
+  '''Collect performance data in ``report`` and log contexts to it.'''
+
+  with _report.sets(report), treelog.add(report):
+    yield report
+
+@contextlib.contextmanager
+def timer(phase):
+  '''Accumulate the wall time of the block in ``phase``.'''
+
+  report = _report.value
+  if report is None:
+    yield
+    return
+  t0 = time.perf_counter()
+  try:
+    yield
+  finally:
+    data = report.phases[phase]
+    data['time'] += time.perf_counter() - t0
+    data['count'] += 1
+
+def count(name, event):
+  '''Increment the counter of ``event`` (e.g. 'hits' or 'misses') of ``name``.'''
+
+  report = _report.value
+  if report is not None:
+    report.counts[name][event] += 1
+
+@contextlib.contextmanager
+def solver(name):
+  '''Record the iterations of a solver.
+
+  Yields a function that should be called with the residual norm of every
+  iterate, which records it along with the wall time and the time spent in
+  the ``assembly`` and ``solve`` phases since the previous iterate.'''
+
+  report = _report.value
+  if report is None:
+    yield lambda resnorm: None
+    return
+  steps = []
+  record = dict(name=name, iterations=0, converged=False, steps=steps)
+  report.solvers.append(record)
+  phases = 'assembly', 'solve'
+  last = [time.perf_counter(), *[report.phases[phase]['time'] for phase in phases]]
+  def step(resnorm):
+    current = [time.perf_counter(), *[report.phases[phase]['time'] for phase in phases]]
+    steps.append(dict(resnorm=float(resnorm), **{name: t1 - t0 for name, t0, t1 in zip(['time', *phases], last, current)}))
+    record['iterations'] = len(steps) - 1
+    last[:] = current
+  yield step
+  record['converged'] = True
+
+# vim:sw=2:sts=2:et
@@ -22,8 +22,8 @@
 The cache module.
 """
 
-from . import types, util
-import os, numpy, functools, inspect, builtins, pathlib, pickle, itertools, hashlib, abc, contextlib, treelog as log
+from . import types, util, _perf
+import os, io, numpy, functools, inspect, builtins, pathlib, pickle, itertools, hashlib, abc, contextlib, struct, zlib, treelog as log
 
 class Wrapper:
   'function decorator that caches results by arguments'
@@ -79,21 +79,28 @@ class WrapperCache:
     return hashlib.sha1(b'nutils.cache.WrapperCache\0').digest()
 
 _cache = util.settable()
+_graphcache = util.settable()
 
-def enable(cachedir: str):
+@contextlib.contextmanager
+def enable(cachedir: str, *, graphs: bool = False):
   '''
   Enable cacheing and set the cache directory to ``cachedir``.  Affects
   functions decorated with :func:`function` and subclasses of
-  :class:`Recursion`.
+  :class:`Recursion`.  If ``graphs`` is true, functions decorated with
+  :func:`graph` are cached in the same directory as well.
   '''
-  return _cache.sets(pathlib.Path(cachedir))
+  cachedir = pathlib.Path(cachedir)
+  with _cache.sets(cachedir), _graphcache.sets(cachedir if graphs else None):
+    yield
 
+@contextlib.contextmanager
 def disable():
   '''
-  Disable cacheing.  Affects functions decorated with :func:`function` and
-  subclasses of :class:`Recursion`.
+  Disable cacheing.  Affects functions decorated with :func:`function` or
+  :func:`graph` and subclasses of :class:`Recursion`.
   '''
-  return _cache.sets(None)
+  with _cache.sets(None), _graphcache.sets(None):
+    yield
 
 # Define platform-dependent `_lock_file` function.
 def _lock_file_fallback(f): pass
@@ -172,6 +179,40 @@ def function(func=None, *, version=0):
     raise ValueError("'version' should be of type 'int' but got {!r}".format(version))
   if func is None:
     return functools.partial(function, version=version)
+  return _memoize(func, version, _cache, 'cache.function')
+
+def graph(func=None, *, version=0):
+  '''
+  Decorator to wrap a function ``func`` that transforms evaluable graphs, such
+  as the simplification and optimization steps that precede evaluation, with a
+  memoizing callable.  The decorator behaves like :func:`function`, except
+  that memoization is active only if caching was enabled with
+  ``graphs=True``, and that it remains active inside functions decorated with
+  :func:`function`: a cache miss of a cached solver can still reuse the
+  optimized graphs of a previous run.
+
+  Parameters
+  ----------
+  func : :any:`callable`
+      The function to be memoized.
+  version : :class:`int`
+      Optional version number of ``func``.  Increment this if the behavior of
+      ``func`` is changed.
+
+  Returns
+  -------
+  :any:`callable`
+      A memoized version of ``func``.
+  '''
+
+  if not isinstance(version, int):
+    raise ValueError("'version' should be of type 'int' but got {!r}".format(version))
+  if func is None:
+    return functools.partial(graph, version=version)
+  return _memoize(func, version, _graphcache, 'cache.graph')
+
+def _memoize(func, version, cachedir, name):
+  '''helper function for :func:`function` and :func:`graph`'''
 
   # Hash of the full function name (closest thing to a unique representation of
   # `func`).
@@ -180,7 +221,7 @@ def function(func=None, *, version=0):
 
   @functools.wraps(func)
   def wrapper(*args, **kwargs):
-    if _cache.value is None:
+    if cachedir.value is None:
       return func(*args, **kwargs)
     args, kwargs = canonicalize(*args, **kwargs)
     # Hash the function key and the canonicalized arguments and compute the
@@ -191,7 +232,7 @@ def function(func=None, *, version=0):
     for hkv in sorted(hashlib.sha1(k.encode()).digest()+types.nutils_hash(v) for k, v in kwargs.items()):
       h.update(hkv)
     hkey = h.hexdigest()
-    cachefile = _cache.value/hkey
+    cachefile = cachedir.value/hkey
     # Open and lock `cachefile`.  Try to read it and, if successful, unlock
     # the file (implicitly by closing the file) and return the value.  If
     # reading fails, e.g. because the file did not exist, call `func`, store
@@ -202,9 +243,9 @@ def function(func=None, *, version=0):
     cachefile.parent.mkdir(parents=True, exist_ok=True)
     cachefile.touch()
     with cachefile.open('r+b') as f:
-      log.debug('[cache.function {}] acquiring lock'.format(hkey))
+      log.debug('[{} {}] acquiring lock'.format(name, hkey))
       _lock_file(f)
-      log.debug('[cache.function {}] lock acquired'.format(hkey))
+      log.debug('[{} {}] lock acquired'.format(name, hkey))
       try:
         data = pickle.load(f)
         if len(data) == 3: # For old caches.
@@ -214,24 +255,135 @@ def function(func=None, *, version=0):
         else:
           value, log_ = data
       except (EOFError, pickle.UnpicklingError, IndexError):
-        log.debug('[cache.function {}] failed to load, cache will be rewritten'.format(hkey))
+        log.debug('[{} {}] failed to load, cache will be rewritten'.format(name, hkey))
         pass
       else:
-        log.debug('[cache.function {}] load'.format(hkey))
+        log.debug('[{} {}] load'.format(name, hkey))
+        _perf.count(name, 'hits')
         log_.replay()
         return value
       # Seek back to the beginning, because pickle might have read garbage.
       f.seek(0)
       # Disable the cache temporarily to prevent caching subresults *in* `func`.
       log_ = log.RecordLog()
-      with disable(), log.add(log_):
+      with _cache.sets(None), log.add(log_):
         value = func(*args, **kwargs)
       pickle.dump((value, log_), f)
-      log.debug('[cache.function {}] store'.format(hkey))
+      log.debug('[{} {}] store'.format(name, hkey))
+      _perf.count(name, 'misses')
       return value
 
   return wrapper
 
+class _AppendLog:
+  '''Append-only storage of the iterations of a :class:`Recursion`.
+
+  The iterations are stored as records in a single file ``records``: a header
+  with the length and checksum of the payload and the number of out-of-band
+  buffers, followed by the pickled object and the raw data of the buffers
+  (e.g. of contiguous numpy arrays) prefixed by their lengths. The file
+  ``index`` contains the end offset of every record, such that any record can
+  be located without reading the preceding ones. A record is complete once its
+  offset is written to the index. Writing a record discards all records from
+  that point onward, so records are not immutable: writers should hold the
+  lock on the file ``lock``, and readers that do not hold the lock should
+  treat a record that fails to load as possibly being rewritten. The files
+  are kept open until :meth:`close`.
+  '''
+
+  _header = struct.Struct('<QII') # payload length, crc32 of payload, number of buffers
+  _size = struct.Struct('<Q')
+
+  def __init__(self, path):
+    path.mkdir(parents=True, exist_ok=True)
+    for name in 'records', 'index', 'lock':
+      (path/name).touch()
+    self._path = path
+    self._records = (path/'records').open('r+b')
+    self._index = (path/'index').open('r+b')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    self._records.close()
+    self._index.close()
+
+  def offsets(self):
+    '''End offsets of the complete records.'''
+
+    self._index.seek(0)
+    data = self._index.read()
+    return numpy.frombuffer(data, dtype='<u8', count=len(data) // self._size.size)
+
+  @contextlib.contextmanager
+  def lock(self):
+    with (self._path/'lock').open('r+b') as f:
+      _lock_file(f)
+      yield
+
+  def read(self, index, offsets):
+    '''Load record ``index``, or return :any:`None` if the record is unavailable or corrupt.'''
+
+    if index >= len(offsets):
+      return None
+    start = int(offsets[index-1]) if index else 0
+    self._records.seek(start)
+    header = self._records.read(self._header.size)
+    if len(header) != self._header.size:
+      return None
+    length, crc, nbuffers = self._header.unpack(header)
+    if start + self._header.size + length != offsets[index]:
+      return None
+    payload = bytearray(length)
+    if self._records.readinto(payload) != length or zlib.crc32(payload) != crc:
+      return None
+    view = memoryview(payload)
+    chunks = []
+    for i in range(nbuffers + 1):
+      size, = self._size.unpack_from(view)
+      chunks.append(view[self._size.size:self._size.size+size])
+      view = view[self._size.size+size:]
+    data, *buffers = chunks
+    return pickle.loads(data, buffers=buffers) if buffers else pickle.loads(data)
+
+  def write(self, index, obj):
+    '''Store ``obj`` as record ``index``, discarding all records from ``index`` onward.'''
+
+    buffers = []
+    if pickle.HIGHEST_PROTOCOL >= 5:
+      data = pickle.dumps(obj, protocol=5, buffer_callback=lambda buffer: buffers.append(buffer.raw()))
+    else:
+      data = pickle.dumps(obj)
+    chunks = [data, *buffers]
+    length = sum(self._size.size + len(chunk) for chunk in chunks)
+    crc = 0
+    for chunk in chunks:
+      crc = zlib.crc32(chunk, zlib.crc32(self._size.pack(len(chunk)), crc))
+    if index:
+      self._index.seek((index-1) * self._size.size)
+      start, = self._size.unpack(self._index.read(self._size.size))
+    else:
+      start = 0
+    # Discard the index entries before the records they refer to, such that
+    # readers never see an entry of an incomplete record.
+    if self._index.seek(0, io.SEEK_END) > index * self._size.size:
+      self._index.truncate(index * self._size.size)
+    if self._records.seek(0, io.SEEK_END) > start:
+      self._records.truncate(start)
+    self._records.seek(start)
+    self._records.write(self._header.pack(length, crc, len(buffers)))
+    for chunk in chunks:
+      self._records.write(self._size.pack(len(chunk)))
+      self._records.write(chunk)
+    self._records.flush()
+    self._index.seek(index * self._size.size)
+    self._index.write(self._size.pack(self._records.tell()))
+    self._index.flush()
+
 class _RecursionMeta(types.ImmutableMeta):
 
   def __new__(mcls, name, bases, namespace, *, length=None, **kwargs):
@@ -332,61 +484,74 @@ class Recursion(types.Immutable, metaclass=_RecursionMeta):
     else:
       # The hash of `types.Immutable` uniquely defines this `Recursion`, so use
       # this to identify the cache directory.  All iterations are stored as
-      # separate files, numbered '0000', '0001', ..., in this directory.
+      # records of a single append-only log in this directory.
       hkey = self.__nutils_hash__.hex()
-      cachepath = _cache.value / hkey
-      cachepath.mkdir(exist_ok=True, parents=True)
       log.debug('[cache.Recursion {}] start iterating'.format(hkey))
       # The `history` variable is updated while reading from the cache and
       # truncated to the required length.
       history = []
-      # The `exhausted` variable controls if we are reading items from the
-      # cache (`False`) or we are computing values and writing to the cache.
-      # Once `exhausted` is `True` we keep it there, even if at some point
-      # there are cached items available.
-      exhausted = False
-      # The `stop` variable indicates if an exception is raised in `resume`.
-      stop = False
-      for i in itertools.count():
-        cachefile = cachepath/'{:04d}'.format(i)
-        cachefile.touch()
-        with cachefile.open('r+b') as f:
+      # The `resume` variable is `None` while we are reading items from the
+      # cache, and holds the generator of the remaining items once we are
+      # computing values and writing to the cache.  Once the cache is
+      # exhausted we keep computing, even if at some point there are cached
+      # items available.
+      resume = None
+      with _AppendLog(_cache.value / hkey) as storage:
+        def lock(stack, i):
           log.debug('[cache.Recursion {}.{:04d}] acquiring lock'.format(hkey, i))
-          _lock_file(f)
+          stack.enter_context(storage.lock())
           log.debug('[cache.Recursion {}.{:04d}] lock acquired'.format(hkey, i))
-          if not exhausted:
-            try:
-              log_, stop, value = pickle.load(f)
-            except (pickle.UnpicklingError, IndexError):
-              log.debug('[cache.Recursion {}.{:04d}] failed to load, cache will be rewritten from this point'.format(hkey, i))
-              exhausted = True
-            except EOFError:
-              log.debug('[cache.Recursion {}.{:04d}] cache exhausted'.format(hkey, i))
-              exhausted = True
-            else:
-              log.debug('[cache.Recursion {}.{:04d}] load'.format(hkey, i))
-              log_.replay()
-              history.append(value)
-              if len(history) > length:
-                history = history[1:]
-            if exhausted:
-              resume = self.resume_index(history, i)
-              f.seek(0)
-              del history
-          if exhausted:
-            # Disable the cache temporarily to prevent caching subresults *in* `func`.
-            log_ = log.RecordLog()
-            with disable(), log.add(log_):
-              try:
-                value = next(resume)
-              except StopIteration:
-                stop = True
-                value = None
-            log.debug('[cache.Recursion {}.{}] store'.format(hkey, i))
-            pickle.dump((log_, stop, value), f)
-        if stop:
-          return
-        yield value
+        offsets = storage.offsets()
+        for i in itertools.count():
+          # Cached items are read without locking.  Past the end of the index,
+          # or if a record fails to load because a concurrent process is
+          # rewriting the log from this point, we acquire the lock, waiting for
+          # the other process to finish writing, and reread the index.
+          with contextlib.ExitStack() as stack:
+            locked = resume is not None or i >= len(offsets)
+            if locked:
+              lock(stack, i)
+            if resume is None:
+              if locked:
+                offsets = storage.offsets()
+              item = storage.read(i, offsets)
+              if item is None and not locked:
+                lock(stack, i)
+                locked = True
+                offsets = storage.offsets()
+                item = storage.read(i, offsets)
+              if item is not None:
+                log_, stop, value = item
+                log.debug('[cache.Recursion {}.{:04d}] load'.format(hkey, i))
+                _perf.count('cache.Recursion', 'hits')
+                log_.replay()
+                history.append(value)
+                if len(history) > length:
+                  history = history[1:]
+              else:
+                if i >= len(offsets):
+                  log.debug('[cache.Recursion {}.{:04d}] cache exhausted'.format(hkey, i))
+                else:
+                  log.debug('[cache.Recursion {}.{:04d}] failed to load, cache will be rewritten from this point'.format(hkey, i))
+                resume = self.resume_index(history, i)
+                del history
+            if resume is not None:
+              # Disable the cache temporarily to prevent caching subresults *in* `func`.
+              log_ = log.RecordLog()
+              with _cache.sets(None), log.add(log_):
+                try:
+                  value = next(resume)
+                except StopIteration:
+                  stop = True
+                  value = None
+                else:
+                  stop = False
+              log.debug('[cache.Recursion {}.{:04d}] store'.format(hkey, i))
+              _perf.count('cache.Recursion', 'misses')
+              storage.write(i, (log_, stop, value))
+          if stop:
+            return
+          yield value
 
   def resume_index(self, history, index):
     '''
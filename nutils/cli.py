@@ -25,7 +25,7 @@ python function based arguments specified on the command line.
 """
 
 from . import long_version, warnings
-import sys, inspect, os, time, signal, subprocess, contextlib, traceback, pathlib, html, functools, pdb, stringly, textwrap, typing, treelog, collections
+import sys, inspect, os, json, time, signal, subprocess, contextlib, traceback, pathlib, html, functools, itertools, pdb, stringly, textwrap, typing, treelog, collections
 
 try:
   Level = treelog.proto.Level
@@ -178,6 +178,53 @@ def _htmllog(outdir, scriptname, kwargs):
       '<li>{}={} <span style="color: gray;">{}</span></li>'.format(name, value, doc) for name, value, doc in kwargs)), level=Level.info, escape=False)
   return htmllog
 
+@contextlib.contextmanager
+def _perfreport(path, scriptname, kwargs):
+  from . import _perf
+  report = _perf.Report()
+  data = dict(nutils=_version(), script=scriptname, arguments={name: value for name, value, doc in kwargs}, start=time.time())
+  try:
+    with _perf.active(report):
+      yield
+  except SystemExit as e:
+    data['status'] = 'success' if not e.code else 'failed'
+    raise
+  except BaseException:
+    data['status'] = 'failed'
+    raise
+  else:
+    data['status'] = 'success'
+  finally:
+    data.update(report.asdict())
+    with open(path, 'w') as f:
+      json.dump(data, f, indent=2)
+
+def _userconfig():
+  setupargs = {}
+  home = os.path.expanduser('~')
+  for path in os.path.join(home, '.config', 'nutils', 'config'), os.path.join(home, '.nutilsrc'):
+    if os.path.isfile(path):
+      setupargs.update(_load_rcfile(path))
+  for key, typ in (('matrix', str),
+                   ('nprocs', int),
+                   ('startmethod', str),
+                   ('cachedir', str),
+                   ('cache', bool),
+                   ('cachegraphs', bool),
+                   ('hoistcache', int),
+                   ('outrootdir', str),
+                   ('outrooturi', str),
+                   ('outdir', str),
+                   ('outuri', str),
+                   ('verbose', int),
+                   ('pdb', bool),
+                   ('gracefulexit', bool),
+                   ('perfreport', str)):
+    val = os.environ.get('NUTILS_{}'.format(key.upper()))
+    if val:
+      setupargs[key] = stringly.loads(typ, val)
+  return setupargs
+
 def run(func, *, args=None, loaduserconfig=True):
   '''parse command line arguments and call function'''
 
@@ -244,24 +291,7 @@ def run(func, *, args=None, loaduserconfig=True):
   setupargs = {}
 
   if loaduserconfig:
-    home = os.path.expanduser('~')
-    for path in os.path.join(home, '.config', 'nutils', 'config'), os.path.join(home, '.nutilsrc'):
-      if os.path.isfile(path):
-        setupargs.update(_load_rcfile(path))
-    for key, typ in (('matrix', str),
-                     ('nprocs', int),
-                     ('cachedir', str),
-                     ('cache', bool),
-                     ('outrootdir', str),
-                     ('outrooturi', str),
-                     ('outdir', str),
-                     ('outuri', str),
-                     ('verbose', int),
-                     ('pdb', bool),
-                     ('gracefulexit', bool)):
-      val = os.environ.get('NUTILS_{}'.format(key.upper()))
-      if val:
-        setupargs[key] = stringly.loads(typ, val)
+    setupargs.update(_userconfig())
 
   for name, s in strargs.items():
     if name not in types:
@@ -298,6 +328,116 @@ def choose(*functions, args=None, loaduserconfig=True):
 
   run(funcnames[funcname], args=args, loaduserconfig=loaduserconfig)
 
+def sweep(func, argsets, *, concurrency=1, scriptname=None, loaduserconfig=True, **setupargs):
+  '''call function for several sets of arguments and summarize the results
+
+  Every run is set up as by :func:`run`, with its own output directory and
+  html log in a numbered subdirectory of the output directory of the sweep.
+  All runs share the cache directory of the sweep, which is enabled by
+  default, such that later runs benefit from the cached functions and graphs
+  of earlier runs. The runs are distributed over ``concurrency`` forked
+  processes, in which case the return values of ``func`` should be picklable.
+  To avoid oversubscription, concurrent runs are limited to a single process
+  each unless ``nprocs`` is passed explicitly, overruling the user
+  configuration. A failing run is reported in the summary rather than
+  aborting the sweep.
+
+  Args
+  ----
+  func : callable
+      Function to be called.
+  argsets : :class:`dict` of sequences or sequence of :class:`dict`
+      Keyword arguments of all runs. A dictionary of sequences defines a grid,
+      for instance ``dict(nelems=[4,8], degree=[1,2])`` results in four runs.
+      Arguments that are not specified take their default value.
+  concurrency : :class:`int`
+      Maximum number of simultaneous runs.
+  scriptname : :class:`str` or :any:`None`
+      Name of the sweep, which defaults to the name of the running script.
+  loaduserconfig : :class:`bool`
+      Load configuration variables from the user configuration as in
+      :func:`run`, which are overruled by ``setupargs``.
+  **setupargs :
+      Configuration variables of :func:`setup`, such as ``outrootdir``,
+      ``cachedir`` or ``nprocs``, that apply to all runs.
+
+  Returns
+  -------
+  :class:`list`
+      Return values of ``func`` in order of ``argsets``, with :any:`None` for
+      failed runs.
+  '''
+
+  if isinstance(argsets, dict):
+    names = tuple(argsets)
+    argsets = [dict(zip(names, values)) for values in itertools.product(*argsets.values())]
+  else:
+    argsets = [dict(argset) for argset in argsets]
+
+  sig = inspect.signature(func)
+  argdocs = stringly.util.DocString(func).argdocs
+  runs = []
+  for argset in argsets:
+    try:
+      bound = sig.bind(**argset)
+    except TypeError as e:
+      raise ValueError('invalid arguments {}: {}'.format(argset, e)) from None
+    bound.apply_defaults()
+    kwargs = []
+    for param in sig.parameters.values():
+      value = bound.arguments[param.name]
+      typ = param.annotation if param.annotation is not param.empty and not isinstance(param.annotation, str) else type(value)
+      kwargs.append((param.name, stringly.dumps(typ, value), argdocs.get(param.name, param.annotation if isinstance(param.annotation, str) else None)))
+    runs.append((bound.arguments, kwargs))
+
+  if scriptname is None:
+    scriptname = os.path.basename(sys.argv[0])
+  config = dict(cache=True, cachegraphs=True)
+  if loaduserconfig:
+    config.update(_userconfig())
+  if concurrency > 1:
+    config['nprocs'] = 1
+  config.update(setupargs)
+  outdir = config.pop('outdir', None)
+  outuri = config.pop('outuri', None)
+  outrootdir = config.pop('outrootdir', '~/public_html')
+  outrooturi = config.pop('outrooturi', None)
+  if outdir is None:
+    outdir = os.path.join(os.path.expanduser(outrootdir), scriptname)
+    if outrooturi is None:
+      outrooturi = pathlib.Path(outrootdir).expanduser().resolve().as_uri()
+    outuri = outrooturi.rstrip('/') + '/' + scriptname
+  elif outuri is None:
+    outuri = pathlib.Path(outdir).resolve().as_uri()
+  # An absolute cachedir is not joined with the output directory of the run,
+  # which makes all runs share the cache directory of the sweep.
+  config['cachedir'] = os.path.abspath(os.path.join(outdir, config.get('cachedir', 'cache')))
+  config.update(gracefulexit=False, pdb=False, richoutput=False)
+  config.setdefault('verbose', 1) # report errors only
+  ndigits = len(str(len(runs)-1))
+
+  def _run(irun):
+    funcargs, kwargs = runs[irun]
+    name = 'run{:0{}d}'.format(irun, ndigits)
+    t0 = time.perf_counter()
+    try:
+      with setup(scriptname=scriptname+'/'+name, kwargs=kwargs, outdir=os.path.join(outdir, name), outuri=outuri+'/'+name, **config):
+        result = func(**funcargs)
+    except Exception as e:
+      return name, None, 'failed: {}'.format(e), time.perf_counter() - t0
+    return name, result, 'ok', time.perf_counter() - t0
+
+  from . import parallel as _parallel
+  with _parallel.maxprocs(concurrency):
+    summary = _parallel.map(_run, range(len(runs)), name='sweep')
+
+  rows = [['run', *sig.parameters, 'status', 'time', 'result']]
+  for (name, result, status, walltime), (funcargs, kwargs) in zip(summary, runs):
+    rows.append([name, *[value for name, value, doc in kwargs], status, '{:.1f}s'.format(walltime), '' if result is None else str(result)])
+  widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+  print('\n'.join('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows))
+  return [result for name, result, status, walltime in summary]
+
 @contextlib.contextmanager
 def setup(scriptname: str,
           kwargs: typing.List[typing.Tuple[str,str,str]],
@@ -305,7 +445,10 @@ def setup(scriptname: str,
           outdir: typing.Optional[str] = None,
           cachedir: str = 'cache',
           cache: bool = False,
+          cachegraphs: bool = False,
+          hoistcache: int = 0,
           nprocs: int = 1,
+          startmethod: str = 'fork',
           matrix: str = 'auto',
           richoutput: typing.Optional[bool] = None,
           outrooturi: typing.Optional[str] = None,
@@ -313,10 +456,19 @@ def setup(scriptname: str,
           verbose: typing.Optional[int] = 4,
           pdb: bool = False,
           gracefulexit: bool = True,
+          perfreport: typing.Optional[str] = None,
           **unused):
-  '''Set up compute environment.'''
+  '''Set up compute environment.
+
+  Option ``hoistcache`` sets the budget in megabytes for the values that
+  element loops hoist out of their body, see :func:`nutils.evaluable.hoisting`.
+  This memory is held for the duration of the run on top of the memory of the
+  computation itself, in exchange for faster repeated evaluations of the same
+  integrals with different arguments, such as in Newton iterations or time
+  steps. Parallel loops, with ``nprocs`` larger than one, do not hoist.
+  '''
 
-  from . import cache as _cache, parallel as _parallel, matrix as _matrix
+  from . import cache as _cache, parallel as _parallel, matrix as _matrix, evaluable as _evaluable
 
   for name in unused:
     warnings.warn('ignoring unused configuration variable {!r}'.format(name))
@@ -343,10 +495,14 @@ def setup(scriptname: str,
   with htmllog, \
        _status(outuri+'/'+htmllog.filename, richoutput), \
        treelog.set(treelog.TeeLog(consolellog, htmllog)), \
+       _perfreport(perfreport, scriptname, kwargs) if perfreport else contextlib.ExitStack(), \
        _traceback(richoutput=richoutput, postmortem=pdb, exit=gracefulexit), \
        warnings.via(treelog.warning), \
-       _cache.enable(os.path.join(outdir, cachedir)) if cache else _cache.disable(), \
+       _cache.enable(os.path.join(outdir, cachedir), graphs=cachegraphs) if cache else _cache.disable(), \
+       _evaluable.hoisting(hoistcache << 20), \
        _parallel.maxprocs(nprocs), \
+       _parallel.startmethod(startmethod), \
+       _parallel.pool(), \
        _matrix.backend(matrix), \
        _signal_handler(signal.SIGINT, functools.partial(_breakpoint, richoutput)):
 
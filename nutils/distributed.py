@@ -0,0 +1,482 @@
+# Copyright (c) 2014 Evalf
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+The distributed module provides tools for distributed-memory computing, in
+which several processes (ranks) run the same script and each rank assembles
+the contributions of its own part of the topology. The ranks communicate via a
+:class:`Transport`, of which :class:`PipeTransport` is a local implementation
+that is created by :func:`local` by forking the current process. Other
+transports, e.g. based on MPI, can be plugged in by deriving from
+:class:`Transport` and implementing :meth:`Transport.send` and
+:meth:`Transport.recv`.
+
+A typical distributed script partitions the topology, assembles the local
+integrals and solves the resulting row-distributed system::
+
+    with distributed.local(4) as transport:
+      part = distributed.partition(transport, topo)
+      bpart = distributed.partition(transport, topo.boundary)
+      res = part.integral('basis_n,i u_,i d:x' @ ns, degree=2) - bpart.integral('basis_n d:x' @ ns, degree=2)
+      jac, rhs = distributed.assemble(transport, res.derivative('lhs'), -res, lhs=numpy.zeros(len(ns.basis)))
+      lhs = jac.solve(rhs, constrain=cons, atol=1e-10)
+
+Scalars and vectors are summed over all ranks and returned in full on every
+rank. Matrices are returned as a :class:`DistributedMatrix` of which every
+rank holds a contiguous range of rows.
+"""
+
+from . import parallel, sample, sparse, matrix
+import os, signal, contextlib, collections, multiprocessing, builtins, numpy, treelog
+
+class Transport:
+  '''Communication between the ranks of a distributed computation.
+
+  Derived classes implement the point to point methods :meth:`send` and
+  :meth:`recv`. The collective operations are built on top of these by routing
+  all data via rank 0, and must be called by all ranks in the same order.
+
+  Args
+  ----
+  rank : :class:`int`
+      Index of this process.
+  size : :class:`int`
+      Total number of processes.
+  '''
+
+  def __init__(self, rank, size):
+    assert 0 <= rank < size
+    self.rank = rank
+    self.size = size
+
+  def send(self, dest, obj):
+    '''Send a picklable object to rank ``dest``.'''
+
+    raise NotImplementedError
+
+  def recv(self, source):
+    '''Receive an object from rank ``source``.'''
+
+    raise NotImplementedError
+
+  def close(self):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def gather(self, obj, root=0):
+    '''Collect an object of every rank in a list on rank ``root``.
+
+    Returns the list of objects in rank order on ``root`` and :any:`None` on
+    all other ranks.'''
+
+    if self.rank != root:
+      self.send(root, obj)
+      return None
+    return [obj if source == root else self.recv(source) for source in range(self.size)]
+
+  def bcast(self, obj, root=0):
+    '''Return the object of rank ``root`` on all ranks.'''
+
+    if self.rank != root:
+      return self.recv(root)
+    for dest in range(self.size):
+      if dest != root:
+        self.send(dest, obj)
+    return obj
+
+  def allgather(self, obj):
+    '''Return the list of the objects of all ranks on all ranks.'''
+
+    return self.bcast(self.gather(obj))
+
+  def allreduce(self, array):
+    '''Return the sum of an array or scalar over all ranks on all ranks.
+
+    The summation happens in rank order on rank 0, such that the result is
+    identical on all ranks.'''
+
+    arrays = self.gather(array)
+    return self.bcast(None if arrays is None else builtins.sum(arrays[1:], arrays[0]))
+
+  def alltoall(self, objs):
+    '''Send ``objs[dest]`` to every rank ``dest``.
+
+    Returns the list of objects that are received from all ranks, in rank
+    order, including ``objs[rank]`` of this rank.'''
+
+    assert len(objs) == self.size
+    received = list(objs)
+    # Pairs of ranks exchange their data in lexicographical order, the lower
+    # rank sending first, such that blocking sends cannot deadlock.
+    for peer in range(self.size):
+      if peer < self.rank:
+        received[peer] = self.recv(peer)
+        self.send(peer, objs[peer])
+      elif peer > self.rank:
+        self.send(peer, objs[peer])
+        received[peer] = self.recv(peer)
+    return received
+
+  def barrier(self):
+    '''Wait until all ranks reach the barrier.'''
+
+    self.allgather(None)
+
+class PipeTransport(Transport):
+  '''Transport over :func:`multiprocessing.Pipe` connections.
+
+  On Unix the pipes are socket pairs that connect processes on the same
+  machine; see :func:`local`.
+
+  Args
+  ----
+  rank : :class:`int`
+      Index of this process.
+  size : :class:`int`
+      Total number of processes.
+  connections : :class:`dict`
+      Connection to every other rank, by rank.
+  '''
+
+  def __init__(self, rank, size, connections):
+    assert len(connections) == size - 1 and rank not in connections
+    self._connections = connections
+    super().__init__(rank, size)
+
+  def send(self, dest, obj):
+    self._connections[dest].send(obj)
+
+  def recv(self, source):
+    return self._connections[source].recv()
+
+  def close(self):
+    for connection in self._connections.values():
+      connection.close()
+
+@contextlib.contextmanager
+def local(nprocs):
+  '''continue as ``nprocs`` ranks of a distributed computation on this machine
+
+  The current process is forked ``nprocs-1`` times, after which every process
+  continues with its own :class:`PipeTransport`, whereby rank 0 is the original
+  process. Contrary to :func:`nutils.parallel.fork` the number of processes is
+  not capped by :func:`nutils.parallel.maxprocs`, and within the block the
+  ranks themselves evaluate serially. Upon leaving the block the child
+  processes exit and the main process waits for them to finish. An exception
+  in any rank causes all ranks to fail.
+
+  Args
+  ----
+  nprocs : :class:`int`
+      Number of ranks.
+
+  Yields
+  ------
+  :class:`PipeTransport`
+  '''
+
+  if nprocs < 1:
+    raise ValueError('nprocs should be positive')
+  if nprocs > 1 and not hasattr(os, 'fork'):
+    raise NotImplementedError('distributed.local requires fork, which is unavailable on this platform')
+  pipes = {(i, j): multiprocessing.Pipe() for i in range(nprocs) for j in range(i+1, nprocs)}
+  amchild = False
+  child_pids = []
+  try:
+    for rank in range(1, nprocs):
+      pid = os.fork()
+      if not pid: # pragma: no cover
+        amchild = True
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # disable sigint (ctrl+c) handler
+        treelog.current = treelog.NullLog() # silence treelog
+        break
+      child_pids.append(pid)
+    else:
+      rank = 0
+    # Close the connections of the other ranks, such that a failing rank
+    # results in an EOFError in its peers rather than a deadlock.
+    connections = {}
+    for (i, j), (conn_i, conn_j) in pipes.items():
+      if i == rank:
+        connections[j] = conn_i
+        conn_j.close()
+      elif j == rank:
+        connections[i] = conn_j
+        conn_i.close()
+      else:
+        conn_i.close()
+        conn_j.close()
+    with PipeTransport(rank, nprocs, connections) as transport, parallel.maxprocs(1):
+      yield transport
+  except BaseException as e:
+    if amchild: # pragma: no cover
+      try:
+        print('[distributed.local] exception in rank {}: {}'.format(rank, e))
+      finally:
+        os._exit(1) # communicate failure to main process
+    for pid in child_pids: # kill all child processes
+      os.kill(pid, signal.SIGKILL)
+      os.waitpid(pid, 0)
+    raise
+  else:
+    if amchild: # pragma: no cover
+      os._exit(0) # communicate success to main process
+    with treelog.context('waiting for child processes'):
+      nfails = builtins.sum(not parallel._wait(pid) for pid in child_pids)
+    if nfails: # failure in child process: raise exception
+      raise Exception('distributed computation failed in {} out of {} ranks'.format(nfails, nprocs))
+  finally:
+    if amchild: # pragma: no cover
+      os._exit(1) # failsafe
+
+def _bounds(n, size):
+  return numpy.arange(size+1) * n // size
+
+def partition(transport, topo, ranks=None):
+  '''Select the elements of a topology that belong to this rank.
+
+  Args
+  ----
+  transport : :class:`Transport`
+  topo : :class:`nutils.topology.Topology`
+      Topology to partition.
+  ranks : :class:`int` array or :any:`None`
+      Rank of every element of ``topo``, for instance the result of a graph
+      partitioner. A :any:`None` value implies that the elements are divided
+      over the ranks in contiguous ranges of (near) equal length.
+
+  Returns
+  -------
+  :class:`nutils.topology.Topology`
+      The elements of ``topo`` that belong to this rank.
+  '''
+
+  if ranks is None:
+    bounds = _bounds(len(topo), transport.size)
+    elements = numpy.arange(bounds[transport.rank], bounds[transport.rank+1])
+  else:
+    ranks = numpy.asarray(ranks)
+    if ranks.shape != (len(topo),):
+      raise ValueError('expected one rank per element')
+    elements, = numpy.equal(ranks, transport.rank).nonzero()
+  return topo[elements]
+
+def assemble(transport, *integrals, **arguments):
+  '''Evaluate integrals over the local partition and reduce them over all ranks.
+
+  Every rank evaluates the integrals of its own partition using
+  :func:`nutils.sample.eval_integrals_sparse`, after which scalar and vector
+  integrals are summed over all ranks and matrix integrals are redistributed
+  into a :class:`DistributedMatrix`.
+
+  Args
+  ----
+  transport : :class:`Transport`
+  integrals : :class:`nutils.function.Array`
+      Integrals over the partitions of this rank, see :func:`partition`.
+  arguments : :class:`dict`
+      Optional arguments for function evaluation.
+
+  Returns
+  -------
+  results : :class:`tuple` of arrays and/or :class:`DistributedMatrix` objects.
+  '''
+
+  results = []
+  for data in sample.eval_integrals_sparse(*integrals, **arguments):
+    ndim = sparse.ndim(data)
+    if ndim < 2:
+      results.append(transport.allreduce(sparse.toarray(data)))
+    elif ndim == 2:
+      results.append(DistributedMatrix.fromsparse(transport, data))
+    else:
+      raise NotImplementedError('distributed assembly of {}d integrals'.format(ndim))
+  return tuple(results)
+
+class DistributedMatrix:
+  '''Matrix that is distributed over the ranks by contiguous ranges of rows.
+
+  Every rank holds its rows as a :class:`nutils.matrix.Matrix` of the active
+  matrix backend, with all columns. Vectors that are passed to and returned by
+  the methods of this class are full vectors, which are identical on all
+  ranks.
+
+  Args
+  ----
+  transport : :class:`Transport`
+  local : :class:`nutils.matrix.Matrix`
+      Rows of this rank.
+  rowbounds : :class:`int` array
+      Row offsets of all ranks, of length ``transport.size+1``.
+  diagonal : :class:`float` array
+      Diagonal entries of the rows of this rank.
+  '''
+
+  def __init__(self, transport, local, rowbounds, diagonal):
+    assert len(rowbounds) == transport.size + 1
+    assert local.shape[0] == len(diagonal) == rowbounds[transport.rank+1] - rowbounds[transport.rank]
+    self._transport = transport
+    self._local = local
+    self._rowbounds = rowbounds
+    self._diagonal = diagonal
+    self.shape = int(rowbounds[-1]), local.shape[1]
+
+  @classmethod
+  def fromsparse(cls, transport, data):
+    '''Create distributed matrix from the sparse contributions of all ranks.
+
+    Every rank sends its entries to the rank that owns the row, where
+    duplicate entries are summed.'''
+
+    (rowindices, colindices), values, (nrows, ncols) = sparse.extract(data)
+    rowbounds = _bounds(nrows, transport.size)
+    owners = numpy.searchsorted(rowbounds, rowindices, side='right') - 1
+    received = transport.alltoall([(rowindices[select], colindices[select], values[select]) for select in map(owners.__eq__, range(transport.size))])
+    rows, cols, values = [numpy.concatenate(items) for items in zip(*received)]
+    offset = rowbounds[transport.rank]
+    nlocal = rowbounds[transport.rank+1] - offset
+    rows = rows - offset
+    isdiag = rows + offset == cols
+    diagonal = numpy.bincount(rows[isdiag], weights=values[isdiag], minlength=nlocal)
+    local = numpy.empty(len(values), dtype=sparse.dtype((nlocal, ncols), values.dtype))
+    local['index']['i0'] = rows
+    local['index']['i1'] = cols
+    local['value'] = values
+    return cls(transport, matrix.fromsparse(local, inplace=True), rowbounds, diagonal)
+
+  @property
+  def rows(self):
+    '''Slice of the rows that belong to this rank.'''
+
+    return slice(self._rowbounds[self._transport.rank], self._rowbounds[self._transport.rank+1])
+
+  def __matmul__(self, other):
+    if not isinstance(other, numpy.ndarray) or other.shape != self.shape[1:]:
+      return NotImplemented
+    return numpy.concatenate(self._transport.allgather(self._local @ other))
+
+  def export(self, form):
+    '''Export matrix data to the full matrix on all ranks.
+
+    Args
+    ----
+    form : :class:`str`
+      - "dense" : return matrix as a single dense array
+    '''
+
+    if form != 'dense':
+      raise NotImplementedError('cannot export {} to {!r}'.format(self.__class__.__name__, form))
+    return numpy.concatenate(self._transport.allgather(self._local.export('dense')), axis=0)
+
+  def solve(self, rhs=None, *, lhs0=None, constrain=None, atol=0., rtol=0., truncate=None):
+    '''Solve system given right hand side vector and/or constraints.
+
+    The system is solved by a distributed Krylov method that mirrors the
+    'arnoldi' solver of :meth:`nutils.matrix.Matrix.solve`, with a diagonal
+    preconditioner. Every rank works on the vector entries of its own rows;
+    the inner products are summed over all ranks.
+
+    Args
+    ----
+    rhs : :class:`float` vector or :any:`None`
+        Right hand side vector. A :any:`None` value implies the zero vector.
+    lhs0 : class:`float` vector or :any:`None`
+        Initial values: compute the solution by solving ``A dx = b - A lhs0``.
+        A :any:`None` value implies the zero vector.
+    constrain : :class:`float` or :class:`bool` array, or :any:`None`
+        Constraints, see :meth:`nutils.matrix.Matrix.solve`.
+    rtol : :class:`float`
+        Relative tolerance: see ``atol``.
+    atol : :class:`float`
+        Absolute tolerance: require that ``|A x - b| <= max(atol, rtol |b|)``
+        after applying constraints and the initial value. In case ``atol`` and
+        ``rtol`` are both zero (the defaults) solve to machine precision.
+        Otherwise fail with :class:`nutils.matrix.ToleranceNotReached` if the
+        requirement is not reached.
+    truncate : :class:`int` or :any:`None`
+        Maximum number of Krylov vectors to retain. A :any:`None` value
+        implies no limit.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Left hand side vector, identical on all ranks.
+    '''
+
+    nrows, ncols = self.shape
+    if nrows != ncols:
+      raise matrix.MatrixError('distributed matrix is not square: {}x{}'.format(nrows, ncols))
+    rhs = numpy.zeros(nrows) if rhs is None else numpy.asarray(rhs, dtype=float)
+    lhs0 = numpy.zeros(nrows) if lhs0 is None else numpy.array(lhs0, dtype=float)
+    if rhs.shape != (nrows,) or lhs0.shape != (nrows,):
+      raise matrix.MatrixError('vector shapes do not match matrix shape')
+    if constrain is None:
+      free = numpy.ones(nrows, dtype=bool)
+    elif numpy.asarray(constrain).dtype == bool:
+      free = ~numpy.asarray(constrain)
+    else:
+      free = numpy.isnan(constrain)
+      lhs0[~free] = numpy.asarray(constrain)[~free]
+    free = free[self.rows]
+    precon = numpy.divide(1, self._diagonal, out=numpy.ones(len(free)), where=self._diagonal != 0)
+    precon[~free] = 0
+    dot = lambda a, b: self._transport.allreduce(numpy.dot(a, b))
+    matvec = lambda x: numpy.where(free, self._local @ numpy.concatenate(self._transport.allgather(x)), 0)
+    res0 = numpy.where(free, rhs[self.rows] - self._local @ lhs0, 0)
+    resnorm = numpy.sqrt(dot(res0, res0))
+    atol = max(atol, rtol * resnorm)
+    if resnorm <= atol:
+      treelog.info('skipping solver because initial vector is within tolerance')
+      return lhs0
+    treelog.info('solving {} dof system on {} ranks to {}'.format(nrows, self._transport.size, 'tolerance {:.0e}'.format(atol) if atol else 'machine precision'))
+    dx = numpy.zeros_like(res0)
+    res = res0
+    krylov = collections.deque(maxlen=truncate)
+    while resnorm > atol:
+      k = res * precon
+      v = matvec(k)
+      if krylov: # orthogonalize v (classical Gram-Schmidt, to sum the inner products in a single reduction)
+        ks, vs, v2s = zip(*krylov)
+        c = self._transport.allreduce(numpy.array([numpy.dot(v, v_) for v_ in vs])) / v2s
+        k -= numpy.dot(c, ks)
+        v -= numpy.dot(c, vs)
+      v2, vres = self._transport.allreduce(numpy.array([numpy.dot(v, v), numpy.dot(v, res)]))
+      newdx = dx + k * (vres / v2)
+      newres = res0 - matvec(newdx) # recompute rather than update to avoid drift
+      newresnorm = numpy.sqrt(dot(newres, newres))
+      if not numpy.isfinite(newresnorm) or newresnorm >= resnorm:
+        break
+      treelog.debug('residual decreased by {:.1f} orders using {} krylov vectors'.format(numpy.log10(resnorm/newresnorm), len(krylov)))
+      dx = newdx
+      res = newres
+      resnorm = newresnorm
+      krylov.append((k, v, v2))
+    lhs = lhs0 + numpy.concatenate(self._transport.allgather(dx))
+    treelog.info('solver returned with residual {:.0e}'.format(resnorm))
+    if resnorm > atol > 0:
+      raise matrix.ToleranceNotReached(lhs)
+    return lhs
+
+# vim:sw=2:sts=2:et
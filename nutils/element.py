@@ -29,7 +29,7 @@ system, and provide pointsets for purposes of integration and sampling.
 """
 
 from . import util, numeric, cache, transform, warnings, types, points
-import numpy, re, math, itertools, operator, functools
+import numpy, re, math, itertools, operator, functools, collections
 _ = numpy.newaxis
 
 
@@ -180,7 +180,10 @@ class Reference(types.Singleton):
     assert len(levels) == self.nvertices_by_level(maxrefine)
     return self if not self or numpy.greater_equal(levels, 0).all() \
       else self.empty if numpy.less_equal(levels, 0).all() \
-      else self.with_children(cref.trim(clevels, maxrefine-1, ndivisions)
+      else trimcache(self, levels, maxrefine, ndivisions)
+
+  def _trim(self, levels, maxrefine, ndivisions):
+    return self.with_children(cref.trim(clevels, maxrefine-1, ndivisions)
             for cref, clevels in zip(self.child_refs, self.child_divide(levels,maxrefine))) if maxrefine > 0 \
       else self.slice(lambda vertices: numeric.dot(numeric.poly_eval(self._linear_bernstein, vertices), levels), ndivisions)
 
@@ -1137,6 +1140,65 @@ class MosaicReference(Reference):
     return self.baseref.get_edge_dofs(degree, iedge)
 
 
+## TRIM CACHE
+
+class TrimCache:
+  '''Bounded least-recently-used cache of trimmed references.
+
+  Trimming is invariant to positive scaling of the levels, so results are
+  stored by reference, ``maxrefine``, ``ndivisions`` and the levels divided by
+  their largest absolute value. Elements with the same cut topology thus share
+  a single trimmed reference, and with it its cached quadrature points. The
+  module level instance :data:`trimcache` is used by :meth:`Reference.trim`.
+
+  Parameters
+  ----------
+  maxsize : :class:`int`
+      Maximum number of cached references. A value of zero disables caching.
+  '''
+
+  def __init__(self, maxsize):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._items = collections.OrderedDict()
+
+  def __len__(self):
+    return len(self._items)
+
+  def __call__(self, ref, levels, maxrefine, ndivisions):
+    levels = numpy.divide(levels, numpy.abs(levels).max())
+    key = ref, maxrefine, ndivisions, levels.tobytes()
+    try:
+      trimmed = self._items[key]
+    except KeyError:
+      self.misses += 1
+      trimmed = ref._trim(levels, maxrefine, ndivisions)
+      if self.maxsize > 0:
+        self._items[key] = trimmed
+        while len(self._items) > self.maxsize:
+          self._items.popitem(last=False)
+    else:
+      self.hits += 1
+      self._items.move_to_end(key)
+    return trimmed
+
+  def clear(self):
+    'remove all cached references and reset the statistics'
+
+    self._items.clear()
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def stats(self):
+    count = self.hits + self.misses
+    return 'not used' if not count \
+      else 'effectivity {:.0f}% (hit {}/{} calls, {} cached)'.format(100*self.hits/count, self.hits, count, len(self._items))
+
+trimcache = TrimCache(maxsize=4096)
+
+
 ## UTILITY FUNCTIONS
 
 def parse_legacy_ischeme(ischeme):
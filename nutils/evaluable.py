@@ -50,7 +50,7 @@ else:
 
 from . import util, types, numeric, cache, transform, expression, warnings, parallel, sparse
 from ._graph import Node, RegularNode, DuplicatedLeafNode, InvisibleNode, Subgraph
-import numpy, sys, itertools, functools, operator, inspect, numbers, builtins, re, types as builtin_types, abc, collections.abc, math, treelog as log, weakref, time, contextlib, subprocess
+import numpy, sys, itertools, functools, operator, inspect, numbers, builtins, re, types as builtin_types, abc, collections.abc, math, treelog as log, weakref, time, contextlib, subprocess, os, json
 _ = numpy.newaxis
 
 isevaluable = lambda arg: isinstance(arg, Evaluable)
@@ -230,6 +230,31 @@ def replace(func=None, depthfirst=False, recursive=False, lru=4):
 
   return wrapped
 
+_rewrites = util.settable() # counter of fired rewrite rules, see `count_rewrites`
+
+@contextlib.contextmanager
+def count_rewrites():
+  '''count rewrite rules fired by simplification and optimization
+
+  Context manager that yields a :class:`collections.Counter`, which is updated
+  with the name of the rule, e.g. ``'Multiply._simplified'``, every time
+  :attr:`Evaluable.simplified` or :attr:`Evaluable.optimized_for_numpy`
+  replaces an object. Since both properties are memoized, only rewrites that
+  are computed inside the context are counted.'''
+
+  counter = collections.Counter()
+  with _rewrites.sets(counter):
+    yield counter
+
+def _rewrite(obj, rule):
+  retval = getattr(obj, rule)()
+  if retval is not None:
+    if isinstance(obj, Array):
+      assert isinstance(retval, Array) and retval.shape == obj.shape, '{}.{} resulted in shape change'.format(type(obj).__name__, rule)
+    if _rewrites.value is not None:
+      _rewrites.value[type(obj).__name__ + '.' + rule] += 1
+  return retval
+
 class Evaluable(types.Singleton):
   'Base class'
 
@@ -245,12 +270,35 @@ class Evaluable(types.Singleton):
     raise NotImplementedError('Evaluable derivatives should implement the evalf method')
 
   def evalf_withtimes(self, times, *args):
-    with times[self]:
-      return self.evalf(*args)
+    with times[self], _traced(type(self).__name__) as details:
+      retval = self.evalf(*args)
+      details.update(_array_details(retval))
+    return retval
+
+  def _cache_dependencies(self, attr):
+    '''populate cached property ``attr`` of all (indirect) function arguments
+
+    Cached graph properties such as :attr:`dependencies` are defined in terms
+    of the same property of the function arguments, which for deep graphs
+    recurses beyond Python's recursion limit. This method visits the
+    dependencies using an explicit stack and evaluates ``attr`` in post-order,
+    such that every evaluation finds the values of its arguments in cache.'''
+
+    stack = [(arg, False) for arg in self.__args]
+    visited = set()
+    while stack:
+      obj, ready = stack.pop()
+      if ready:
+        getattr(obj, attr)
+      elif obj not in visited and not types.iscached(obj, attr):
+        visited.add(obj)
+        stack.append((obj, True))
+        stack.extend((arg, False) for arg in obj.__args)
 
   @property
   def dependencies(self):
     '''collection of all function arguments'''
+    self._cache_dependencies('dependencies')
     deps = {}
     for func in self.__args:
       funcdeps = func.dependencies
@@ -261,6 +309,7 @@ class Evaluable(types.Singleton):
   @property
   def arguments(self):
     'a frozenset of all arguments of this evaluable'
+    self._cache_dependencies('arguments')
     return frozenset().union(*(child.arguments for child in self.__args))
 
   @property
@@ -310,6 +359,8 @@ class Evaluable(types.Singleton):
   def eval(self, **evalargs):
     '''Evaluate function on a specified element, point set.'''
 
+    if _trace.value is not None:
+      return self.eval_withtimes(collections.defaultdict(_Stats), **evalargs)
     values = [evalargs]
     try:
       values.extend(op.evalf(*[values[i] for i in indices]) for op, indices in self.serialized)
@@ -333,14 +384,52 @@ class Evaluable(types.Singleton):
     else:
       return values[-1]
 
+  def eval_batched(self, batchargs, **evalargs):
+    '''Evaluate function for a batch of arguments.
+
+    The arguments in ``batchargs`` are stacked along a leading batch axis;
+    arguments in ``evalargs`` are shared by all members of the batch. Every
+    part of the function that does not depend on a batched argument is
+    evaluated only once, including the parts of the bodies of loops, such that
+    a loop over elements is traversed a single time for the entire batch.
+    Pointwise operations, additions, multiplications and powers of batched
+    values are evaluated at once, with a leading batch axis; all other
+    operations are evaluated for every member of the batch separately.
+
+    Returns a list with the value of the function for every member of the
+    batch.
+    '''
+
+    lengths = {len(value) for value in batchargs.values()}
+    if len(lengths) != 1:
+      raise ValueError('expected one or more batched arguments of equal length')
+    nbatch, = lengths
+    values = [evalargs]
+    try:
+      for op, indices in self.serialized:
+        if isinstance(op, Argument) and op._name in batchargs:
+          values.append(_Batch(op.evalf({op._name: value}) for value in batchargs[op._name]))
+        else:
+          values.append(_evalf_batched(op, [values[i] for i in indices], nbatch))
+    except KeyboardInterrupt:
+      raise
+    except Exception as e:
+      raise EvaluationError(self, values) from e
+    retval = values[-1]
+    return list(retval) if isinstance(retval, _Batch) else [retval] * nbatch
+
   @contextlib.contextmanager
   def session(self, graphviz):
-    if graphviz is None:
+    if graphviz is None and _trace.value is None:
       yield self.eval
       return
     stats = collections.defaultdict(_Stats)
     def eval(**args):
-      return self.eval_withtimes(stats, **args)
+      with _traced('eval'):
+        return self.eval_withtimes(stats, **args)
+    if graphviz is None:
+      yield eval
+      return
     with log.context('eval'):
       yield eval
       node = self._node({}, None, stats)
@@ -373,10 +462,7 @@ class Evaluable(types.Singleton):
   @replace(depthfirst=True, recursive=True)
   def simplified(obj):
     if isinstance(obj, Evaluable):
-      retval = obj._simplified()
-      if retval is not None and isinstance(obj, Array):
-        assert isinstance(retval, Array) and retval.shape == obj.shape, '{}._simplified resulted in shape change'.format(type(obj).__name__)
-      return retval
+      return _rewrite(obj, '_simplified')
 
   def _simplified(self):
     return
@@ -384,22 +470,20 @@ class Evaluable(types.Singleton):
   @property
   def optimized_for_numpy(self):
     retval = self._optimized_for_numpy1() or self
-    return retval._combine_loop_concatenates(frozenset())
+    return retval._combine_loop_concatenates(frozenset())._merge_loop_concatenates()
 
   @types.apply_annotations
   @replace(depthfirst=True, recursive=True)
   def _optimized_for_numpy1(obj: simplified.fget):
     if isinstance(obj, Evaluable):
-      retval = obj._simplified() or obj._optimized_for_numpy()
-      if retval is not None and isinstance(obj, Array):
-        assert isinstance(retval, Array) and retval.shape == obj.shape, '{0}._optimized_for_numpy or {0}._simplified resulted in shape change'.format(type(obj).__name__)
-      return retval
+      return _rewrite(obj, '_simplified') or _rewrite(obj, '_optimized_for_numpy')
 
   def _optimized_for_numpy(self):
     return
 
   @property
   def _loop_concatenate_deps(self):
+    self._cache_dependencies('_loop_concatenate_deps')
     deps = []
     for arg in self.__args:
       deps += [dep for dep in arg._loop_concatenate_deps if dep not in deps]
@@ -444,6 +528,24 @@ class Evaluable(types.Singleton):
       else:
         return self
 
+  def _merge_loop_concatenates(self):
+    # Merge the loops that are mutually independent, such as the loops over
+    # the different samples of a set of integrals, into a single parallel
+    # region.
+    loops = [dep for dep in self.dependencies if isinstance(dep, LoopConcatenateCombined)]
+    dependent = set()
+    for loop in loops:
+      deps = [other for other in loops if other in loop.dependencies]
+      if deps:
+        dependent.add(loop)
+        dependent.update(deps)
+    loops = [loop for loop in loops if loop not in dependent]
+    if len(loops) < 2:
+      return self
+    merged = LoopConcatenateMerged(loops)
+    offsets = dict(zip(loops, numpy.cumsum([0, *(len(loop._funcs) for loop in loops)])))
+    return replace(lambda key: ArrayFromTuple(merged, int(offsets[key.arrays]) + key.index, key.shape, key.dtype) if isinstance(key, ArrayFromTuple) and key.arrays in offsets else None, recursive=False, depthfirst=False)(self)
+
 class EvaluationError(Exception):
   def __init__(self, f, values):
     super().__init__('evaluation failed in step {}/{}\n'.format(len(values), len(f.dependencies)) + '\n'.join(f._stack(values)))
@@ -1033,6 +1135,14 @@ class Normal(Array):
     self.lgrad = lgrad
     super().__init__(args=[lgrad], shape=lgrad.shape[:-1], dtype=float)
 
+  def _simplified(self):
+    # Hoist the normal out of any axis along which the local gradient is
+    # invariant, such as the points axis of an affine geometry, so that the
+    # orthonormalization is performed once rather than for every point.
+    for axis, parg in enumerate(self.lgrad._axes[:-2]):
+      if isinstance(parg, Inserted):
+        return insertaxis(Normal(self.lgrad._uninsert(axis)), axis, parg.length)
+
   def evalf(self, lgrad):
     n = lgrad[...,-1]
     if n.shape[-1] == 1: # geom is 1D
@@ -1484,7 +1594,12 @@ class Inverse(Array):
     super().__init__(args=[func], shape=func.shape, dtype=float)
 
   def _simplified(self):
-    return self.func._inverse(self.ndim-2, self.ndim-1)
+    result = self.func._inverse(self.ndim-2, self.ndim-1)
+    if result is not None:
+      return result
+    for axis, parg in enumerate(self.func._axes[:-2]):
+      if isinstance(parg, Inserted):
+        return insertaxis(Inverse(self.func._uninsert(axis)), axis, parg.length)
 
   def evalf(self, arr):
     return numeric.inv(arr)
@@ -1547,7 +1662,12 @@ class Determinant(Array):
     super().__init__(args=[func], shape=func.shape[:-2], dtype=func.dtype)
 
   def _simplified(self):
-    return self.func._determinant(self.ndim, self.ndim+1)
+    result = self.func._determinant(self.ndim, self.ndim+1)
+    if result is not None:
+      return result
+    for axis, parg in enumerate(self.func._axes[:-2]):
+      if isinstance(parg, Inserted):
+        return insertaxis(Determinant(self.func._uninsert(axis)), axis, parg.length)
 
   def evalf(self, arr):
     assert arr.ndim == self.ndim+2
@@ -3281,11 +3401,15 @@ class LoopSum(Array):
   def evalf_withtimes(self, times, *args):
     times[self] = subtimes = collections.defaultdict(_Stats)
     result = numpy.zeros(tuple(map(int, args[:self.ndim])), self.dtype)
-    for index in range(int(args[self.ndim])):
-      values = list(args)
-      values.append(numpy.array(index))
-      values.extend(op.evalf_withtimes(subtimes, *[values[i] for i in indices]) for op, indices in self._serialized)
-      result += values[self._result_index]
+    length = int(args[self.ndim])
+    with _traced('LoopSum', length=length) as details:
+      for index in range(length):
+        with _traced('iteration', index=index):
+          values = list(args)
+          values.append(numpy.array(index))
+          values.extend(op.evalf_withtimes(subtimes, *[values[i] for i in indices]) for op, indices in self._serialized)
+          result += values[self._result_index]
+      details.update(_array_details(result))
     return result
 
   def _derivative(self, var, seen):
@@ -3469,23 +3593,84 @@ class LoopConcatenateCombined(Evaluable):
     self._serialized = tuple((dep, tuple(map(indices.__getitem__, dep._Evaluable__args))) for dep in dependencies)
     self._invariants = tuple(invariants)
 
+    # Split the body in a part that depends on arguments other than the loop
+    # index, and a part that does not. Of the latter, the values that are used
+    # by the former or that are part of the result are hoisted: they are stored
+    # per index in the hoist cache and reused in subsequent evaluations.
+    variable = [invariant is EVALARGS or not invariant.isconstant for invariant in invariants] + [False]
+    for dep, argindices in self._serialized:
+      variable.append(any(variable[i] for i in argindices))
+    nfixed = len(invariants) + 1
+    hoisted = {i for (dep, argindices), isvariable in zip(self._serialized, variable[nfixed:]) if isvariable for i in argindices if i >= nfixed and not variable[i]}
+    hoisted.update(i for i in (*self._start_indices, *self._stop_indices, *self._result_indices) if i >= nfixed and not variable[i])
+    self._hoisted = tuple(sorted(hoisted))
+    self._variable = tuple((op, argindices, i) for i, (op, argindices) in enumerate(self._serialized, nfixed) if variable[i])
+
     super().__init__(args=invariants)
 
   def evalf(self, *args):
     i = 0
-    results = []
+    shapes = []
     for func in self._funcs:
-      results.append(parallel.shempty(tuple(map(int, args[i:i+func.ndim])), dtype=func.dtype))
+      shapes.append((tuple(map(int, args[i:i+func.ndim])), func.dtype))
       i += func.ndim
     length = int(args[i])
-    with parallel.ctxrange('loop', length) as indices:
-      for index in indices:
-        values = list(args)
-        values.append(numpy.array(index))
-        values.extend(op.evalf(*[values[i] for i in indices]) for op, indices in self._serialized)
-        for result, result_id, start_id, stop_id in zip(results, self._result_indices, self._start_indices, self._stop_indices):
-          result[...,int(values[start_id]):int(values[stop_id])] = values[result_id]
-    return tuple(results)
+    return parallel.loop('loop', length, self._evalf_loop, shapes, self._hoisting(length), None, *args)
+
+  def _hoisting(self, length):
+    # Hoisting is restricted to serial loops: in a parallel loop every process
+    # claims an arbitrary subset of the indices, which would fill the cache of
+    # every process with a different, short lived part of the values.
+    return bool(self._hoisted) and _hoistcache.value.maxbytes > 0 and (length <= 1 or parallel._maxprocs.value <= 1)
+
+  def _evalf_loop(self, indices, results, hoisting, nbatch, *args):
+    # If `nbatch` is not None, `args` may contain batches, see
+    # `Evaluable.eval_batched`, and `results` contains the arrays of every
+    # function for every member of the batch.
+    if nbatch is None:
+      evalf = lambda op, opargs: op.evalf(*opargs)
+    else:
+      evalf = functools.partial(_evalf_batched, nbatch=nbatch)
+    hoistcache = _hoistcache.value if hoisting else None
+    if hoistcache is not None:
+      try:
+        hoistkey = types.nutils_hash(self)
+      except TypeError: # the loop contains objects without a stable hash
+        hoistcache = None
+    for index in indices:
+      hoisted = hoistcache.get(hoistkey, index) if hoistcache is not None else None
+      values = list(args)
+      values.append(numpy.array(index))
+      if hoisted is None:
+        values.extend(evalf(op, [values[i] for i in argindices]) for op, argindices in self._serialized)
+        if hoistcache is not None:
+          hoistcache.put(hoistkey, index, tuple(values[i] for i in self._hoisted), external=args)
+      else:
+        values.extend([None] * len(self._serialized))
+        for i, value in zip(self._hoisted, hoisted):
+          values[i] = value
+        for op, argindices, i in self._variable:
+          values[i] = evalf(op, [values[j] for j in argindices])
+      for ifunc, (result_id, start_id, stop_id) in enumerate(zip(self._result_indices, self._start_indices, self._stop_indices)):
+        value, start, stop = values[result_id], values[start_id], values[stop_id]
+        if nbatch is None:
+          results[ifunc][...,int(start):int(stop)] = value
+        else:
+          for ibatch in range(nbatch):
+            results[ifunc*nbatch+ibatch][...,int(_member(start, ibatch)):int(_member(stop, ibatch))] = _member(value, ibatch)
+
+  def evalf_batched(self, nbatch, *args):
+    i = 0
+    shapes = []
+    for func in self._funcs:
+      shape = args[i:i+func.ndim]
+      if any(isinstance(n, _Batch) for n in shape):
+        raise ValueError('the shape of a loop concatenation cannot depend on a batched argument')
+      shapes.extend([(tuple(map(int, shape)), func.dtype)] * nbatch)
+      i += func.ndim
+    length = int(args[i])
+    results = parallel.loop('loop', length, self._evalf_loop, shapes, self._hoisting(length), nbatch, *args)
+    return _Batch(results[ibatch::nbatch] for ibatch in range(nbatch))
 
   def evalf_withtimes(self, times, *args):
     times[self] = subtimes = collections.defaultdict(_Stats)
@@ -3496,13 +3681,15 @@ class LoopConcatenateCombined(Evaluable):
         results.append(numpy.empty(tuple(map(int, args[i:i+func.ndim])), dtype=func.dtype))
       i += func.ndim
     length = int(args[i])
-    for index in range(length):
-      values = list(args)
-      values.append(numpy.array(index))
-      values.extend(op.evalf_withtimes(subtimes, *[values[i] for i in indices]) for op, indices in self._serialized)
-      for func, result, result_id, start_id, stop_id in zip(self._funcs, results, self._result_indices, self._start_indices, self._stop_indices):
-        with subtimes['concat', func]:
-          result[...,int(values[start_id]):int(values[stop_id])] = values[result_id]
+    with _traced('LoopConcatenateCombined', length=length):
+      for index in range(length):
+        with _traced('iteration', index=index):
+          values = list(args)
+          values.append(numpy.array(index))
+          values.extend(op.evalf_withtimes(subtimes, *[values[i] for i in indices]) for op, indices in self._serialized)
+          for func, result, result_id, start_id, stop_id in zip(self._funcs, results, self._result_indices, self._start_indices, self._stop_indices):
+            with subtimes['concat', func], _traced('concat'):
+              result[...,int(values[start_id]):int(values[stop_id])] = values[result_id]
     return tuple(results)
 
   def _node_tuple(self, cache, subgraph, times):
@@ -3524,6 +3711,66 @@ class LoopConcatenateCombined(Evaluable):
     cache[self, 'tuple'] = concats = tuple(concats)
     return concats
 
+class LoopConcatenateMerged(Evaluable):
+  '''Independent loops evaluated in a single parallel region.
+
+  The iterations of all loops are distributed over the processes through one
+  shared work queue. The loops are queued in order of decreasing estimated
+  cost per iteration, such that the iterations of cheap loops fill up the
+  processes that finish early. The value is the concatenation of the tuples of
+  the loops.
+  '''
+
+  @types.apply_annotations
+  def __init__(self, loops:types.tuple[types.strict[LoopConcatenateCombined]]):
+    self._loops = loops
+    # the number of operations in the body of a loop serves as an estimate of
+    # the cost of an iteration
+    self._order = tuple(sorted(range(len(loops)), key=lambda iloop: -len(loops[iloop]._serialized)))
+    super().__init__(args=[arg for loop in loops for arg in loop._invariants])
+
+  def _split(self, items, sizes):
+    parts = []
+    i = 0
+    for size in sizes:
+      parts.append(items[i:i+size])
+      i += size
+    return parts
+
+  def evalf(self, *args):
+    shapes = []
+    lengths = []
+    for loop, loopargs in zip(self._loops, self._split(args, [len(loop._invariants) for loop in self._loops])):
+      i = 0
+      for func in loop._funcs:
+        shapes.append((tuple(map(int, loopargs[i:i+func.ndim])), func.dtype))
+        i += func.ndim
+      lengths.append(int(loopargs[i]))
+    length = builtins.sum(lengths)
+    hoisting = [loop._hoisting(length) for loop in self._loops]
+    return parallel.loop('loop', length, self._evalf_loops, shapes, lengths, hoisting, *args)
+
+  def _evalf_loops(self, indices, results, lengths, hoisting, *args):
+    argparts = self._split(args, [len(loop._invariants) for loop in self._loops])
+    resultparts = self._split(results, [len(loop._funcs) for loop in self._loops])
+    indices = iter(indices)
+    pending = [next(indices, None)]
+    start = 0
+    for iloop in self._order:
+      stop = start + lengths[iloop]
+      self._loops[iloop]._evalf_loop(_claim(indices, pending, start, stop), resultparts[iloop], hoisting[iloop], None, *argparts[iloop])
+      start = stop
+
+  def evalf_batched(self, nbatch, *args):
+    values = [_evalf_batched(loop, loopargs, nbatch) for loop, loopargs in zip(self._loops, self._split(args, [len(loop._invariants) for loop in self._loops]))]
+    return _Batch(tuple(item for value in values for item in _member(value, ibatch)) for ibatch in range(nbatch))
+
+  def evalf_withtimes(self, times, *args):
+    return tuple(item for loop, loopargs in zip(self._loops, self._split(args, [len(loop._invariants) for loop in self._loops])) for item in loop.evalf_withtimes(times, *loopargs))
+
+  def _node_tuple(self, cache, subgraph, times):
+    return tuple(node for loop in self._loops for node in loop._node_tuple(cache, subgraph, times))
+
 # AUXILIARY FUNCTIONS (FOR INTERNAL USE)
 
 _ascending = lambda arg: numpy.greater(numpy.diff(arg), 0).all()
@@ -3570,6 +3817,49 @@ def _inflate_scalar(arg, shape):
 def _isunique(array):
   return numpy.unique(array).size == array.size
 
+class _Batch(tuple):
+  '''Values for every member of a batch, see :meth:`Evaluable.eval_batched`.
+
+  If the members are views of an array with a leading batch axis, this array
+  is stored as attribute ``stacked``.'''
+
+  stacked = None
+
+# Operations of which `evalf` broadcasts over leading axes of equal shaped
+# arguments, such that a batch is evaluated in a single call.
+_broadcasting = Pointwise, Add, Multiply, Power, Sign
+
+def _member(value, ibatch):
+  return value[ibatch] if isinstance(value, _Batch) else value
+
+def _stacked(value):
+  if isinstance(value, _Batch) and value.stacked is None:
+    if len({numpy.shape(member) for member in value}) != 1:
+      return None
+    value.stacked = numpy.stack(value)
+  return value.stacked if isinstance(value, _Batch) else value
+
+def _evalf_batched(op, args, nbatch):
+  if not any(isinstance(arg, _Batch) for arg in args):
+    return op.evalf(*args)
+  if isinstance(op, (LoopConcatenateCombined, LoopConcatenateMerged)):
+    return op.evalf_batched(nbatch, *args)
+  if isinstance(op, _broadcasting):
+    stacked = [_stacked(arg) for arg in args]
+    if all(arg is not None for arg in stacked):
+      retval = numpy.asarray(op.evalf(*stacked))
+      batch = _Batch(retval)
+      batch.stacked = retval
+      return batch
+  return _Batch(op.evalf(*[_member(arg, ibatch) for arg in args]) for ibatch in range(nbatch))
+
+def _claim(indices, pending, start, stop):
+  # Yield the indices in [start,stop) from the ascending iterable `indices`,
+  # relative to start, where `pending` holds the first unprocessed index.
+  while pending[0] is not None and pending[0] < stop:
+    yield pending[0] - start
+    pending[0] = next(indices, None)
+
 def _populate_dependencies_sans_invariants(func, arg, invariants, dependencies, cache):
   if func in cache:
     return
@@ -3607,6 +3897,176 @@ class _Stats:
     self.time += time.perf_counter_ns() - self._start
     self.ncalls += 1
 
+class _Trace:
+  '''Recorder of nested evaluation events, see :func:`profile`.'''
+
+  __slots__ = 'events', '_stack'
+
+  def __init__(self) -> None:
+    self.events = [] # list of (stack, start, duration, details) tuples
+    self._stack = []
+
+  @contextlib.contextmanager
+  def event(self, name: str, **details):
+    self._stack.append(name)
+    start = time.perf_counter_ns()
+    try:
+      yield details
+    finally:
+      self.events.append((tuple(self._stack), start, time.perf_counter_ns() - start, details))
+      self._stack.pop()
+
+  def write_trace(self, f) -> None:
+    '''Write events in Chrome's trace event format.'''
+
+    pid = os.getpid()
+    events = [dict(name=stack[-1], ph='X', ts=start/1e3, dur=duration/1e3, pid=pid, tid=0, args=details) for stack, start, duration, details in self.events]
+    json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+  def write_collapsed(self, f) -> None:
+    '''Write the exclusive time in microseconds per call stack in collapsed
+    stack format.'''
+
+    times = collections.defaultdict(int)
+    for stack, start, duration, details in self.events:
+      times[stack] += duration
+      if len(stack) > 1:
+        times[stack[:-1]] -= duration
+    for stack, duration in sorted(times.items()):
+      print('{} {}'.format(';'.join(stack), builtins.max(duration // 1000, 0)), file=f)
+
+_trace = util.settable() # active _Trace instance, see `profile`
+
+def _traced(name, **details):
+  return _trace.value.event(name, **details) if _trace.value is not None else contextlib.nullcontext({})
+
+def _array_details(value):
+  if isinstance(value, numpy.ndarray):
+    return dict(shape=value.shape, dtype=value.dtype.str, nbytes=value.nbytes)
+  return {}
+
+@contextlib.contextmanager
+def profile(name: typing.Optional[str] = 'profile.json'):
+  '''Profile evaluations of evaluable graphs.
+
+  Every evaluation inside this context, including the assembly of integrals
+  in :func:`nutils.sample.eval_integrals_sparse` and hence the solvers in
+  :mod:`nutils.solver`, records the wall time, output array sizes and loop
+  nesting of every evaluated node. On exiting the
+  context the profile is written to the user file ``name``: in Chrome's trace
+  event format if ``name`` ends with ``.json``, to be opened in for instance
+  ``chrome://tracing`` or Perfetto, or in collapsed stack format otherwise,
+  as used by flamegraph generators.
+
+  Args
+  ----
+  name : :class:`str` or ``None``
+      File name of the profile. If ``None`` the profile is not written, but
+      the recorded events remain available via the yielded trace object.
+  '''
+
+  trace = _Trace()
+  with _trace.sets(trace):
+    yield trace
+  if name is None:
+    return
+  with log.userfile(name, 'w') as f:
+    if name.endswith('.json'):
+      trace.write_trace(f)
+    else:
+      trace.write_collapsed(f)
+
+class _HoistCache:
+  '''Bounded cache of the argument independent values of loop bodies.
+
+  Stores per loop and per loop index the values that
+  :class:`LoopConcatenateCombined` hoists out of its body. Loops are identified
+  by their stable hash, such that the values survive the reconstruction of
+  the loop in every evaluation of an integral. If storing a value would exceed
+  ``maxbytes``, the least recently used loops are evicted; the values of the
+  current loop are never evicted in favour of itself.'''
+
+  def __init__(self, maxbytes):
+    self.maxbytes = maxbytes
+    self.nbytes = 0
+    self.hits = 0
+    self.misses = 0
+    self._loops = collections.OrderedDict() # key -> [nbytes, {index: values}]
+
+  def get(self, key, index):
+    loop = self._loops.get(key)
+    values = loop[1].get(index) if loop is not None else None
+    if values is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+      self._loops.move_to_end(key)
+    return values
+
+  def put(self, key, index, values, external=()):
+    values = tuple(_hoistable(value, external) for value in values)
+    nbytes = builtins.sum(value.nbytes for value in values if isinstance(value, numpy.ndarray))
+    while self.nbytes + nbytes > self.maxbytes:
+      if not self._loops or next(iter(self._loops)) == key:
+        return
+      self.nbytes -= self._loops.popitem(last=False)[1][0]
+    loop = self._loops.get(key)
+    if loop is None:
+      self._loops[key] = loop = [0, {}]
+    else:
+      self._loops.move_to_end(key)
+    loop[0] += nbytes
+    loop[1][index] = values
+    self.nbytes += nbytes
+
+  def clear(self):
+    self._loops.clear()
+    self.nbytes = 0
+
+def _hoistable(value, external):
+  # Views and `external` arrays may share memory with arrays that are modified
+  # after the evaluation, such as the result of another loop, so they are
+  # stored as copies. All stored arrays are made read-only to guard against
+  # in-place modification.
+  if isinstance(value, numpy.ndarray):
+    if value.base is not None or any(value is arg for arg in external):
+      value = value.copy()
+    value.flags.writeable = False
+  return value
+
+_hoistcache = util.settable(_HoistCache(int(os.environ.get('NUTILS_HOISTCACHE') or 0) << 20)) # see `hoisting`
+
+@contextlib.contextmanager
+def hoisting(maxbytes: int):
+  '''Set the memory budget for hoisted loop body values.
+
+  Loops over elements, such as the ones that result from integrals, contain
+  intermediate values that do not depend on any argument other than the
+  element index: geometry, jacobians, basis functions and quadrature weights.
+  The first evaluation stores these values per element, up to a total of
+  ``maxbytes`` bytes, such that repeated evaluations with different arguments,
+  for instance in subsequent Newton iterations or time steps, evaluate only the
+  argument dependent remainder. Hoisting trades memory for time and is
+  therefore disabled by default; outside of this context the budget can be set
+  via environment variable ``NUTILS_HOISTCACHE`` in megabytes.
+
+  The context activates a new, empty cache, which is yielded on entry and
+  discarded on exit. A budget of 0 disables hoisting. Loops that are evaluated
+  in parallel, see :func:`nutils.parallel.maxprocs`, do not hoist, such that
+  the worker processes do not keep copies of the values.
+
+  Args
+  ----
+  maxbytes : :class:`int`
+      Maximum number of bytes of stored values.
+  '''
+
+  if not isinstance(maxbytes, int) or maxbytes < 0:
+    raise ValueError('maxbytes requires a nonnegative integer argument')
+  cache = _HoistCache(maxbytes)
+  with _hoistcache.sets(cache):
+    yield cache
+
 # FUNCTIONS
 
 def isarray(arg):
@@ -3768,17 +4228,54 @@ def takediag(arg, axis=-2, rmaxis=-1):
 def _takediag(arg, axis1=-2, axis2=-1):
   return TakeDiag(Transpose.to_end(arg, axis1, axis2))
 
+class _DeferDerivative(Exception):
+  '''Raised to postpone the derivative of ``func`` to the worklist of :func:`derivative`.'''
+
+  def __init__(self, func):
+    self.func = func
+    super().__init__(func)
+
+class _DerivativeMemo(dict):
+
+  maxdepth = 64
+
+  def __init__(self):
+    self.depth = 0
+    super().__init__()
+
 def derivative(func, var, seen=None):
   'derivative'
 
   assert isinstance(var, DerivativeTargetBase), 'invalid derivative target {!r}'.format(var)
-  if seen is None:
-    seen = {}
   func = asarray(func)
+  if seen is None:
+    # The `_derivative` rules request the derivatives of their arguments on
+    # demand. Beyond `maxdepth` nested requests the requested function is
+    # pushed to a worklist and the pending rules are retried once it is
+    # differentiated, such that deep graphs do not exceed the recursion limit.
+    seen = _DerivativeMemo()
+    worklist = [func]
+    while worklist:
+      try:
+        derivative(worklist[-1], var, seen)
+      except _DeferDerivative as e:
+        worklist.append(e.func)
+      else:
+        worklist.pop()
+    return seen[func]
   if func in seen:
     result = seen[func]
   else:
-    result = func._derivative(var, seen)
+    if isinstance(seen, _DerivativeMemo):
+      if seen.depth >= seen.maxdepth:
+        raise _DeferDerivative(func)
+      seen.depth += 1
+      try:
+        result = func._derivative(var, seen)
+      finally:
+        seen.depth -= 1
+    else:
+      result = func._derivative(var, seen)
     seen[func] = result
   assert result.shape == func.shape+var.shape, 'bug in {}._derivative'.format(type(func).__name__)
   return result
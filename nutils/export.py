@@ -19,7 +19,7 @@
 # THE SOFTWARE.
 
 from . import util, warnings
-import contextlib, numpy, os, treelog as log
+import contextlib, numpy, os, queue, sys, threading, zlib, hashlib, treelog as log
 
 @contextlib.contextmanager
 @util.positional_only
@@ -174,4 +174,384 @@ def vtk(name, cells, points, kwargs=...):
         vtk.write(vtkndim[array.ndim].format(dname, vtkdtype[array.dtype]).encode('ascii'))
         array.tofile(vtk)
 
+_vtucelltypes = dict(vertex=1, line=3, triangle=5, quad=9, tetra=10, hexahedron=12, wedge=13,
+  lagrange_curve=68, lagrange_triangle=69, lagrange_quadrilateral=70, lagrange_tetrahedron=71, lagrange_hexahedron=72, lagrange_wedge=73)
+_vtusimplices = {1: 'vertex', 2: 'line', 3: 'triangle', 4: 'tetra'}
+_vtudtypes = {
+  'i1': 'Int8',  'u1': 'UInt8',  'i2': 'Int16', 'u2': 'UInt16',
+  'i4': 'Int32', 'u4': 'UInt32', 'i8': 'Int64', 'u8': 'UInt64',
+  'f4': 'Float32', 'f8': 'Float64'}
+_vtucompressors = dict(zlib='vtkZLibDataCompressor', lz4='vtkLZ4DataCompressor')
+_vtublocksize = 1 << 15
+
+@util.positional_only
+def vtu(name, cells, points, *, celltype=None, compress=None, piece=None, npieces=None, kwargs=...):
+  '''Export data to a VTK XML unstructured grid file.
+
+  Writes the mesh and data in the `VTK XML format`_ with all arrays stored as
+  native-endian appended raw binary data, optionally compressed in blocks.
+  Contrary to :func:`vtk` any cell type supported by VTK can be written,
+  including quadrilaterals, hexahedra and higher-order Lagrange cells, provided
+  that the connectivity table follows VTK's node ordering.
+
+  Beyond the mandatory file name, connectivity table, and vertex coordinates,
+  any additional data sets can be provided as keyword arguments, where the keys
+  are the names by which the arrays are stored. The data can be either vertex
+  or point data, with the distinction made based on the length of the array.
+  Vector and tensor data are stored with the number of components following
+  from the array shape, without padding.
+
+  For data that is produced in parallel, every process writes its own piece
+  ``name_<piece>.vtu`` by specifying ``piece`` and ``npieces``, and piece 0
+  additionally writes the index file ``name.pvtu`` that combines them. Index
+  files refer to the pieces by file name, which requires a logger that
+  preserves file names such as :class:`treelog.DataLog`.
+
+  .. _`VTK XML format`: https://www.vtk.org/VTK/img/file-formats.pdf
+
+  Args
+  ----
+  name : :class:`str`
+    Destination file name (without vtu extension).
+  cells : :class:`int` array
+    Connectivity table.
+  points : :class:`float` array
+    Vertex coordinates.
+  celltype : :class:`str`, optional
+    VTK cell type, e.g. ``'quad'``, ``'hexahedron'`` or
+    ``'lagrange_quadrilateral'``. By default the cells are taken to be
+    simplices.
+  compress : :class:`str`, optional
+    Block compression, ``'zlib'`` or ``'lz4'``. The latter requires the lz4
+    module.
+  piece : :class:`int`, optional
+    Index of the piece written by this process.
+  npieces : :class:`int`, optional
+    Total number of pieces.
+  **kwargs :
+    Cell and/or point data
+
+  Returns
+  -------
+  :class:`str`
+    Name of the data set for use in :func:`pvd`: the vtu file, or the pvtu
+    index if the data is written in pieces.
+  '''
+
+  cells = numpy.asarray(cells)
+  points = numpy.asarray(points)
+  assert cells.ndim == points.ndim == 2
+  npoints, ndims = points.shape
+  ncells, nverts = cells.shape
+
+  if ndims > 3:
+    raise Exception('invalid spatial dimension: {}'.format(ndims))
+  if celltype is None:
+    if nverts not in _vtusimplices:
+      raise Exception('cannot determine cell type for {} vertices per cell'.format(nverts))
+    celltype = _vtusimplices[nverts]
+  elif celltype not in _vtucelltypes:
+    raise Exception('invalid cell type: {!r}'.format(celltype))
+  if compress is not None and compress not in _vtucompressors:
+    raise Exception('invalid compressor: {!r}'.format(compress))
+  if (piece is None) != (npieces is None):
+    raise Exception('piece and npieces should be specified together')
+
+  pointdata = {}
+  celldata = {}
+  for dname, array in kwargs.items():
+    array = numpy.asarray(array)
+    if len(array) == npoints:
+      pointdata[dname] = array
+    elif len(array) == ncells:
+      celldata[dname] = array
+    else:
+      raise Exception('data length matches neither points nor cells: {}'.format(dname))
+
+  xyz = numpy.zeros((npoints, 3), dtype=points.dtype if points.dtype.kind == 'f' else float)
+  xyz[:,:ndims] = points
+  sections = [
+    ('Points', [('Points', xyz)]),
+    ('Cells', [('connectivity', cells.astype(numpy.int64)), ('offsets', numpy.arange(nverts, (ncells+1)*nverts, nverts, dtype=numpy.int64)), ('types', numpy.full(ncells, _vtucelltypes[celltype], dtype=numpy.uint8))]),
+    ('PointData', list(pointdata.items())),
+    ('CellData', list(celldata.items()))]
+
+  xml = []
+  pxml = []
+  blocks = []
+  offset = 0
+  for section, arrays in sections:
+    xml.append('<{}>'.format(section))
+    if section != 'Cells': # the parallel index lists all arrays except the connectivity
+      pxml.append('<P{}>'.format(section))
+    for dname, array in arrays:
+      array, dtype, ncomp = _vtuarray(array)
+      block = _vtublock(array, compress)
+      xml.append('<DataArray type="{}" Name="{}" NumberOfComponents="{}" format="appended" offset="{}"/>'.format(dtype, dname, ncomp, offset))
+      if section != 'Cells':
+        pxml.append('<PDataArray type="{}" Name="{}" NumberOfComponents="{}"/>'.format(dtype, dname, ncomp))
+      blocks.append(block)
+      offset += len(block)
+    xml.append('</{}>'.format(section))
+    if section != 'Cells':
+      pxml.append('</P{}>'.format(section))
+
+  if piece is None:
+    name_vtu = name + '.vtu'
+  else:
+    name_vtu = '{}_{}.vtu'.format(name, piece)
+  with log.userfile(name_vtu, 'wb') as vtu:
+    vtu.write(_vtuheader('UnstructuredGrid', compress).encode('ascii'))
+    vtu.write('<UnstructuredGrid><Piece NumberOfPoints="{}" NumberOfCells="{}">\n'.format(npoints, ncells).encode('ascii'))
+    vtu.write('\n'.join(xml).encode('ascii'))
+    vtu.write(b'\n</Piece></UnstructuredGrid>\n<AppendedData encoding="raw">\n_')
+    for block in blocks:
+      vtu.write(block)
+    vtu.write(b'\n</AppendedData>\n</VTKFile>\n')
+
+  if piece == 0:
+    pxml.extend('<Piece Source="{}_{}.vtu"/>'.format(os.path.basename(name), i) for i in range(npieces))
+    with log.userfile(name + '.pvtu', 'w') as pvtu:
+      pvtu.write(_vtuheader('PUnstructuredGrid', compress))
+      pvtu.write('<PUnstructuredGrid GhostLevel="0">\n')
+      pvtu.write('\n'.join(pxml))
+      pvtu.write('\n</PUnstructuredGrid>\n</VTKFile>\n')
+
+  return name_vtu if piece is None else name + '.pvtu'
+
+def pvd(name, datasets):
+  '''Export a time series of VTK files as a ParaView data collection.
+
+  Writes an index file that lists the given VTK files with their time values,
+  such that the series can be opened and animated as a whole. Like the
+  ``pvtu`` index of :func:`vtu`, the collection refers to the files by name,
+  which requires a logger that preserves file names such as
+  :class:`treelog.DataLog`.
+
+  Args
+  ----
+  name : :class:`str`
+    Destination file name (without pvd extension).
+  datasets : iterable of (:class:`float`, :class:`str`) pairs
+    Time values and names of the files in the series, such as those returned
+    by :func:`vtu`.
+  '''
+
+  with log.userfile(name + '.pvd', 'w') as pvd:
+    pvd.write(_vtuheader('Collection', None))
+    pvd.write('<Collection>\n')
+    for time, filename in datasets:
+      pvd.write('<DataSet timestep="{!r}" part="0" file="{}"/>\n'.format(float(time), filename))
+    pvd.write('</Collection>\n</VTKFile>\n')
+
+class timeseries:
+  '''Streaming writer for time series of data on a fixed mesh.
+
+  Writes the mesh once and the data of every subsequent time step to a
+  separate raw binary file, accompanied by an `XDMF`_ index that can be opened
+  directly in ParaView or VisIt. The data is written by a background thread,
+  such that output overlaps with the computation of the next time step. The
+  writer is used as a context manager, which waits for the remaining time
+  steps to be written upon exit::
+
+      with export.timeseries('solution', bezier.tri, x) as series:
+        for istep, lhs in enumerate(solver.thetamethod(...)):
+          series.write(istep * timestep, u=bezier.eval(u, lhs=lhs))
+
+  As with :func:`vtu`, data is stored as either point or cell data depending
+  on the length of the array. Vectors of two components are padded with a
+  zero third component, as are the points of a two-dimensional mesh.
+
+  The binary files are named after the SHA-1 hash of their contents, which is
+  the name under which :class:`treelog.HtmlLog` stores them and which loggers
+  that preserve file names, such as :class:`treelog.DataLog`, leave intact,
+  such that the index refers to the binary files by their actual names. The
+  index is written anew after every time step, such that it covers all data
+  that was written even if the computation is interrupted. As loggers do not
+  overwrite files, this results in an index file per time step, of which the
+  last one is complete.
+
+  .. _`XDMF`: http://www.xdmf.org/index.php/XDMF_Model_and_Format
+
+  Args
+  ----
+  name : :class:`str`
+    Destination file name (without extension).
+  cells : :class:`int` array
+    Connectivity table.
+  points : :class:`float` array
+    Vertex coordinates.
+  celltype : :class:`str`, optional
+    Cell type, e.g. ``'quad'`` or ``'hexahedron'``. By default the cells are
+    taken to be simplices.
+  maxqueue : :class:`int`
+    Maximum number of time steps that are waiting to be written before
+    :meth:`write` blocks.
+  '''
+
+  _celltypes = dict(vertex='Polyvertex', line='Polyline', triangle='Triangle', quad='Quadrilateral', tetra='Tetrahedron', hexahedron='Hexahedron', wedge='Wedge')
+
+  def __init__(self, name, cells, points, *, celltype=None, maxqueue=2):
+    cells = numpy.asarray(cells)
+    points = numpy.asarray(points)
+    assert cells.ndim == points.ndim == 2
+    self.npoints, ndims = points.shape
+    self.ncells, nverts = cells.shape
+    if ndims > 3:
+      raise Exception('invalid spatial dimension: {}'.format(ndims))
+    if celltype is None:
+      if nverts not in _vtusimplices:
+        raise Exception('cannot determine cell type for {} vertices per cell'.format(nverts))
+      celltype = _vtusimplices[nverts]
+    elif celltype not in self._celltypes:
+      raise Exception('invalid cell type: {!r}'.format(celltype))
+    self._name = name
+    self._grids = [] # xdmf grids of the written time steps
+    self._written = set() # names of the written binary files
+    self._error = None
+    xyz = numpy.zeros((self.npoints, 3), dtype=points.dtype if points.dtype.kind == 'f' else float)
+    xyz[:,:ndims] = points
+    cellsitem, xyzitem = self._writebinary([cells.astype(numpy.int64), xyz])
+    self._mesh = '<Topology TopologyType="{}" NumberOfElements="{}" NodesPerElement="{}">{}</Topology>\n<Geometry GeometryType="XYZ">{}</Geometry>\n'.format(self._celltypes[celltype], self.ncells, nverts, cellsitem, xyzitem)
+    self._queue = queue.Queue(maxsize=maxqueue)
+    self._thread = threading.Thread(target=self._work, name='timeseries', daemon=True)
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  @util.positional_only
+  def write(self, time, kwargs=...):
+    '''Add a time step.
+
+    The data is copied and handed over to the background thread, which
+    writes it along with the updated index.
+
+    Args
+    ----
+    time : :class:`float`
+      Time value of the step.
+    **kwargs :
+      Cell and/or point data
+    '''
+
+    if self._thread is None:
+      raise Exception('time series is closed')
+    if self._error is not None:
+      raise self._error
+    data = []
+    for dname, array in kwargs.items():
+      array = numpy.array(array) # copy such that the caller is free to modify the array
+      if array.dtype.kind == 'b':
+        array = array.astype(numpy.uint8)
+      if array.dtype.kind not in 'iuf':
+        raise Exception('invalid data type: {}'.format(array.dtype))
+      if len(array) == self.npoints:
+        center = 'Node'
+      elif len(array) == self.ncells:
+        center = 'Cell'
+      else:
+        raise Exception('data length matches neither points nor cells: {}'.format(dname))
+      data.append((dname, center, array))
+    self._queue.put((float(time), data))
+
+  def close(self):
+    '''Write the remaining time steps.'''
+
+    if self._thread is None:
+      return
+    self._queue.put(None)
+    self._thread.join()
+    self._thread = None
+    if self._error is not None:
+      raise self._error
+    if not self._grids:
+      self._writeindex()
+
+  def _work(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        return
+      if self._error is not None:
+        continue # drain the queue such that write and close do not block
+      time, data = item
+      try:
+        arrays = []
+        attributes = []
+        for dname, center, array in data:
+          if array.ndim == 2 and array.shape[1] == 2: # pad to a three-component vector
+            array = numpy.concatenate([array, numpy.zeros_like(array[:,:1])], axis=1)
+          arrays.append(array)
+          attributes.append((dname, center, 'Scalar' if array.ndim == 1 else 'Vector' if array.shape[1:] == (3,) else 'Tensor' if array.shape[1:] == (3,3) else 'Matrix'))
+        dataitems = self._writebinary(arrays)
+        grid = '<Grid GridType="Uniform">\n<Time Value="{!r}"/>\n'.format(time) + self._mesh
+        for (dname, center, attributetype), dataitem in zip(attributes, dataitems):
+          grid += '<Attribute Name="{}" AttributeType="{}" Center="{}">{}</Attribute>\n'.format(dname, attributetype, center, dataitem)
+        self._grids.append(grid + '</Grid>\n')
+        self._writeindex()
+      except Exception as e:
+        self._error = e
+
+  def _writeindex(self):
+    with log.userfile(self._name + '.xdmf', 'w') as xdmf:
+      xdmf.write('<?xml version="1.0"?>\n<Xdmf Version="3.0">\n<Domain>\n<Grid Name="{}" GridType="Collection" CollectionType="Temporal">\n'.format(os.path.basename(self._name)))
+      xdmf.writelines(self._grids)
+      xdmf.write('</Grid>\n</Domain>\n</Xdmf>\n')
+
+  def _writebinary(self, arrays):
+    # Write the arrays to a binary file named after the hash of its contents
+    # and return the corresponding data items.
+    chunks = []
+    items = []
+    offset = 0
+    for array in arrays:
+      array = numpy.ascontiguousarray(array, dtype=array.dtype.newbyteorder('='))
+      numbertype = dict(i='Int', u='UInt', f='Float')[array.dtype.kind]
+      if array.dtype.itemsize == 1:
+        numbertype = 'Char' if numbertype == 'Int' else 'UChar'
+      chunks.append(memoryview(array.reshape(-1)).cast('B'))
+      items.append('<DataItem Format="Binary" Endian="Native" Seek="{}" NumberType="{}" Precision="{}" Dimensions="{}">{{}}</DataItem>'.format(offset, numbertype, array.dtype.itemsize, ' '.join(map(str, array.shape))))
+      offset += array.nbytes
+    digest = hashlib.sha1()
+    for chunk in chunks:
+      digest.update(chunk)
+    filename = digest.hexdigest() + '.bin'
+    if filename not in self._written: # identical data is stored only once
+      with log.userfile(filename, 'wb') as f:
+        f.writelines(chunks)
+      self._written.add(filename)
+    return [item.format(filename) for item in items]
+
+def _vtuheader(filetype, compress):
+  byteorder = 'LittleEndian' if sys.byteorder == 'little' else 'BigEndian'
+  compressor = ' compressor="{}"'.format(_vtucompressors[compress]) if compress else ''
+  return '<?xml version="1.0"?>\n<VTKFile type="{}" version="1.0" byte_order="{}" header_type="UInt64"{}>\n'.format(filetype, byteorder, compressor)
+
+def _vtuarray(a): # convert to native endian, contiguous data with components flattened
+  a = numpy.asarray(a)
+  if a.dtype.kind == 'b':
+    a = a.astype(numpy.uint8)
+  dtype = '{0.kind}{0.itemsize}'.format(a.dtype)
+  if dtype not in _vtudtypes:
+    raise Exception('invalid data type: {}'.format(a.dtype))
+  a = numpy.ascontiguousarray(a, dtype=a.dtype.newbyteorder('='))
+  return a, _vtudtypes[dtype], int(numpy.prod(a.shape[1:], dtype=int))
+
+def _vtublock(a, compress): # encode array as appended data block, optionally compressed
+  data = a.tobytes()
+  if not compress:
+    return numpy.array(len(data), dtype=numpy.uint64).tobytes() + data
+  if compress == 'lz4':
+    import lz4.block
+    compressor = lambda chunk: lz4.block.compress(chunk, store_size=False)
+  else:
+    compressor = zlib.compress
+  chunks = [compressor(data[i:i+_vtublocksize]) for i in range(0, len(data), _vtublocksize)]
+  header = numpy.array([len(chunks), _vtublocksize, len(data) % _vtublocksize] + [len(chunk) for chunk in chunks], dtype=numpy.uint64)
+  return header.tobytes() + b''.join(chunks)
+
 # vim:sw=2:sts=2:et
@@ -29,8 +29,8 @@ the ``export`` method.
 from  .. import util, sparse, warnings
 import numpy, importlib, os
 
-from ._base import Matrix, MatrixError, BackendNotAvailable, ToleranceNotReached
-for cls in Matrix, MatrixError, BackendNotAvailable, ToleranceNotReached:
+from ._base import Matrix, Factorization, MatrixError, BackendNotAvailable, ToleranceNotReached
+for cls in Matrix, Factorization, MatrixError, BackendNotAvailable, ToleranceNotReached:
   cls.__module__ = __name__ # make it appear as if cls was defined here
 del cls # clean up for sphinx
 
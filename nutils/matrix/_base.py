@@ -18,7 +18,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from .. import numeric
+from .. import numeric, _perf
 import abc, treelog, functools, numpy, collections
 
 class MatrixError(Exception):
@@ -153,33 +153,40 @@ class Matrix:
       return self._solver(rhs, solver, atol=atol, rtol=rtol, **solverargs)
 
     # otherwise we need to do some pre- and post-processing
-    nrows, ncols = self.shape
-    if rhs is None:
-      rhs = numpy.zeros(nrows)
-    if lhs0 is None:
-      lhs = numpy.zeros((ncols,)+rhs.shape[1:])
-    else:
-      lhs = numpy.array(lhs0, dtype=float)
-      while lhs.ndim < rhs.ndim:
-        lhs = lhs[...,numpy.newaxis].repeat(rhs.shape[lhs.ndim], axis=lhs.ndim)
-      assert lhs.shape == (ncols,)+rhs.shape[1:]
-    if constrain is None:
-      J = numpy.ones(ncols, dtype=bool)
-    else:
-      assert constrain.shape == (ncols,)
-      if constrain.dtype == bool:
-        J = ~constrain
-      else:
-        J = numpy.isnan(constrain)
-        lhs[~J] = constrain[~J]
-    if rconstrain is None:
-      assert nrows == ncols
-      I = J
-    else:
-      assert rconstrain.shape == (nrows,) and constrain.dtype == bool
-      I = ~rconstrain
-    lhs[J] += self.submatrix(I, J)._solver((rhs - self @ lhs)[I], solver, atol=atol, rtol=rtol, **solverargs)
-    return lhs
+    return Factorization(self, constrain=constrain, rconstrain=rconstrain, solver=solver, atol=atol, rtol=rtol, **solverargs).solve(rhs, lhs0=lhs0)
+
+  def factorize(self, *, constrain=None, rconstrain=None, solver='direct', atol=0., rtol=0., **solverargs):
+    '''Prepare for solving repeatedly with different right hand sides.
+
+    Apply the constraints once and keep the factorization that is formed by
+    the first solve, such that subsequent solves cost only a forward and back
+    substitution. The factorization is held until :meth:`Factorization.release`
+    is called, or until the end of the ``with`` block if the returned object is
+    used as a context manager.
+
+    Args
+    ----
+    constrain : :class:`float` or :class:`bool` array, or :any:`None`
+        Column constraints, see :meth:`solve`. Boolean constraints take their
+        values from the ``lhs0`` argument of :meth:`Factorization.solve`.
+    rconstrain : :class:`bool` array or :any:`None`
+        Row constraints, see :meth:`solve`.
+    solver : :class:`str`
+        Name of the solver algorithm, see :meth:`solve`. Defaults to 'direct'.
+    rtol : :class:`float`
+        Relative tolerance, see :meth:`solve`.
+    atol : :class:`float`
+        Absolute tolerance, see :meth:`solve`.
+    **kwargs :
+        All remaining arguments are passed on to the selected solver method.
+
+    Returns
+    -------
+    :class:`Factorization`
+        Object with a ``solve`` method.
+    '''
+
+    return Factorization(self, constrain=constrain, rconstrain=rconstrain, solver=solver, atol=atol, rtol=rtol, **solverargs)
 
   def solve_leniently(self, *args, **kwargs):
     '''
@@ -215,7 +222,8 @@ class Matrix:
     solver_method, solver_name = self._method('solver', solver)
     treelog.info('solving {} dof system to {} using {} solver'.format(self.shape[0], 'tolerance {:.0e}'.format(atol) if atol else 'machine precision', solver_name))
     try:
-      lhs = solver_method(rhs, atol=atol, **solverargs)
+      with _perf.timer('solve'):
+        lhs = solver_method(rhs, atol=atol, **solverargs)
     except MatrixError:
       raise
     except Exception as e:
@@ -336,4 +344,79 @@ class Matrix:
   def __repr__(self):
     return '{}<{}x{}>'.format(type(self).__qualname__, *self.shape)
 
+class Factorization:
+  '''Constrained matrix prepared for repeated solves, see :meth:`Matrix.factorize`.'''
+
+  def __init__(self, matrix, *, constrain=None, rconstrain=None, solver='direct', atol=0., rtol=0., **solverargs):
+    nrows, ncols = self.shape = matrix.shape
+    self._values = None
+    if constrain is None:
+      J = numpy.ones(ncols, dtype=bool)
+    else:
+      assert constrain.shape == (ncols,)
+      if constrain.dtype == bool:
+        J = ~constrain
+      else:
+        J = numpy.isnan(constrain)
+        self._values = constrain[~J]
+    if rconstrain is None:
+      assert nrows == ncols
+      I = J
+    else:
+      assert rconstrain.shape == (nrows,) and constrain.dtype == bool
+      I = ~rconstrain
+    self._matrix = matrix
+    self._submatrix = matrix.submatrix(I, J)
+    self._rows = I
+    self._cols = J
+    self._solverargs = dict(solver=solver, atol=atol, rtol=rtol, **solverargs)
+
+  def solve(self, rhs=None, *, lhs0=None):
+    '''Solve system for the given right hand side vector.
+
+    Args
+    ----
+    rhs : :class:`float` vector or :any:`None`
+        Right hand side vector. A :any:`None` value implies the zero vector.
+    lhs0 : class:`float` vector or :any:`None`
+        Initial values, see :meth:`Matrix.solve`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Left hand side vector.
+    '''
+
+    if self._matrix is None:
+      raise MatrixError('factorization was released')
+    nrows, ncols = self.shape
+    if rhs is None:
+      rhs = numpy.zeros(nrows)
+    if lhs0 is None:
+      lhs = numpy.zeros((ncols,)+rhs.shape[1:])
+    else:
+      lhs = numpy.array(lhs0, dtype=float)
+      while lhs.ndim < rhs.ndim:
+        lhs = lhs[...,numpy.newaxis].repeat(rhs.shape[lhs.ndim], axis=lhs.ndim)
+      assert lhs.shape == (ncols,)+rhs.shape[1:]
+    if self._values is not None:
+      lhs[~self._cols] = self._values.reshape(self._values.shape+(1,)*(lhs.ndim-1))
+    if self._submatrix is self._matrix and lhs0 is None:
+      return self._submatrix._solver(rhs, **self._solverargs)
+    lhs[self._cols] += self._submatrix._solver((rhs - self._matrix @ lhs)[self._rows], **self._solverargs)
+    return lhs
+
+  def release(self):
+    '''Release the factorization.'''
+
+    if self._submatrix is not None:
+      self._submatrix._precon_args = self._submatrix._precon_object = None
+    self._matrix = self._submatrix = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.release()
+
 # vim:sw=2:sts=2:et
@@ -20,15 +20,18 @@
 
 """
 The parallel module provides tools aimed at parallel computing. At this point
-all parallel solutions use the ``fork`` system call and are supported on limited
-platforms, notably excluding Windows. On unsupported platforms parallel features
-will disable and a warning is printed.
+most parallel solutions use the ``fork`` system call and are supported on
+limited platforms, notably excluding Windows. On unsupported platforms parallel
+features will disable and a warning is printed. The exception is a
+:func:`pool` of spawned worker processes, see :func:`startmethod`.
 """
 
 from . import numeric, warnings, util
-import os, multiprocessing, mmap, signal, contextlib, builtins, numpy, treelog
+import os, multiprocessing, mmap, signal, contextlib, builtins, pickle, tempfile, numpy, treelog
 
 _maxprocs = util.settable(int(os.environ.get('NUTILS_NPROCS') or 1))
+_startmethod = util.settable(os.environ.get('NUTILS_STARTMETHOD') or 'fork')
+_pool = util.settable(None)
 
 @util.positional_only
 def maxprocs(new: int):
@@ -38,6 +41,20 @@ def maxprocs(new: int):
     raise ValueError('nprocs requires a positive integer argument')
   return _maxprocs.sets(new)
 
+@util.positional_only
+def startmethod(new: str):
+  '''select how the worker processes of a :func:`pool` are started
+
+  With ``'fork'`` the workers are forked from the main process. With
+  ``'spawn'`` they are started as fresh interpreters, which is safe in the
+  presence of threads and open file handles in the main process; in this mode
+  :func:`fork`, and everything that builds on it, runs serially.
+  '''
+
+  if new not in ('fork', 'spawn'):
+    raise ValueError("startmethod requires either 'fork' or 'spawn'")
+  return _startmethod.sets(new)
+
 @contextlib.contextmanager
 def fork(nprocs=None):
   '''continue as ``nprocs`` parallel processes by forking ``nprocs-1`` times
@@ -50,7 +67,7 @@ def fork(nprocs=None):
 
   if nprocs is None or nprocs > _maxprocs.value:
     nprocs = _maxprocs.value
-  if nprocs <= 1:
+  if nprocs <= 1 or _startmethod.value != 'fork':
     yield 0
     return
   if not hasattr(os, 'fork'):
@@ -100,7 +117,7 @@ def shempty(shape, dtype=float):
   else:
     assert all(numeric.isint(sh) for sh in shape)
   dtype = numpy.dtype(dtype)
-  size = util.product(map(int, shape), int(dtype.itemsize))
+  size = util.product(builtins.map(int, shape), int(dtype.itemsize))
   if size == 0 or _maxprocs.value == 1:
     return numpy.empty(shape, dtype)
   # `mmap(-1,...)` will allocate *anonymous* memory.  Although linux' man page
@@ -141,6 +158,391 @@ def ctxrange(name, nitems):
   with fork(nitems), treelog.iter.wrap(_pct(name, nitems), rng) as wrprng:
     yield wrprng
 
+def map(func, items, name='map'):
+  '''parallel equivalent of :func:`builtins.map` that returns a list
+
+  The items are distributed over at most ``maxprocs`` forked processes. Return
+  values of child processes are pickled and sent to the main process through a
+  pipe, so they should be picklable.
+  '''
+
+  items = tuple(items)
+  nprocs = min(_maxprocs.value, len(items))
+  if nprocs <= 1 or not hasattr(os, 'fork') or _startmethod.value != 'fork':
+    with treelog.iter.wrap(_pct(name, len(items)), builtins.range(len(items))) as indices:
+      return [func(items[i]) for i in indices]
+  results = [None] * len(items)
+  rng = range(len(items)) # shared range, must be created pre-fork
+  pipes = [os.pipe() for iproc in builtins.range(1, nprocs)] # pipes must be created pre-fork
+  with fork(nprocs) as procid, treelog.iter.wrap(_pct(name, len(items)), rng) as indices:
+    for iproc, (r, w) in enumerate(pipes, start=1):
+      os.close(r if procid else w) # parent keeps read ends, children their own write end
+      if procid and iproc != procid:
+        os.close(w)
+    computed = [(i, func(items[i])) for i in indices]
+    if procid:
+      with os.fdopen(pipes[procid-1][1], 'wb') as f:
+        pickle.dump(computed, f)
+    else:
+      for r, w in pipes:
+        with os.fdopen(r, 'rb') as f:
+          try:
+            computed.extend(pickle.load(f))
+          except EOFError: # failure in child process, raised by fork
+            pass
+      for i, result in computed:
+        results[i] = result
+  return results
+
+def loop(name, nitems, func, shapes, *args):
+  '''evaluate ``func`` in parallel, writing into arrays in shared memory
+
+  Allocate arrays of the given shapes and dtypes in shared memory and call
+  ``func(indices, arrays, *args)`` in every process, where ``indices`` is a
+  shared range-like iterable that yields every index below ``nitems`` exactly
+  once. If a :func:`pool` is active and ``func`` and ``args`` are picklable the
+  processes are its workers; otherwise the main process forks as in
+  :func:`ctxrange`. Returns the tuple of arrays.
+  '''
+
+  if _pool.value is not None and _maxprocs.value > 1 and nitems > 1:
+    arrays = _pool.value.run(name, nitems, func, shapes, *args)
+    if arrays is not None:
+      return arrays
+  arrays = tuple(shempty(shape, dtype) for shape, dtype in shapes)
+  with ctxrange(name, nitems) as indices:
+    func(indices, arrays, *args)
+  return arrays
+
+@contextlib.contextmanager
+def pool(nprocs=None):
+  '''create a persistent pool of ``nprocs`` processes for :func:`loop`
+
+  The worker processes are started once, upon entering the context, rather
+  than for every parallel loop. This makes the overhead of a loop independent
+  of the size of the main process. Depending on :func:`startmethod` the
+  workers are forked or spawned. If ``nprocs`` exceeds the configured
+  ``maxprocs`` it is silently capped; for a single process no pool is created
+  and ``None`` is yielded.
+  '''
+
+  if nprocs is None or nprocs > _maxprocs.value:
+    nprocs = _maxprocs.value
+  if nprocs <= 1:
+    yield None
+    return
+  if _startmethod.value == 'spawn':
+    p = SpawnPool(nprocs)
+  elif not hasattr(os, 'fork'):
+    warnings.warn('fork is unavailable on this platform')
+    yield None
+    return
+  else:
+    p = ForkPool(nprocs)
+  try:
+    with _pool.sets(p):
+      yield p
+  finally:
+    p.close()
+
+class Pool:
+  '''persistent pool of worker processes, see :func:`pool`
+
+  Every task is sent to the workers through a pipe as a function plus
+  arguments, and the layout of the result arrays in a shared memory buffer
+  that is reused, and grown if necessary, between tasks. Functions are
+  pickled only the first time they are used; the workers keep the most
+  recently used functions. To this end the main process holds references to
+  these functions, and everything they refer to, until the pool is closed. If
+  a task fails, the function is sent again with the next task. The main
+  process participates in every task and waits for all workers to finish.
+  '''
+
+  _context = multiprocessing
+  _maxfuncs = 16
+
+  def __init__(self, nprocs):
+    self.nprocs = nprocs
+    self._index = self._context.RawValue('i', 0)
+    self._lock = self._context.Lock() # lock to avoid race conditions in incrementing index
+    self._funcs = {} # function -> id, in order of use
+    self._nextid = 0
+    self._forget = [] # ids of functions that the workers may hold but should forget
+    self._size = mmap.PAGESIZE
+    self._buffer = None
+    self._buffer = self._allocate(self._size)
+    self._workers = []
+    try:
+      for procid in builtins.range(1, nprocs):
+        self._workers.append(self._start())
+      for handle, tasks, status in self._workers: # wait for the workers to be ready
+        try:
+          status.recv()
+        except EOFError:
+          raise Exception('failed to start worker process') from None
+    except:
+      self.close()
+      raise
+
+  def run(self, name, nitems, func, shapes, *args):
+    '''evaluate ``func`` in all processes of the pool, see :func:`loop`
+
+    Returns :any:`None`, without evaluating ``func``, if ``func`` or ``args``
+    cannot be pickled. If a worker process died the pool is closed and
+    deactivated, and :any:`None` is returned as well.'''
+
+    if not self._workers:
+      raise Exception('pool is closed')
+    try:
+      isnew = func not in self._funcs
+    except TypeError: # not hashable
+      isnew = True
+    try:
+      payload = pickle.dumps((func if isnew else None, args))
+    except (pickle.PicklingError, AttributeError, TypeError):
+      return None
+    layout = []
+    size = 0
+    for shape, dtype in shapes:
+      shape = (int(shape),) if numeric.isint(shape) else tuple(builtins.map(int, shape))
+      dtype = numpy.dtype(dtype)
+      layout.append((size, shape, dtype.str))
+      size += -(-util.product(shape, dtype.itemsize) // 64) * 64 # align to 64 bytes
+    if size > self._size:
+      self._size = max(size, 2 * self._size)
+      self._buffer = self._allocate(self._size)
+    funcid, forget = self._register(func)
+    self._index.value = 0
+    task = pickle.dumps((self._buffer, layout, nitems, funcid, forget, payload))
+    busy = [] # workers that received the task
+    broken = False
+    try:
+      try:
+        for worker in self._workers:
+          worker[1].send_bytes(task)
+          busy.append(worker)
+      except OSError: # worker died in an earlier task
+        broken = True
+        with self._lock:
+          self._index.value = nitems # stop the workers that received the task from claiming indices
+      if not broken:
+        arrays = self._arrays(self._buffer, layout)
+        with treelog.iter.wrap(_pct(name, nitems), self._range(nitems)) as indices, maxprocs(1):
+          func(indices, arrays, *args)
+    except:
+      with self._lock:
+        self._index.value = nitems # stop workers from claiming further indices
+      raise
+    finally:
+      errors = []
+      for handle, tasks, status in busy:
+        try:
+          error = status.recv()
+        except (OSError, EOFError): # worker died
+          broken = True
+        else:
+          if error:
+            errors.append(error)
+      if errors and funcid is not None and self._funcs.get(func) == funcid:
+        # the workers may have failed to store the function
+        del self._funcs[func]
+        self._forget.append(funcid)
+      if broken:
+        warnings.warn('a worker process of the pool died, continuing without pool')
+        self.close()
+        if _pool.value is self:
+          _pool.value = None
+    if broken:
+      return None
+    if errors:
+      raise Exception('pool task failed in {} out of {} processes: {}'.format(len(errors), self.nprocs, errors[0]))
+    return tuple(numpy.array(array) for array in arrays) # copy to free the buffer for the next task
+
+  def close(self):
+    '''terminate the worker processes'''
+
+    workers, self._workers = self._workers, []
+    for handle, tasks, status in workers:
+      try:
+        tasks.send_bytes(b'')
+        tasks.close()
+      except OSError: # worker died
+        pass
+      status.close()
+    if workers:
+      with treelog.context('waiting for pool processes'):
+        for handle, tasks, status in workers:
+          self._join(handle)
+    self._funcs.clear()
+    if self._buffer is not None:
+      self._release()
+      self._buffer = None
+
+  def _register(self, func):
+    # Return the id of `func` and the ids that the workers should forget. A
+    # function that is not hashable has no id and is sent with every task.
+    forget, self._forget = self._forget, []
+    try:
+      funcid = self._funcs.pop(func)
+    except KeyError:
+      funcid = self._nextid
+      self._nextid += 1
+    except TypeError:
+      return None, forget
+    self._funcs[func] = funcid
+    while len(self._funcs) > self._maxfuncs:
+      forget.append(self._funcs.pop(next(iter(self._funcs))))
+    return funcid, forget
+
+  def _serve(self, tasks, status): # pragma: no cover
+    funcs = {}
+    status.send(None) # ready
+    while True:
+      try:
+        task = tasks.recv_bytes()
+      except EOFError: # main process died
+        return
+      if not task:
+        return
+      try:
+        buffer, layout, nitems, funcid, forget, payload = pickle.loads(task)
+        for oldid in forget:
+          funcs.pop(oldid, None)
+        func, args = pickle.loads(payload)
+        if func is None:
+          func = funcs[funcid]
+        elif funcid is not None:
+          funcs[funcid] = func
+        func(self._range(nitems), self._arrays(buffer, layout), *args)
+      except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+      else:
+        error = None
+      task = payload = func = args = None # release references to the arguments
+      status.send(error)
+
+  def _arrays(self, buffer, layout):
+    buf = self._attach(buffer)
+    return tuple(numpy.frombuffer(buf, dtype=dtype, count=util.product(shape, 1), offset=offset).reshape(shape) for offset, shape, dtype in layout)
+
+  def _range(self, nitems):
+    while True:
+      with self._lock:
+        iiter = self._index.value # claim next value
+        if iiter >= nitems:
+          return
+        self._index.value = iiter + 1
+      yield iiter
+
+class ForkPool(Pool):
+  '''pool of forked worker processes, see :func:`pool`'''
+
+  def _start(self):
+    tasks, taskw = multiprocessing.Pipe(duplex=False)
+    statusr, status = multiprocessing.Pipe(duplex=False)
+    pid = os.fork()
+    if not pid: # pragma: no cover
+      try:
+        taskw.close()
+        statusr.close()
+        for handle, tasks_, status_ in self._workers:
+          tasks_.close()
+          status_.close()
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # disable sigint (ctrl+c) handler
+        treelog.current = treelog.NullLog() # silence treelog
+        with maxprocs(1):
+          self._serve(tasks, status)
+      finally:
+        os._exit(0)
+    tasks.close()
+    status.close()
+    return pid, taskw, statusr
+
+  def _join(self, pid):
+    _wait(pid)
+
+  def _allocate(self, size):
+    # The buffer is a temporary file that is inherited by the workers, and
+    # that is grown in place; tasks refer to it by size.
+    if self._buffer is None:
+      self._file = tempfile.TemporaryFile(dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+      self._map = None
+    self._file.truncate(size)
+    return size
+
+  def _attach(self, size):
+    if self._map is None or len(self._map) != size:
+      self._map = mmap.mmap(self._file.fileno(), size)
+    return self._map
+
+  def _release(self):
+    self._map = None
+    self._file.close()
+
+class SpawnPool(Pool):
+  '''pool of spawned worker processes, see :func:`pool`
+
+  The workers are fresh interpreters that share nothing with the main process
+  but the objects that are pickled to them, which makes this pool safe to use
+  in processes that run threads (e.g. of MKL or OpenBLAS) or that hold open
+  file handles. The result arrays are placed in
+  :class:`multiprocessing.shared_memory.SharedMemory` blocks; tasks refer to
+  them by name. As with all spawned processes, the main module of a script
+  must be importable without side effects, i.e., guard the entry point by
+  ``if __name__ == '__main__'``.
+  '''
+
+  _context = multiprocessing.get_context('spawn')
+
+  def __getstate__(self):
+    # the state that is sent to the workers upon spawning
+    return dict(nprocs=self.nprocs, _index=self._index, _lock=self._lock)
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._shm = None
+
+  def _start(self):
+    tasks, taskw = self._context.Pipe(duplex=False)
+    statusr, status = self._context.Pipe(duplex=False)
+    process = self._context.Process(target=_spawned, args=(self, tasks, status), daemon=True)
+    process.start()
+    tasks.close()
+    status.close()
+    return process, taskw, statusr
+
+  def _join(self, process):
+    process.join()
+    if process.exitcode:
+      treelog.error('process {} exited with status {}'.format(process.pid, process.exitcode))
+
+  def _allocate(self, size):
+    from multiprocessing import shared_memory
+    if self._buffer is not None:
+      self._release()
+    self._shm = shared_memory.SharedMemory(create=True, size=size)
+    return self._shm.name
+
+  def _attach(self, name):
+    if self._shm is None or self._shm.name != name:
+      from multiprocessing import shared_memory
+      self._shm = shared_memory.SharedMemory(name=name)
+    return self._shm.buf
+
+  def _release(self):
+    self._shm.unlink()
+    try:
+      self._shm.close()
+    except BufferError: # the memory is released when the last array is deleted
+      pass
+    self._shm = None
+
+def _spawned(pool, tasks, status): # pragma: no cover
+  signal.signal(signal.SIGINT, signal.SIG_IGN) # disable sigint (ctrl+c) handler
+  treelog.current = treelog.NullLog() # silence treelog
+  with maxprocs(1):
+    pool._serve(tasks, status)
+
 def _pct(name, n):
   '''helper function for ctxrange'''
 
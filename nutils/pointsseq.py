@@ -44,7 +44,7 @@ class PointsSequence(types.Singleton):
   '''
 
   __slots__ = 'ndims'
-  __cache__ = 'npoints', 'tri', 'hull'
+  __cache__ = 'npoints', 'offsets', 'tri', 'hull'
 
   @staticmethod
   def from_iter(value: Iterable[Points], ndims: int) -> 'PointsSequence':
@@ -304,6 +304,18 @@ class PointsSequence(types.Singleton):
       else:
         return _balanced_chain(selfitems + otheritems)
 
+  @property
+  def offsets(self) -> numpy.ndarray:
+    '''Offsets of the points of every item in the concatenation of all points.
+
+    A one-dimensional integer array of length ``len(self)+1``, such that the
+    points of item ``i`` are numbered ``offsets[i]`` to ``offsets[i+1]``.
+    '''
+
+    offsets = numpy.cumsum([0]+[points.npoints for points in self])
+    offsets.flags.writeable = False
+    return offsets
+
   @property
   def tri(self) -> numpy.ndarray:
     '''Triangulation of interior.
@@ -312,14 +324,7 @@ class PointsSequence(types.Singleton):
     row defines a simplex by mapping vertices into the list of points.
     '''
 
-    tri = []
-    offset = 0
-    for points in self:
-      tri.append(points.tri + offset)
-      offset += points.npoints
-    tri = numpy.concatenate(tri) if tri else numpy.zeros((0,self.ndims+1), int)
-    tri.flags.writeable = False
-    return tri
+    return self._mk_connectivity('tri', self.ndims+1)
 
   @property
   def hull(self) -> numpy.ndarray:
@@ -331,14 +336,26 @@ class PointsSequence(types.Singleton):
     triangulations originating from separate elements are disconnected.
     '''
 
-    hull = []
-    offset = 0
-    for points in self:
-      hull.append(points.hull + offset)
-      offset += points.npoints
-    hull = numpy.concatenate(hull) if hull else numpy.zeros((0,self.ndims), int)
-    hull.flags.writeable = False
-    return hull
+    return self._mk_connectivity('hull', self.ndims)
+
+  def _mk_connectivity(self, attr: str, ncols: int) -> numpy.ndarray:
+    # Group the items by points, such that the connectivity of every unique
+    # points is broadcast over all items of the group in a single operation.
+    groups = {}
+    for i, points in enumerate(self):
+      groups.setdefault(points, []).append(i)
+    templates = {points: getattr(points, attr) for points in groups}
+    counts = numpy.empty(len(self), dtype=int)
+    for points, indices in groups.items():
+      counts[indices] = len(templates[points])
+    starts = numpy.cumsum(counts) - counts
+    offsets = self.offsets
+    conn = numpy.empty((counts.sum(), ncols), dtype=int)
+    for points, indices in groups.items():
+      template = templates[points]
+      conn[starts[indices,None] + numpy.arange(len(template))] = template + offsets[indices,None,None]
+    conn.flags.writeable = False
+    return conn
 
   def get_evaluable_coords(self, index: evaluable.Array) -> evaluable.Array:
     if index.ndim != 0 or index.dtype != int:
@@ -383,7 +400,7 @@ class _Plain(PointsSequence):
 class _Uniform(PointsSequence):
 
   __slots__ = 'item', 'length'
-  __cache__ = 'tri', 'hull'
+  __cache__ = 'offsets', 'tri', 'hull'
 
   def __init__(self, item, length):
     assert length >= 0, 'length should be nonnegative'
@@ -427,6 +444,12 @@ class _Uniform(PointsSequence):
     else:
       return super().product(other)
 
+  @property
+  def offsets(self) -> numpy.ndarray:
+    offsets = numpy.arange(0, (len(self)+1)*self.item.npoints, self.item.npoints)
+    offsets.flags.writeable = False
+    return offsets
+
   def _mk_indices(self, item: numpy.ndarray) -> numpy.ndarray:
     npoints = self.item.npoints
     ind = item[None] + numpy.arange(0, len(self)*npoints, npoints)[:,None,None]
@@ -35,7 +35,7 @@ selected sample points, and is typically used in combination with the "bezier"
 set.
 '''
 
-from . import types, points, util, function, evaluable, parallel, numeric, matrix, transformseq, sparse
+from . import types, points, util, function, evaluable, parallel, numeric, matrix, transformseq, sparse, cache, _perf
 from .pointsseq import PointsSequence
 import numpy, numbers, collections.abc, os, treelog as log, abc
 
@@ -119,6 +119,11 @@ class Sample(types.Singleton):
   def index(self):
     return tuple(map(self.getindex, range(self.nelems)))
 
+  @property
+  def _flatindex(self):
+    # indices of all points in the order of `self.points`
+    return numpy.concatenate(self.index) if self.nelems else numpy.zeros((0,), dtype=int)
+
   @abc.abstractmethod
   def getindex(self, ielem):
     '''Return the indices of `Sample.points[ielem]` in results of `Sample.eval`.'''
@@ -163,6 +168,24 @@ class Sample(types.Singleton):
     with log.iter.fraction('assembling', datas) as items:
       return [_convert(data, inplace=True) for data in items]
 
+  @util.positional_only
+  @util.single_or_multiple
+  @types.apply_annotations
+  def integrate_batched(self, funcs, arguments:argdict=...):
+    '''Integrate functions for a batch of arguments.
+
+    See :func:`eval_integrals_batched` for the handling of batched arguments.
+
+    Args
+    ----
+    funcs : :class:`nutils.function.Array` object or :class:`tuple` thereof.
+        The integrand(s).
+    arguments : :class:`dict`
+        Arguments for function evaluation, of which at least one is batched.
+    '''
+
+    return eval_integrals_batched(*map(self.integral, funcs), **arguments)
+
   @util.single_or_multiple
   @types.apply_annotations
   def integrate_sparse(self, funcs:types.tuple[function.asarray], arguments:types.frozendict[str,types.frozenarray]=None):
@@ -276,7 +299,7 @@ class Sample(types.Singleton):
     row defines a simplex by mapping vertices into the list of points.
     '''
 
-    return numpy.concatenate([self.getindex(ielem).take(points.tri) for ielem, points in enumerate(self.points)])
+    return self._flatindex.take(self.points.tri)
 
   @property
   def hull(self):
@@ -288,7 +311,7 @@ class Sample(types.Singleton):
     triangulations originating from separate elements are disconnected.
     '''
 
-    return numpy.concatenate([self.getindex(ielem).take(points.hull) for ielem, points in enumerate(self.points)])
+    return self._flatindex.take(self.points.hull)
 
   def subset(self, mask):
     '''Reduce the number of points.
@@ -309,7 +332,8 @@ class Sample(types.Singleton):
     subset : :class:`Sample`
     '''
 
-    selection = types.frozenarray([ielem for ielem in range(self.nelems) if mask[self.getindex(ielem)].any()])
+    ielems = numpy.repeat(numpy.arange(self.nelems), numpy.diff(self.points.offsets))
+    selection = types.frozenarray(numpy.unique(ielems[numpy.asarray(mask, dtype=bool)[self._flatindex]]))
     transforms = tuple(transform[selection] for transform in self.transforms)
     return Sample.new(transforms, self.points.take(selection))
 
@@ -322,11 +346,15 @@ class _DefaultIndex(Sample):
 
   @property
   def offsets(self):
-    return numpy.cumsum([0]+[p.npoints for p in self.points])
+    return self.points.offsets
 
   def getindex(self, ielem):
     return numpy.arange(self.offsets[ielem], self.offsets[ielem+1])
 
+  @property
+  def _flatindex(self):
+    return numpy.arange(self.npoints)
+
   @property
   def tri(self):
     return self.points.tri
@@ -343,6 +371,7 @@ class _DefaultIndex(Sample):
 class _CustomIndex(Sample):
 
   __slots__ = '_index'
+  __cache__ = '_flatindex'
 
   def __init__(self, transforms, points, index):
     self._index = index
@@ -359,6 +388,10 @@ class _CustomIndex(Sample):
   def getindex(self, ielem):
     return self._index[ielem]
 
+  @property
+  def _flatindex(self):
+    return super()._flatindex
+
 @types.apply_annotations
 def eval_integrals(*integrals: types.tuple, **arguments:argdict):
   '''Evaluate integrals.
@@ -404,10 +437,59 @@ def eval_integrals_sparse(*integrals: types.tuple, **arguments: argdict):
   results : :class:`tuple` of arrays and/or :class:`nutils.matrix.Matrix` objects.
   '''
 
-  integrals = tuple(integral.as_evaluable_array().assparse for integral in integrals)
-  with evaluable.Tuple(tuple(integrals)).optimized_for_numpy.session(graphviz=graphviz) as eval:
+  with _optimized_for_numpy(evaluable.Tuple(tuple(integral.as_evaluable_array() for integral in integrals))).session(graphviz=graphviz) as eval, _perf.timer('assembly'):
     return eval(**arguments)
 
+@types.apply_annotations
+def eval_integrals_batched(*integrals: types.tuple, **arguments: argdict):
+  '''Evaluate integrals for a batch of arguments.
+
+  Evaluate one or several postponed integrals for several values of the
+  arguments at once, for instance for multiple load cases or parameter
+  values. Arguments that have one more dimension than the corresponding
+  :class:`~nutils.function.Argument` are stacked along a leading batch axis;
+  all other arguments are shared by the entire batch. The elements are
+  traversed once for the entire batch, such that geometry and basis functions
+  are evaluated only once.
+
+  Args
+  ----
+  integrals : :class:`tuple` of integrals
+      Integrals to be evaluated.
+  arguments : :class:`dict`
+      Arguments for function evaluation, of which at least one is batched.
+
+  Returns
+  -------
+  results : :class:`tuple`
+      Per integral an array with a leading batch axis, or for two-dimensional
+      integrals a :class:`tuple` of :class:`nutils.matrix.Matrix` objects.
+  '''
+
+  func = _optimized_for_numpy(evaluable.Tuple(tuple(integral.as_evaluable_array() for integral in integrals)))
+  shapes = {arg._name: arg.shape for arg in func.arguments if isinstance(arg, evaluable.Argument)}
+  batched = {name: value for name, value in arguments.items() if name in shapes and value.ndim == len(shapes[name]) + 1}
+  if not batched:
+    raise ValueError('none of the arguments has a batch axis')
+  shared = {name: value for name, value in arguments.items() if name not in batched}
+  members = func.eval_batched(batched, **shared)
+  retvals = []
+  for i in range(len(integrals)):
+    datas = [member[i] for member in members]
+    # data that does not depend on the batched arguments is shared by all
+    # members and converted only once
+    unique = {id(data): data for data in datas}
+    converted = {key: _convert(data, inplace=False) for key, data in unique.items()}
+    items = [converted[id(data)] for data in datas]
+    retvals.append(tuple(items) if sparse.ndim(datas[0]) >= 2 else numpy.stack(items))
+  return tuple(retvals)
+
+@cache.graph
+def _optimized_for_numpy(integrals):
+  '''Convert integrals to sparse form and optimize for evaluation.'''
+
+  return evaluable.Tuple(tuple(integral.assparse for integral in integrals)).optimized_for_numpy
+
 def _convert(data, inplace=False):
   '''Convert a two-dimensional sparse object to an appropriate object.
 
@@ -50,7 +50,7 @@ In addition to ``solve_linear`` the solver module defines ``newton`` and
 time dependent problems.
 """
 
-from . import function, evaluable, cache, numeric, sample, types, util, matrix, warnings, sparse
+from . import function, evaluable, cache, numeric, sample, types, util, matrix, warnings, sparse, _perf
 import abc, numpy, itertools, functools, numbers, collections, math, inspect, treelog as log
 
 
@@ -154,9 +154,10 @@ class withsolve(iterable):
     norm and other generator-dependent information.
     '''
   
-    with log.iter.wrap(_progress(self.__class__.__name__, tol), self) as items:
+    with log.iter.wrap(_progress(self.__class__.__name__, tol), self) as items, _perf.solver(self.__class__.__name__) as record:
       i = 0
       for lhs, info in items:
+        record(info.resnorm)
         if info.resnorm <= tol:
           break
         if i > maxiter:
@@ -182,8 +183,14 @@ class LineSearch(types.Immutable):
   directional derivative, with derivatives normalized to unit length; and
   returns the optimal scaling and a boolean flag that marks whether the
   candidate should be accepted.
+
+  Line searches that do not use the candidate directional derivative set
+  ``trialtangent`` to ``False``, in which case ``None`` is passed instead and
+  solvers postpone the assembly of the jacobian until a candidate is accepted.
   '''
 
+  trialtangent = True
+
   @abc.abstractmethod
   def __call__(self, res0, dres0, res1, dres1):
     raise NotImplementedError
@@ -314,6 +321,72 @@ class MedianBased(LineSearch, version=1):
     log.info('estimated {}-quantile at {:.0f}% of update vector'.format(self.quantile, scale*100))
     return min(max(scale, self.minscale), self.maxscale), scale >= self.acceptscale
 
+class Backtracking(LineSearch):
+  '''
+  Residual-only line search for Newton-like iterations, accepting candidates
+  that satisfy the Armijo condition of sufficient decrease of the squared
+  residual norm, and backtracking to the minimum of a quadratic interpolation
+  otherwise. The directional derivative at the candidate is not used, so that
+  the jacobian is assembled only for accepted candidates.
+
+  Parameters
+  ----------
+  minscale : :class:`float`
+      Minimum relaxation scaling per update. Must be strictly greater than
+      zero.
+  maxscale : :class:`float`
+      Maximum relaxation scaling per update. Must be greater than one,
+      determining how fast relaxation values rebound to one.
+  armijo : :class:`float`
+      Fraction of the decrease predicted by the directional derivative that
+      must be attained for a candidate to be accepted. Must lie between zero
+      and one half.
+  '''
+
+  trialtangent = False
+
+  @types.apply_annotations
+  def __init__(self, minscale:float=.1, maxscale:float=2., armijo:float=1e-4):
+    assert 0 < minscale < 1 < maxscale
+    assert 0 < armijo < .5
+    self.minscale = minscale
+    self.maxscale = maxscale
+    self.armijo = armijo
+
+  def __call__(self, res0, dres0, res1, dres1):
+    if not numpy.isfinite(res1).all():
+      log.info('non-finite residual')
+      return self.minscale, False
+    # The residual norm is estimated by the quadratic P(x) = p0 + q0 x + c x^2
+    # that matches the squared norm and slope at x=0 and the squared norm at x=1
+    p0 = res0@res0
+    q0 = 2*res0@dres0
+    p1 = res1@res1
+    if q0 >= 0:
+      raise SolverError('search vector does not reduce residual')
+    c = p1 - p0 - q0
+    scale = -q0 / (2*c) if c > 0 else math.inf
+    log.info('estimated residual minimum at {:.0f}% of update vector'.format(scale*100))
+    # Rejection implies c > (1-armijo) |q0|, hence scale < 1/(2-2*armijo) < 1
+    return min(max(scale, self.minscale), self.maxscale), p1 <= p0 + self.armijo * q0
+
+class SecantBased(NormBased):
+  '''
+  Residual-only variant of :class:`NormBased` that estimates the directional
+  derivative at the candidate from a secant, ``2 (res1 - res0) - dres0``,
+  rather than requiring the jacobian at the candidate. The estimate is exact
+  for residuals that are quadratic in the argument. The parameters are those
+  of :class:`NormBased`.
+  '''
+
+  trialtangent = False
+
+  def __call__(self, res0, dres0, res1, dres1):
+    if not numpy.isfinite(res1).all():
+      log.info('non-finite residual')
+      return self.minscale, False
+    return super().__call__(res0, dres0, res1, 2*(res1-res0)-dres0)
+
 
 ## SOLVERS
 
@@ -390,6 +463,15 @@ class newton(cache.Recursion, length=1):
       Callable that defines relaxation logic.
   failrelax : :class:`float`
       Fail with exception if relaxation reaches this lower limit.
+  refresh : :class:`float`
+      Maximum number of iterations that use the same jacobian (modified
+      Newton). In between refreshes only the residual is assembled and the
+      factorization of the jacobian's preconditioner is reused. The default
+      value 1 reassembles the jacobian every iteration; ``float('inf')``
+      reassembles it only when convergence stalls (see ``refreshratio``).
+  refreshratio : :class:`float`
+      Reassemble the jacobian ahead of schedule if an iteration with a reused
+      jacobian reduces the residual norm by less than this factor.
   arguments : :class:`collections.abc.Mapping`
       Defines the values for :class:`nutils.function.Argument` objects in
       `residual`.  The ``target`` should not be present in ``arguments``.
@@ -402,7 +484,7 @@ class newton(cache.Recursion, length=1):
   '''
 
   @types.apply_annotations
-  def __init__(self, target, residual:integraltuple, jacobian:integraltuple=None, lhs0:types.frozenarray[types.strictfloat]=None, relax0:float=1., constrain:arrayordict=None, linesearch=None, failrelax:types.strictfloat=1e-6, arguments:argdict={}, **kwargs):
+  def __init__(self, target, residual:integraltuple, jacobian:integraltuple=None, lhs0:types.frozenarray[types.strictfloat]=None, relax0:float=1., constrain:arrayordict=None, linesearch=None, failrelax:types.strictfloat=1e-6, refresh:float=1., refreshratio:float=.5, arguments:argdict={}, **kwargs):
     super().__init__()
     self.target = target
     self.residual = residual
@@ -411,13 +493,17 @@ class newton(cache.Recursion, length=1):
     self.relax0 = relax0
     self.linesearch = linesearch or NormBased.legacy(kwargs)
     self.failrelax = failrelax
+    if refresh < 1:
+      raise ValueError('refresh should be at least 1')
+    self.refresh = refresh
+    self.refreshratio = refreshratio
     self.solveargs = _strip(kwargs, 'lin')
     if kwargs:
       raise TypeError('unexpected keyword arguments: {}'.format(', '.join(kwargs)))
     self.solveargs.setdefault('rtol', 1e-3)
 
-  def _eval(self, lhs, mask):
-    return _integrate_blocks(self.residual, self.jacobian, arguments=lhs, mask=mask)
+  def _eval(self, lhs, mask, jacobian=True):
+    return _integrate_blocks(self.residual, self.jacobian if jacobian else None, arguments=lhs, mask=mask)
 
   def resume(self, history):
     mask, vmask = _invert(self.constrain, self.target)
@@ -432,13 +518,29 @@ class newton(cache.Recursion, length=1):
       res, jac = self._eval(lhs, mask)
       relax = self.relax0
       yield lhs, types.attributes(resnorm=numpy.linalg.norm(res), relax=relax)
+    nsolves = 0 # number of solves with the current jacobian
     while True:
-      dlhs = -jac.solve_leniently(res, **self.solveargs) # compute new search vector
+      dlhs = -jac.solve_leniently(res, **self.solveargs) # compute new search vector, reusing jac's preconditioner if not refreshed
+      nsolves += 1
       res0 = res
       dres = jac@dlhs # == -res if dlhs was solved to infinite precision
       vlhs[vmask] += relax * dlhs
-      res, jac = self._eval(lhs, mask)
-      scale, accept = self.linesearch(res0, relax*dres, res, relax*(jac@dlhs))
+      if nsolves < self.refresh:
+        res, newjac = self._eval(lhs, mask, jacobian=False)
+        ratio = numpy.linalg.norm(res) / numpy.linalg.norm(res0)
+        if ratio <= self.refreshratio:
+          log.info('update accepted at relaxation {}, reusing jacobian (residual ratio {:.2f})'.format(round(relax, 5), ratio))
+          yield lhs, types.attributes(resnorm=numpy.linalg.norm(res), relax=relax)
+          continue
+        log.info('refreshing jacobian: residual ratio {:.2f} exceeds {}'.format(ratio, self.refreshratio))
+        if self.linesearch.trialtangent: # complete the evaluation at the trial point, keeping res
+          _, newjac = _integrate_blocks(None, self.jacobian, arguments=lhs, mask=mask)
+      else:
+        if self.refresh > 1:
+          log.info('refreshing jacobian after {} iterations'.format(nsolves))
+        res, newjac = self._eval(lhs, mask, jacobian=self.linesearch.trialtangent)
+      nsolves = 0
+      scale, accept = self.linesearch(res0, relax*dres, res, relax*(newjac@dlhs) if newjac is not None else None)
       while not accept: # line search
         assert scale < 1
         oldrelax = relax
@@ -446,8 +548,11 @@ class newton(cache.Recursion, length=1):
         if relax <= self.failrelax:
           raise SolverError('stuck in local minimum')
         vlhs[vmask] += (relax - oldrelax) * dlhs
-        res, jac = self._eval(lhs, mask)
-        scale, accept = self.linesearch(res0, relax*dres, res, relax*(jac@dlhs))
+        res, newjac = self._eval(lhs, mask, jacobian=self.linesearch.trialtangent)
+        scale, accept = self.linesearch(res0, relax*dres, res, relax*(newjac@dlhs) if newjac is not None else None)
+      if newjac is None: # line search did not require the jacobian at trial points
+        _, newjac = _integrate_blocks(None, self.jacobian, arguments=lhs, mask=mask)
+      jac = newjac
       log.info('update accepted at relaxation', round(relax, 5))
       relax = min(relax * scale, 1)
       yield lhs, types.attributes(resnorm=numpy.linalg.norm(res), relax=relax)
@@ -750,6 +855,122 @@ impliciteuler = functools.partial(thetamethod, theta=1)
 cranknicolson = functools.partial(thetamethod, theta=0.5)
 
 
+@iterable.single_or_multiple
+class adaptivethetamethod(thetamethod.__wrapped__, length=3):
+  '''solve time dependent problem using the theta method with adaptive timestep
+
+  Like :class:`thetamethod`, but the timestep is adjusted such that an estimate
+  of the local truncation error stays below ``timesteptol``. Every Newton solve
+  starts from a polynomial extrapolation of the preceding solutions, second
+  order for ``theta=0.5`` and first order otherwise, and the difference
+  between this predictor and the solution serves as error estimate. During
+  the first steps, for which insufficient history is available, the initial
+  timestep is used without error control. Steps that exceed the tolerance or
+  fail to converge are repeated with a smaller timestep.
+
+  Parameters
+  ----------
+  target : :class:`str`
+      Name of the target: a :class:`nutils.function.Argument` in ``residual``.
+  residual : :class:`nutils.evaluable.AsEvaluableArray`
+  inertia : :class:`nutils.evaluable.AsEvaluableArray`
+  timestep : :class:`float`
+      Initial time step.
+  theta : :class:`float`
+      Theta value (theta=1 for implicit Euler, theta=0.5 for Crank-Nicolson)
+  timesteptol : :class:`float`
+      Tolerance for the norm of the estimated local truncation error.
+  mintimestep : :class:`float`
+      Lower bound for the timestep. Steps at this bound are accepted
+      regardless of the error estimate. Default: ``0.0``.
+  maxtimestep : :class:`float`
+      Upper bound for the timestep. Default: no bound.
+  maxgrowth : :class:`float`
+      Maximum factor by which the timestep grows per step. Default: ``2.0``.
+  timesteptarget : :class:`str`
+      Name under which the timestep of the next step is stored in the yielded
+      coefficient dictionary. Optional.
+
+  For the remaining parameters see :class:`thetamethod`.
+
+  Yields
+  ------
+  :class:`numpy.ndarray`
+      Coefficient vector for all timesteps after the initial condition.
+  '''
+
+  @types.apply_annotations
+  def __init__(self, target, residual:integraltuple, inertia:optionalintegraltuple, timestep:types.strictfloat, theta:types.strictfloat, timesteptol:types.strictfloat, lhs0:types.frozenarray[types.strictfloat]=None, constrain:arrayordict=None, newtontol:types.strictfloat=1e-10, arguments:argdict={}, newtonargs:types.frozendict={}, timetarget:types.strictstr='_thetamethod_time', time0:types.strictfloat=0., historysuffix:types.strictstr='0', mintimestep:types.strictfloat=0., maxtimestep:types.strictfloat=float('inf'), maxgrowth:types.strictfloat=2., timesteptarget:types.strictstr='_thetamethod_timestep'):
+    if not mintimestep <= timestep <= maxtimestep:
+      raise ValueError('initial timestep is out of bounds')
+    if maxgrowth <= 1:
+      raise ValueError('maxgrowth should be larger than one')
+    super().__init__(target, residual, inertia, timestep, theta, lhs0=lhs0, constrain=constrain, newtontol=newtontol, arguments=arguments, newtonargs=newtonargs, timetarget=timetarget, time0=time0, historysuffix=historysuffix)
+    self.timesteptol = timesteptol
+    self.mintimestep = mintimestep
+    self.maxtimestep = maxtimestep
+    self.maxgrowth = maxgrowth
+    self.timesteptarget = timesteptarget
+    self.lhs0[timesteptarget] = numpy.array(timestep)
+    # Order of the method and ratio of the local truncation error and the
+    # difference between solution and predictor, for constant timesteps.
+    if theta == .5:
+      self.order, self.errorratio = 2, 1/11
+    else:
+      self.order, self.errorratio = 1, abs(theta-.5) / (theta+.5)
+
+  def _predict(self, history, time):
+    '''polynomial extrapolation of the targets in ``history`` to ``time``'''
+
+    times = [lhs[self.timetarget] for lhs in history]
+    weights = [numpy.prod([(time-tj)/(ti-tj) for j, tj in enumerate(times) if j != i]) for i, ti in enumerate(times)]
+    return {target: numpy.choose(self.constrain[target], [sum(w * lhs[target] for w, lhs in zip(weights, history)), history[-1][target]]) for target in self.target}
+
+  def _solve(self, lhs0, dt, predictor):
+    arguments = lhs0.copy()
+    arguments.update((old, lhs0[new]) for old, new in self.old_new)
+    arguments[self.timetarget] = lhs0[self.timetarget] + dt
+    arguments.update(predictor)
+    return newton(self.target, residual=self.residuals, jacobian=self.jacobians, constrain=self.constrain, arguments=arguments, **self.newtonargs).solve(tol=self.newtontol)
+
+  def resume(self, history):
+    if history:
+      history = list(history)
+    else:
+      history = [self.lhs0]
+      yield self.lhs0
+    while True:
+      lhs0 = history[-1]
+      dt = float(lhs0[self.timesteptarget])
+      startup = len(history) <= self.order
+      while True:
+        predictor = self._predict(history[-1-self.order:], lhs0[self.timetarget] + dt)
+        try:
+          lhs = self._solve(lhs0, dt, predictor)
+        except (SolverError, matrix.MatrixError) as e:
+          if dt <= self.mintimestep:
+            raise
+          dt = max(dt/2, self.mintimestep)
+          log.error('error: {}; retrying with timestep {:.2e}'.format(e, dt))
+          continue
+        if startup:
+          log.info('timestep {:.2e} accepted without error estimate'.format(dt))
+          nextdt = dt
+          break
+        error = self.errorratio * numpy.linalg.norm(numpy.concatenate([(lhs[target] - predictor[target]).ravel() for target in self.target]))
+        scale = min(max(.9 * (self.timesteptol / error)**(1/(self.order+1)), .2), self.maxgrowth) if error else self.maxgrowth
+        if error <= self.timesteptol or dt <= self.mintimestep:
+          nextdt = min(max(dt * scale, self.mintimestep), self.maxtimestep)
+          log.info('timestep {:.2e} accepted with estimated error {:.1e}; next timestep {:.2e}'.format(dt, error, nextdt))
+          break
+        dt = max(dt * scale, self.mintimestep)
+        log.info('estimated error {:.1e} exceeds tolerance; retrying with timestep {:.2e}'.format(error, dt))
+      lhs = dict(lhs)
+      lhs[self.timesteptarget] = numpy.array(nextdt)
+      yield lhs
+      history = history[1-self.length:] + [lhs]
+
+
 @log.withcontext
 @single_or_multiple
 @types.apply_annotations
@@ -826,6 +1047,8 @@ def optimize(target, functional:evaluable.asarray, *, tol:types.strictfloat=0.,
     with log.context('newton {:.0f}%', 0) as reformat:
       while not numpy.isfinite(resnorm) or resnorm > tol:
         if accept:
+          if jac is None: # line search did not require the jacobian at trial points
+            val, res, jac = _integrate_blocks(functional, residual, jacobian, arguments=lhs, mask=mask)
           reformat(100 * numpy.log(firstresnorm/resnorm) / numpy.log(firstresnorm/tol))
           dlhs = -jac.solve_leniently(res, **solveargs)
           res0 = res
@@ -833,9 +1056,9 @@ def optimize(target, functional:evaluable.asarray, *, tol:types.strictfloat=0.,
           relax0 = 0
         vlhs[vmask] += (relax - relax0) * dlhs
         relax0 = relax # currently applied relaxation
-        val, res, jac = _integrate_blocks(functional, residual, jacobian, arguments=lhs, mask=mask)
+        val, res, jac = _integrate_blocks(functional, residual, jacobian if linesearch.trialtangent else None, arguments=lhs, mask=mask)
         resnorm = numpy.linalg.norm(res)
-        scale, accept = linesearch(res0, relax*dres, res, relax*(jac@dlhs))
+        scale, accept = linesearch(res0, relax*dres, res, relax*(jac@dlhs) if jac is not None else None)
         relax = min(relax * scale, 1)
         if relax <= failrelax:
           raise SolverError('stuck in local minimum')
@@ -942,14 +1165,14 @@ def _integrate_blocks(*blocks, arguments, mask):
   '''helper function for blockwise integration'''
 
   *scalars, residuals, jacobians = blocks
-  assert len(residuals) == len(mask)
-  assert len(jacobians) == len(mask)**2
-  data = iter(sample.eval_integrals_sparse(*scalars, *residuals, *jacobians, **arguments))
+  assert residuals is None or len(residuals) == len(mask)
+  assert jacobians is None or len(jacobians) == len(mask)**2
+  data = iter(sample.eval_integrals_sparse(*scalars, *residuals or (), *jacobians or (), **arguments))
   nrg = [sparse.toarray(next(data)) for _ in range(len(scalars))]
-  res = [sparse.take(next(data), [m]) for m in mask]
-  jac = [[sparse.take(next(data), [mi, mj]) for mj in mask] for mi in mask]
+  res = [sparse.take(next(data), [m]) for m in mask] if residuals is not None else None
+  jac = [[sparse.take(next(data), [mi, mj]) for mj in mask] for mi in mask] if jacobians is not None else None
   assert not list(data)
-  return nrg + [sparse.toarray(sparse.block(res)), matrix.fromsparse(sparse.block(jac), inplace=True)]
+  return nrg + [sparse.toarray(sparse.block(res)) if res is not None else None, matrix.fromsparse(sparse.block(jac), inplace=True) if jac is not None else None]
 
 def _argobjs(funcs):
   '''get :class:`evaluable.Argument` dependencies of multiple functions'''
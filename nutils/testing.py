@@ -22,9 +22,9 @@
 Extensions of the :mod:`unittest` module.
 '''
 
-import unittest, sys, types as builtin_types, operator, contextlib, treelog, functools, importlib, doctest, re, zlib, binascii, warnings as _builtin_warnings
+import unittest, sys, types as builtin_types, operator, contextlib, treelog, functools, importlib, doctest, re, zlib, binascii, warnings as _builtin_warnings, collections, time as _time, tracemalloc
 import numpy
-from nutils import warnings, numeric
+from nutils import warnings, numeric, evaluable
 
 
 def _not_has_module(module):
@@ -227,9 +227,74 @@ class TestCase(unittest.TestCase):
     status.extend(s[i:i+80] for i in range(0, len(s), 80))
     self.fail('\n'.join(status))
 
+  @contextlib.contextmanager
+  def assertBudget(self, *, time=None, memory=None, per=1):
+    '''Assert that the body of the context stays within a budget.
+
+    The wall time of the body and the peak memory allocated by the body, as
+    traced by :mod:`tracemalloc`, are divided by ``per``, e.g. the number of
+    elements, and compared against the respective budgets.
+
+    Args
+    ----
+    time : :class:`float`
+      Maximum wall time in seconds per item, or ``None`` to skip this check.
+    memory : :class:`int`
+      Maximum peak memory in bytes per item, or ``None`` to skip this check.
+    per : :class:`int`
+      Number of items processed by the body.
+
+    If :mod:`tracemalloc` is already tracing, it is left running. On Python
+    versions prior to 3.9, which lack :func:`tracemalloc.reset_peak`, this
+    requires a restart that discards the traces collected before the body.
+    '''
+
+    if memory is not None:
+      tracing = tracemalloc.is_tracing()
+      if not tracing:
+        tracemalloc.start()
+      elif hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+      else:
+        # Python < 3.9 cannot reset the peak of active tracing other than by
+        # restarting it, which discards the traces collected thus far.
+        nframes = tracemalloc.get_traceback_limit()
+        tracemalloc.stop()
+        tracemalloc.start(nframes)
+      base = tracemalloc.get_traced_memory()[0]
+    start = _time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = _time.perf_counter() - start
+      if memory is not None:
+        peak = tracemalloc.get_traced_memory()[1] - base
+        if not tracing:
+          tracemalloc.stop()
+    if time is not None and elapsed > time * per:
+      self.fail('time budget exceeded: {:.2e}s per item, budget: {:.2e}s'.format(elapsed / per, time))
+    if memory is not None and peak > memory * per:
+      self.fail('memory budget exceeded: {:,} bytes per item, budget: {:,} bytes'.format(peak // per, memory))
+
 
 ContextTestCase = TestCase
 
+@contextlib.contextmanager
+def count_evaluations():
+  '''Count evaluations of evaluable nodes.
+
+  Context manager that yields a :class:`collections.Counter`, which is updated
+  on exit with the number of ``evalf`` calls per type name of the evaluated
+  :class:`nutils.evaluable.Evaluable` nodes, e.g. ``'ElemwiseFromCallable'``,
+  and under key ``'iteration'`` with the number of Python level iterations of
+  all evaluated loops, e.g. over the elements of a sample.
+  '''
+
+  counter = collections.Counter()
+  with evaluable.profile(None) as trace:
+    yield counter
+  counter.update(stack[-1] for stack, start, duration, details in trace.events if stack[-1] not in ('eval', 'concat'))
+
 
 class FloatNeighborhoodOutputChecker(doctest.OutputChecker):
 
@@ -361,13 +361,10 @@ class Topology(types.Singleton):
     if arguments is None:
       arguments = {}
 
-    levelset = levelset.prepare_eval(ndims=self.ndims).optimized_for_numpy
-    refs = []
     if leveltopo is None:
-      with log.iter.percentage('trimming', self.references, self.transforms, self.opposites) as items:
-        for ref, trans, opp in items:
-          levels = levelset.eval(_transforms=(trans, opp), _points=ref.getpoints('vertex', maxrefine), **arguments)
-          refs.append(ref.trim(levels, maxrefine=maxrefine, ndivisions=ndivisions))
+      vertices = self.sample('vertex', maxrefine)
+      levels = vertices.eval(levelset, arguments=arguments)
+      elemlevels = [levels[vertices.getindex(ielem)] for ielem in range(len(self))]
     else:
       log.info('collecting leveltopo elements')
       bins = [set() for ielem in range(len(self))]
@@ -375,20 +372,42 @@ class Topology(types.Singleton):
         ielem, tail = self.transforms.index_with_tail(trans)
         bins[ielem].add(tail)
       fcache = cache.WrapperCache()
-      with log.iter.percentage('trimming', self.references, self.transforms, bins) as items:
-        for ref, trans, ctransforms in items:
-          levels = numpy.empty(ref.nvertices_by_level(maxrefine))
-          cover = list(fcache[ref.vertex_cover](frozenset(ctransforms), maxrefine))
-          # confirm cover and greedily optimize order
-          mask = numpy.ones(len(levels), dtype=bool)
-          while mask.any():
-            imax = numpy.argmax([mask[indices].sum() for tail, points, indices in cover])
-            tail, points, indices = cover.pop(imax)
-            levels[indices] = levelset.eval(_transforms=(trans + tail,), _points=points, **arguments)
-            mask[indices] = False
-          refs.append(ref.trim(levels, maxrefine=maxrefine, ndivisions=ndivisions))
+      plan = [] # (ielem, transform, points, indices) in order of assignment
+      for ielem, (ref, trans, ctransforms) in enumerate(zip(self.references, self.transforms, bins)):
+        cover = list(fcache[ref.vertex_cover](frozenset(ctransforms), maxrefine))
+        # confirm cover and greedily optimize order
+        mask = numpy.ones(ref.nvertices_by_level(maxrefine), dtype=bool)
+        while mask.any():
+          imax = numpy.argmax([mask[indices].sum() for tail, points, indices in cover])
+          tail, points, indices = cover.pop(imax)
+          plan.append((ielem, trans + tail, points, indices))
+          mask[indices] = False
       log.debug('cache', fcache.stats)
-    return SubsetTopology(self, refs, newboundary=name)
+      elemlevels = [numpy.empty(ref.nvertices_by_level(maxrefine)) for ref in self.references]
+      if plan:
+        ielems, ctransforms, cpoints, cindices = zip(*plan)
+        covers = Sample.new((transformseq.PlainTransforms(ctransforms, self.ndims),), PointsSequence.from_iter(cpoints, self.ndims))
+        levels = covers.eval(levelset, arguments=arguments)
+        for i, (ielem, indices) in enumerate(zip(ielems, cindices)):
+          elemlevels[ielem][indices] = levels[covers.getindex(i)]
+    # Elements that are not intersected by the levelset are resolved directly,
+    # every distinct combination of reference and levels of the remaining
+    # elements is trimmed only once, in parallel.
+    refs = []
+    cut = {}
+    for ref, levels in zip(self.references, elemlevels):
+      if not ref or numpy.greater_equal(levels, 0).all():
+        refs.append(ref)
+      elif numpy.less_equal(levels, 0).all():
+        refs.append(ref.empty)
+      else:
+        key = ref, levels.tobytes()
+        cut.setdefault(key, (ref, levels))
+        refs.append(key)
+    log.debug('trimming {} distinct out of {} elements'.format(len(cut), len(refs)))
+    trimmed = dict(zip(cut, parallel.map(lambda item: item[0].trim(item[1], maxrefine=maxrefine, ndivisions=ndivisions), cut.values(), name='trimming')))
+    log.debug('trim cache', element.trimcache.stats)
+    return SubsetTopology(self, [trimmed[ref] if isinstance(ref, tuple) else ref for ref in refs], newboundary=name)
 
   def subset(self, topo, newboundary=None, strict=False):
     'intersection'
@@ -536,6 +536,28 @@ class CacheMeta(abc.ABCMeta):
         namespace['__slots__'] = tuple(slots)
     return super().__new__(mcls, name, bases, namespace, **kwargs)
 
+def iscached(obj, attr):
+  '''
+  Test if cached property ``attr`` of ``obj`` holds a value.
+
+  Parameters
+  ----------
+  obj
+      An instance of a class with metaclass :class:`CacheMeta`.
+  attr : :class:`str`
+      The name of a property.
+
+  Returns
+  -------
+  :class:`bool`
+      ``True`` if the property is listed in ``__cache__`` and was evaluated
+      before, ``False`` otherwise. A subclass that overrides a cached property
+      by a regular property is never cached.
+  '''
+
+  prop = getattr(type(obj), attr)
+  return isinstance(prop, _CacheMeta_property) and hasattr(obj, prop.cache_attr)
+
 class ImmutableMeta(CacheMeta):
 
   def __new__(mcls, name, bases, namespace, *, version=0, **kwargs):
@@ -581,6 +603,39 @@ class ImmutableMeta(CacheMeta):
     self._init(*args, **kwargs)
     return self
 
+def _cache_nutils_hashes(items):
+  # Hashing an immutable object requires the hashes of the objects among its
+  # arguments, which for deeply nested objects such as large evaluable graphs
+  # recurses beyond Python's recursion limit. Here we visit the arguments using
+  # an explicit stack and compute the memoized hashes of all nested immutable
+  # objects bottom-up, such that `nutils_hash` finds them in cache.
+  stack = [(item, False) for item in items]
+  visited = set()
+  while stack:
+    obj, ready = stack.pop()
+    t = type(obj)
+    if ready:
+      obj.__nutils_hash__
+    elif t is builtins.tuple or t is frozenset:
+      stack.extend((item, False) for item in obj)
+    elif id(obj) in visited:
+      pass
+    elif isinstance(obj, Immutable):
+      if not iscached(obj, '__nutils_hash__'):
+        visited.add(id(obj))
+        stack.append((obj, True))
+        stack.extend((item, False) for item in obj._args + builtins.tuple(obj._kwargs.values()))
+    elif isinstance(obj, frozendict):
+      if not iscached(obj, '__nutils_hash__'):
+        visited.add(id(obj))
+        stack.append((obj, True))
+        stack.extend((item, False) for item in obj.items())
+    elif isinstance(obj, frozenmultiset):
+      if not iscached(obj, '__nutils_hash__'):
+        visited.add(id(obj))
+        stack.append((obj, True))
+        stack.extend((item, False) for item in obj)
+
 class Immutable(metaclass=ImmutableMeta):
   '''
   Base class for immutable types.  This class adds equality tests, traditional
@@ -647,6 +702,7 @@ class Immutable(metaclass=ImmutableMeta):
 
   @property
   def __nutils_hash__(self):
+    _cache_nutils_hashes(self._args + builtins.tuple(self._kwargs.values()))
     h = hashlib.sha1('{}.{}:{}\0'.format(type(self).__module__, type(self).__qualname__, type(self)._version).encode())
     for arg in self._args:
       h.update(nutils_hash(arg))
@@ -1188,7 +1244,7 @@ class frozenarray(collections.abc.Sequence, metaclass=_frozenarraymeta):
   @property
   def __nutils_hash__(self):
     h = hashlib.sha1('{}.{}\0{} {}'.format(type(self).__module__, type(self).__qualname__, self.__base.shape, self.__base.dtype.str).encode())
-    h.update(self.__base.tobytes())
+    h.update(numpy.ascontiguousarray(self.__base).data) # hash the buffer in place rather than a copy from tobytes
     return h.digest()
 
   @property
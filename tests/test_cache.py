@@ -1,6 +1,7 @@
 from nutils import *
 from nutils.testing import *
-import sys, contextlib, tempfile, pathlib, threading
+import sys, contextlib, tempfile, pathlib, threading, numpy
+_ = numpy.newaxis
 
 @contextlib.contextmanager
 def tmpcache():
@@ -235,6 +236,54 @@ class function(TestCase):
       self.assertEqual(nsuccess, 2)
 
 
+class graph(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.ncalls = 0
+    @cache.graph
+    def func(x):
+      self.ncalls += 1
+      return x * 2
+    self.func = func
+
+  def test_nocache(self):
+    with tmpcache():
+      self.assertEqual(self.func(1), 2)
+      self.assertEqual(self.func(1), 2)
+    self.assertEqual(self.ncalls, 2)
+
+  def test_cache(self):
+    with tempfile.TemporaryDirectory() as tmpdir, cache.enable(tmpdir, graphs=True):
+      self.assertEqual(self.func(1), 2)
+      self.assertEqual(self.func(1), 2)
+      self.assertEqual(self.ncalls, 1)
+      with cache.disable():
+        self.assertEqual(self.func(1), 2)
+      self.assertEqual(self.ncalls, 2)
+
+  def test_nested(self):
+    @cache.function
+    def outer(x):
+      return self.func(x)
+    with tempfile.TemporaryDirectory() as tmpdir, cache.enable(tmpdir, graphs=True):
+      self.assertEqual(outer(1), 2)
+      self.assertEqual(outer(2), 4)
+      self.assertEqual(self.func(2), 4)
+    self.assertEqual(self.ncalls, 2)
+
+  def test_eval_integrals(self):
+    domain, geom = mesh.rectilinear([2,2])
+    basis = domain.basis('std', degree=1)
+    with tempfile.TemporaryDirectory() as tmpdir, cache.enable(tmpdir, graphs=True):
+      A1 = domain.integrate((basis.grad(geom)[:,_,:] * basis.grad(geom)[_,:,:]).sum(-1), degree=2).export('dense')
+      ncached = len(tuple(pathlib.Path(tmpdir).iterdir()))
+      A2 = domain.integrate((basis.grad(geom)[:,_,:] * basis.grad(geom)[_,:,:]).sum(-1), degree=2).export('dense')
+      self.assertEqual(len(tuple(pathlib.Path(tmpdir).iterdir())), ncached)
+    self.assertEqual(ncached, 1)
+    numpy.testing.assert_array_equal(A1, A2)
+
+
 class Recursion(TestCase):
 
   def test_nocache(self):
@@ -337,9 +386,14 @@ class Recursion(TestCase):
           cache_files = tuple(cachedir.iterdir())
           self.assertEqual(len(cache_files), 1)
           cache_file, = cache_files
-          self.assertTrue((cache_file/'{:04d}'.format(icorrupted)).exists())
-          with (cache_file/'{:04d}'.format(icorrupted)).open('wb') as f:
-            f.write(corruption.encode())
+          offsets = numpy.fromfile(str(cache_file/'index'), dtype='<u8')
+          self.assertEqual(len(offsets), 4)
+          with (cache_file/'records').open('r+b') as f:
+            f.seek(offsets[icorrupted-1] if icorrupted else 0)
+            if corruption:
+              f.write(corruption.encode())
+            else:
+              f.truncate()
 
           received_history = untouched
           self.assertEqual(read(R(), 6), tuple(range(6)))
@@ -362,41 +416,114 @@ class Recursion(TestCase):
       assert read(R(), n) == tuple(range(n))
       nsuccess += 1
 
-    for ilock in range(3):
-      with self.subTest(ilock=ilock), tmpcache() as cachedir:
+    with tmpcache() as cachedir:
 
-        nsuccess = 0
+      nsuccess = 0
 
-        # Call `wrapper`.  Since the cache is clean `R.resume` should be called with empty history.
-        received_history = untouched
-        wrapper(4)
-        self.assertEqual(received_history, ())
-        self.assertEqual(nsuccess, 1)
+      # Call `wrapper`.  Since the cache is clean `R.resume` should be called with empty history.
+      received_history = untouched
+      wrapper(4)
+      self.assertEqual(received_history, ())
+      self.assertEqual(nsuccess, 1)
 
-        # Find the cache file of iteration `ilock`, obtain a lock and call
-        # `wrapper` in a thread.  `wrapper` should block on acquiring the file
-        # lock in `function.Recursion`.
-        cache_files = tuple(cachedir.iterdir())
-        self.assertEqual(len(cache_files), 1)
-        cache_file = cache_files[0]/'{:04d}'.format(ilock)
-        assert cache_file.exists()
-        with cache_file.open('r+b') as f:
-          cache._lock_file(f)
+      # Obtain the lock of the cache and call `wrapper` in a thread.  Reading
+      # the cached items does not require the lock, but `wrapper` should block
+      # on acquiring the lock in `function.Recursion` once the cache is
+      # exhausted.
+      cache_files = tuple(cachedir.iterdir())
+      self.assertEqual(len(cache_files), 1)
+      cache_file = cache_files[0]/'lock'
+      assert cache_file.exists()
+      with cache_file.open('r+b') as f:
+        cache._lock_file(f)
 
-          # We use `daemon=True` to make sure this thread won't keep the
-          # interpreter alive when something goes wrong with the thread.
-          received_history = untouched
-          t = threading.Thread(target=lambda: wrapper(5), daemon=True)
-          t.start()
-          # Give the thread some time to start.
-          t.join(timeout=1)
-          # Assert the thread is still running, but `R.resume` is not called.
-          self.assertEqual(received_history, untouched)
-          self.assertEqual(nsuccess, 1)
-
-        # The lock has been released by closing the file.  The thread should
-        # continue with loading the cache and ultimately calling `R.resume
-        t.join(timeout=5)
-        self.assertFalse(t.is_alive())
-        self.assertEqual(received_history, (3,))
+        wrapper(3)
+        self.assertEqual(received_history, ())
         self.assertEqual(nsuccess, 2)
+
+        # We use `daemon=True` to make sure this thread won't keep the
+        # interpreter alive when something goes wrong with the thread.
+        received_history = untouched
+        t = threading.Thread(target=lambda: wrapper(5), daemon=True)
+        t.start()
+        # Give the thread some time to start.
+        t.join(timeout=1)
+        # Assert the thread is still running, but `R.resume` is not called.
+        self.assertEqual(received_history, untouched)
+        self.assertEqual(nsuccess, 2)
+
+      # The lock has been released by closing the file.  The thread should
+      # continue with loading the cache and ultimately calling `R.resume
+      t.join(timeout=5)
+      self.assertFalse(t.is_alive())
+      self.assertEqual(received_history, (3,))
+      self.assertEqual(nsuccess, 3)
+
+  @unittest.skipIf(cache._lock_file is cache._lock_file_fallback, 'platform does not support file locks')
+  def test_concurrent_rewrite(self):
+
+    read = lambda iterable, n: tuple(item for i, item in zip(range(n), iterable))
+    untouched = object()
+
+    class R(cache.Recursion, length=1):
+      def resume(R_self, history):
+        nonlocal received_history
+        received_history = tuple(history)
+        yield from range(0 if not history else history[-1]+1, 10)
+
+    with tmpcache() as cachedir:
+
+      received_history = untouched
+      self.assertEqual(read(R(), 4), tuple(range(4)))
+      cache_file, = cachedir.iterdir()
+      records = (cache_file/'records').read_bytes()
+      offsets = numpy.fromfile(str(cache_file/'index'), dtype='<u8')
+
+      # Obtain the lock and truncate the records after the first, as a process
+      # does that rewrites the log from the second record onward, and read the
+      # cache in a thread.  The thread should fail to load the second record
+      # and block on acquiring the lock.
+      results = []
+      received_history = untouched
+      with (cache_file/'lock').open('r+b') as f:
+        cache._lock_file(f)
+        with (cache_file/'records').open('r+b') as records_file:
+          records_file.truncate(offsets[0])
+        t = threading.Thread(target=lambda: results.append(read(R(), 4)), daemon=True)
+        t.start()
+        t.join(timeout=1)
+        self.assertTrue(t.is_alive())
+        # Complete the rewrite.
+        (cache_file/'records').write_bytes(records)
+
+      # Upon acquiring the lock the thread should reread the record rather
+      # than recompute it.
+      t.join(timeout=5)
+      self.assertFalse(t.is_alive())
+      self.assertEqual(results, [tuple(range(4))])
+      self.assertIs(received_history, untouched)
+
+  def test_storage(self):
+
+    class R(cache.Recursion, length=2):
+      def resume(R_self, history):
+        nonlocal nresumed
+        nresumed += 1
+        value = history[-1] if history else numpy.zeros((10, 10))
+        while True:
+          value = value + 1
+          yield value
+
+    read = lambda n: [item for i, item in zip(range(n), R())]
+    with tmpcache() as cachedir:
+      nresumed = 0
+      values = read(100)
+      self.assertEqual(sorted(path.name for path in next(cachedir.iterdir()).iterdir()), ['index', 'lock', 'records'])
+      values2 = read(150)
+      self.assertEqual(nresumed, 2)
+      for i, value in enumerate(values2):
+        self.assertEqual(value.shape, (10, 10))
+        self.assertTrue((value == i + 1).all())
+      self.assertTrue(values2[0].flags.writeable)
+      self.assertEqual(read(150)[-1][0,0], 150)
+      self.assertEqual(nresumed, 2)
@@ -1,5 +1,5 @@
-import sys, os, tempfile, io, contextlib, time, unittest, treelog as log, importlib
-from nutils import cli, testing, matrix, parallel, cache
+import sys, os, tempfile, io, contextlib, time, unittest, unittest.mock, json, numpy, treelog as log, importlib
+from nutils import cli, testing, matrix, parallel, cache, mesh, function, solver
 
 def main(
   iarg: 'integer' = 1,
@@ -121,6 +121,33 @@ class setup(testing.TestCase):
     with self.subTest('nocache'), self._setup(cache=False):
       self.assertFalse(cache._cache.value)
 
+  def test_perfreport(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, 'perf.json')
+      with self._setup(perfreport=path, cache=True, verbose=1):
+        topo, geom = mesh.rectilinear([4])
+        basis = topo.basis('std', degree=1)
+        u = basis.dot(function.Argument('dofs', [5]))
+        res = topo.integral(basis.grad(geom)[:,0] * u.grad(geom)[0] + basis * (u**3 - 1), degree=4)
+        with log.context('solve'):
+          for i in range(2):
+            solver.newton('dofs', res, constrain=numpy.array([0]+[numpy.nan]*4)).solve(tol=1e-10)
+      with open(path) as f:
+        report = json.load(f)
+    self.assertEqual(report['status'], 'success')
+    self.assertEqual(report['script'], 'unittest')
+    context, = [context for context in report['contexts'] if context['title'] == 'solve']
+    self.assertGreater(report['time'], context['time'])
+    self.assertTrue(all(step['title'].startswith('newton') for step in context['contexts']))
+    newton, = report['solvers']
+    self.assertTrue(newton['converged'])
+    self.assertEqual(newton['iterations'], len(newton['steps']) - 1)
+    self.assertLess(newton['steps'][-1]['resnorm'], 1e-10)
+    self.assertGreater(newton['steps'][1]['assembly'], 0)
+    self.assertGreater(newton['steps'][1]['solve'], 0)
+    self.assertEqual(report['cache']['cache.function'], dict(hits=1, misses=1, rate=.5))
+    self.assertGreater(report['phases']['assembly']['count'], 0)
+
 class bottombar(testing.TestCase):
 
   @unittest.skipIf(cli._rss_memory is None, 'resource or psutil must be installed')
@@ -132,3 +159,60 @@ class bottombar(testing.TestCase):
     self.assertRegex(cli._format(uri, t0, width=45)[1:], '^\[2m' + uri + r'[ ]+[0-9,]+M | \d:\d\d:\d\d$')
     self.assertEqual(cli._format(uri, t0, width=28), '\033[2m' + uri)
     self.assertEqual(cli._format(uri, t0, width=13), '\033[2m...' + uri[-10:])
+
+@cache.function
+def _sweepproduct(n, f):
+  return n * f
+
+def _sweepfunc(n: int = 1, f: float = 1.):
+  if n < 0:
+    raise ValueError('negative n')
+  return _sweepproduct(n, f)
+
+def _sweepnprocs(n: int = 1):
+  return parallel._maxprocs.value
+
+class sweep(testing.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.outdir = self.enter_context(tempfile.TemporaryDirectory())
+
+  def _sweep(self, argsets, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+      results = cli.sweep(_sweepfunc, argsets, scriptname='sweep', outdir=self.outdir, loaduserconfig=False, **kwargs)
+    return results, stdout.getvalue()
+
+  def test_grid(self):
+    results, output = self._sweep(dict(n=[1, 2], f=[.5, 2.]))
+    self.assertEqual(results, [.5, 2., 1., 4.])
+    for i in range(4):
+      self.assertTrue(os.path.isfile(os.path.join(self.outdir, 'run{}'.format(i), 'log.html')))
+    self.assertTrue(os.path.isdir(os.path.join(self.outdir, 'cache')))
+    self.assertEqual(sorted(os.listdir(self.outdir)), ['cache', 'run0', 'run1', 'run2', 'run3'])
+    self.assertRegex(output, r'\nrun3  2  2    ok\s+\d+\.\ds  4.0\n$')
+
+  def test_list(self):
+    results, output = self._sweep([dict(n=3), dict(n=-1), dict(f=3.)], cache=False)
+    self.assertEqual(results, [3., None, 3.])
+    self.assertIn('failed: negative n', output)
+    self.assertFalse(os.path.exists(os.path.join(self.outdir, 'cache')))
+
+  @unittest.skipIf(not hasattr(os, 'fork'), 'fork is unavailable')
+  def test_concurrency(self):
+    results, output = self._sweep(dict(n=range(4)), concurrency=2)
+    self.assertEqual(results, [0., 1., 2., 3.])
+
+  @unittest.skipIf(not hasattr(os, 'fork'), 'fork is unavailable')
+  def test_concurrency_nprocs(self):
+    with unittest.mock.patch.dict(os.environ, NUTILS_NPROCS='3'), contextlib.redirect_stdout(io.StringIO()):
+      serial = cli.sweep(_sweepnprocs, dict(n=range(2)), scriptname='sweep', outdir=self.outdir, cache=False)
+      concurrent = cli.sweep(_sweepnprocs, dict(n=range(2)), concurrency=2, scriptname='sweep', outdir=self.outdir, cache=False)
+      explicit = cli.sweep(_sweepnprocs, dict(n=range(2)), concurrency=2, scriptname='sweep', outdir=self.outdir, cache=False, nprocs=2)
+    self.assertEqual(serial, [3, 3])
+    self.assertEqual(concurrent, [1, 1])
+    self.assertEqual(explicit, [2, 2])
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      self._sweep([dict(m=1)])
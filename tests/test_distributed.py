@@ -0,0 +1,77 @@
+import unittest, os, sys, numpy
+from nutils import distributed, mesh, function, sample, testing
+
+@unittest.skipIf(not hasattr(os, 'fork') or sys.platform == 'darwin', 'fork is unavailable or unreliable')
+class Test(testing.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.topo, self.geom = mesh.rectilinear([numpy.linspace(0, 1, 7), numpy.linspace(0, 1, 5)])
+    self.basis = self.topo.basis('std', degree=1)
+    self.lhs = function.Argument('lhs', self.basis.shape)
+
+  def residual(self, topo, btopo):
+    u = self.basis.dot(self.lhs)
+    J = function.J(self.geom)
+    return topo.integral(((self.basis.grad(self.geom) * u.grad(self.geom)).sum(-1) - self.basis) * J, degree=2) \
+      + btopo.integral(self.basis * (u - 1) * J, degree=2)
+
+  def test_collectives(self):
+    with distributed.local(3) as transport:
+      ranks = transport.allgather(transport.rank)
+      total = transport.allreduce(numpy.arange(3) * (transport.rank + 1))
+      root = transport.bcast('rank {}'.format(transport.rank), root=2)
+      received = transport.alltoall([(transport.rank, dest) for dest in range(transport.size)])
+      self.assertEqual(received, [(source, transport.rank) for source in range(transport.size)])
+      transport.barrier()
+    self.assertEqual(ranks, [0, 1, 2])
+    self.assertAllEqual(total, [0, 6, 12])
+    self.assertEqual(root, 'rank 2')
+
+  def test_failinchild(self):
+    with self.assertRaises(Exception):
+      with distributed.local(3) as transport:
+        if transport.rank == 1:
+          1/0
+        transport.barrier()
+
+  def test_partition(self):
+    with distributed.local(3) as transport:
+      sizes = transport.allgather(len(distributed.partition(transport, self.topo)))
+      ranks = numpy.arange(len(self.topo)) % 3
+      refs = transport.allgather(len(distributed.partition(transport, self.topo, ranks)))
+    self.assertEqual(sizes, [8, 8, 8])
+    self.assertEqual(refs, [8, 8, 8])
+
+  def test_assemble(self):
+    res = self.residual(self.topo, self.topo.boundary['left'])
+    lhs0 = numpy.linspace(0, 1, len(self.basis))
+    with distributed.local(3) as transport:
+      part = distributed.partition(transport, self.topo)
+      bpart = distributed.partition(transport, self.topo.boundary['left'])
+      dres = self.residual(part, bpart)
+      djac, dres = distributed.assemble(transport, dres.derivative('lhs'), dres, lhs=lhs0)
+      rows = transport.allgather(djac.rows)
+      dense = djac.export('dense')
+      matvec = djac @ lhs0
+    sjac, sres = sample.eval_integrals(res.derivative('lhs'), res, lhs=lhs0)
+    self.assertAllAlmostEqual(dres, sres)
+    self.assertAllAlmostEqual(dense, sjac.export('dense'))
+    self.assertAllAlmostEqual(matvec, sjac @ lhs0)
+    self.assertEqual([(s.start, s.stop) for s in rows], [(0, 11), (11, 23), (23, 35)])
+
+  def test_solve(self):
+    cons = numpy.full(len(self.basis), numpy.nan)
+    cons[:5] = 2
+    res = self.residual(self.topo, self.topo.boundary['right'])
+    sjac, sres = sample.eval_integrals(res.derivative('lhs'), res, lhs=numpy.zeros(len(self.basis)))
+    expected = sjac.solve(-sres, constrain=cons)
+    with distributed.local(2) as transport:
+      part = distributed.partition(transport, self.topo)
+      bpart = distributed.partition(transport, self.topo.boundary['right'])
+      res = self.residual(part, bpart)
+      jac, rhs = distributed.assemble(transport, res.derivative('lhs'), -res, lhs=numpy.zeros(len(self.basis)))
+      lhs = jac.solve(rhs, constrain=cons, atol=1e-12)
+      lhs0 = jac.solve(rhs, lhs0=numpy.nan_to_num(cons), constrain=~numpy.isnan(cons), atol=1e-12)
+    self.assertAllAlmostEqual(lhs, expected)
+    self.assertAllAlmostEqual(lhs0, expected)
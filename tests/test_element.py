@@ -85,3 +85,39 @@ quad = line**2
 elem('withchildren1', ref=element.WithChildrenReference(quad, [quad,quad.empty,quad.empty,quad.empty]), exactcentroid=[1/4,1/4])
 elem('withchildren2', ref=element.WithChildrenReference(quad, [quad,quad,quad.empty,quad.empty]), exactcentroid=[1/4,1/2])
 elem('mosaic', ref=element.MosaicReference(quad, [line,line.empty,line,line.empty], [.25,.75]), exactcentroid=[2/3,2/3])
+
+
+class trimcache(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.cache = element.TrimCache(maxsize=2)
+    self.ref = element.LineReference()**2
+    self.levels = numpy.array([-1., 1, -.5, 2])
+
+  def test_scaleinvariant(self):
+    trimmed = self.cache(self.ref, self.levels, maxrefine=0, ndivisions=8)
+    self.assertEqual(trimmed, self.ref.slice(lambda vertices: numeric.dot(numeric.poly_eval(self.ref._linear_bernstein, vertices), self.levels), 8))
+    self.assertIs(self.cache(self.ref, self.levels * 3, maxrefine=0, ndivisions=8), trimmed)
+    self.assertEqual((self.cache.hits, self.cache.misses, len(self.cache)), (1, 1, 1))
+    self.assertIsNot(self.cache(self.ref, self.levels - .1, maxrefine=0, ndivisions=8), trimmed)
+    self.assertEqual((self.cache.hits, self.cache.misses, len(self.cache)), (1, 2, 2))
+
+  def test_eviction(self):
+    for offset in 0, .1, .2, 0:
+      self.cache(self.ref, self.levels + offset, maxrefine=0, ndivisions=8)
+    self.assertEqual((self.cache.hits, self.cache.misses, len(self.cache)), (0, 4, 2))
+    self.cache(self.ref, self.levels, maxrefine=0, ndivisions=8)
+    self.assertEqual(self.cache.hits, 1)
+
+  def test_disabled(self):
+    self.cache.maxsize = 0
+    self.cache(self.ref, self.levels, maxrefine=0, ndivisions=8)
+    self.cache(self.ref, self.levels, maxrefine=0, ndivisions=8)
+    self.assertEqual((self.cache.hits, self.cache.misses, len(self.cache)), (0, 2, 0))
+
+  def test_clear(self):
+    self.cache(self.ref, self.levels, maxrefine=0, ndivisions=8)
+    self.cache.clear()
+    self.assertEqual((self.cache.hits, self.cache.misses, len(self.cache)), (0, 0, 0))
+    self.assertEqual(self.cache.stats, 'not used')
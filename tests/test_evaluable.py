@@ -1,4 +1,4 @@
-import numpy, itertools, pickle, weakref, gc, warnings as _builtin_warnings, collections, sys, unittest
+import numpy, itertools, pickle, weakref, gc, warnings as _builtin_warnings, collections, sys, unittest, tempfile, pathlib, json, treelog
 from nutils import *
 from nutils.testing import *
 _ = numpy.newaxis
@@ -773,6 +773,195 @@ class simplify(TestCase):
     # isinstance(other_trans, Transpose) restriction in Transpose._multiply.
     self.assertEqual(f.simplified, f)
 
+  def test_pointwise_invariant_geometry(self):
+    # the local gradient of an affine geometry is invariant along the points
+    # axis; determinant, inverse and normal should be computed only once
+    lgrad = evaluable.Argument('lgrad', shape=[2,2], dtype=float)
+    lgrad = evaluable.Transpose(evaluable.InsertAxis(lgrad, 3), (2,0,1))
+    value = numpy.array([[1.,2.],[-3.,4.]])
+    normal = value[:,1] - value[:,0] * (value[:,0] @ value[:,1]) / (value[:,0] @ value[:,0])
+    for f, desired in ((evaluable.Determinant(lgrad), numpy.linalg.det(value)),
+                       (evaluable.Inverse(lgrad), numpy.linalg.inv(value)),
+                       (evaluable.Normal(lgrad), normal / numpy.linalg.norm(normal))):
+      with self.subTest(type(f).__name__):
+        simplified = f.simplified
+        self.assertIsInstance(simplified._axes[0], evaluable.Inserted)
+        actual = simplified.eval(lgrad=value)
+        self.assertEqual(actual.shape, (3, *desired.shape))
+        self.assertAllAlmostEqual(actual, desired[_])
+
+  def test_count_rewrites(self):
+    dummy = evaluable.Argument('dummy', shape=[2], dtype=float)
+    f = evaluable.Sum(evaluable.InsertAxis(dummy, 3))
+    with evaluable.count_rewrites() as counter:
+      self.assertEqual(f.simplified, dummy * 3)
+    self.assertEqual(counter['Sum._simplified'], 1)
+    with evaluable.count_rewrites() as counter:
+      f.simplified
+    self.assertEqual(counter, {})
+
+class deep(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.x = evaluable.Argument('x', shape=[2], dtype=float)
+    self.f = self.x
+    for i in range(sys.getrecursionlimit()):
+      self.f = evaluable.Sin(self.f) + self.x
+    self.value = numpy.array([.1, .2])
+    self.desired = self.value
+    for i in range(sys.getrecursionlimit()):
+      self.desired = numpy.sin(self.desired) + self.value
+
+  def test_dependencies(self):
+    self.assertIn(self.x, self.f.dependencies)
+    self.assertEqual(self.f.arguments, {self.x})
+
+  def test_eval(self):
+    self.assertAllAlmostEqual(self.f.optimized_for_numpy.eval(x=self.value), self.desired)
+
+  def test_derivative(self):
+    d = evaluable.derivative(self.f, self.x)
+    self.assertEqual(d.shape, (2, 2))
+    self.assertIn(self.x, d.dependencies)
+
+  def test_derivative_unrequested(self):
+    # The derivative of Sign is zero and does not request the derivative of
+    # its argument, for which no derivative rule exists.
+    x = evaluable.Argument('x', shape=[2,2], dtype=float)
+    eigval, eigvec = evaluable.eig(x, symmetric=True)
+    d = evaluable.derivative(evaluable.Sign(eigval), x)
+    self.assertAllEqual(d.eval(x=numpy.eye(2)), numpy.zeros((2,2,2,2)))
+
+class profile(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.outdir = pathlib.Path(self.enter_context(tempfile.TemporaryDirectory()))
+    self.enter_context(treelog.set(treelog.DataLog(str(self.outdir))))
+    i = evaluable.Argument('i', (), int)
+    x = evaluable.Argument('x', (3,), float)
+    self.f = evaluable.Tuple((evaluable.LoopSum(evaluable.Sin(x) * i, i, 4),))
+
+  def test_trace(self):
+    with evaluable.profile('profile.json'):
+      with self.f.session(graphviz=None) as eval:
+        retval, = eval(x=numpy.array([1.,2.,3.]))
+    self.assertAllAlmostEqual(retval, numpy.sin([1.,2.,3.]) * 6)
+    with (self.outdir/'profile.json').open() as f:
+      events = json.load(f)['traceEvents']
+    names = collections.Counter(event['name'] for event in events)
+    self.assertEqual(names['eval'], 1)
+    self.assertEqual(names['LoopSum'], 1)
+    self.assertEqual(names['iteration'], 4)
+    loopsum, = [event for event in events if event['name'] == 'LoopSum']
+    self.assertEqual(loopsum['args'], dict(length=4, shape=[3], dtype='<f8', nbytes=24))
+
+  def test_collapsed(self):
+    with evaluable.profile('profile.txt'):
+      with self.f.session(graphviz=None) as eval:
+        eval(x=numpy.array([1.,2.,3.]))
+    with (self.outdir/'profile.txt').open() as f:
+      stacks = [line.rsplit(' ', 1)[0] for line in f]
+    self.assertIn('eval;LoopSum;iteration', stacks)
+
+  def test_inactive(self):
+    with self.f.session(graphviz=None) as eval:
+      self.assertEqual(eval, self.f.eval)
+
+class hoisting(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    i = evaluable.Argument('i', (), int)
+    x = evaluable.Argument('x', (), float)
+    c = evaluable.Sin(evaluable.get(evaluable.Constant(numpy.arange(4.)), 0, i)) # argument independent
+    self.f = evaluable.loop_concatenate(evaluable.InsertAxis(c * x, 1), i, 4)
+
+  def check(self, maxbytes, hits, misses):
+    with evaluable.hoisting(maxbytes) as cache:
+      for x in 1., 2., 3.:
+        self.assertAllAlmostEqual(self.f.eval(x=numpy.array(x)), numpy.sin(numpy.arange(4.)) * x)
+    self.assertEqual((cache.hits, cache.misses), (hits, misses))
+    return cache
+
+  def test_reuse(self):
+    cache = self.check(1 << 20, hits=8, misses=4)
+    self.assertGreater(cache.nbytes, 0)
+
+  def test_budget(self):
+    nbytes = self.check(1 << 20, hits=8, misses=4).nbytes
+    cache = self.check(nbytes // 2, hits=4, misses=8)
+    self.assertEqual(cache.nbytes, nbytes // 2)
+
+  def test_disabled(self):
+    self.check(0, hits=0, misses=0)
+
+  def test_parallel(self):
+    with parallel.maxprocs(2):
+      cache = self.check(1 << 20, hits=0, misses=0)
+    self.assertEqual(cache.nbytes, 0)
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      with evaluable.hoisting(-1):
+        pass
+
+  def test_integral(self):
+    topo, geom = mesh.rectilinear([4,4])
+    basis = topo.basis('std', degree=1)
+    u = (basis * function.Argument('u', [len(basis)])).sum(-1)
+    res = topo.integral((basis * u**2 + (basis.grad(geom) * u.grad(geom)).sum(-1)) * function.J(geom), degree=2)
+    args = [numpy.random.RandomState(i).normal(size=len(basis)) for i in range(2)]
+    with evaluable.hoisting(0):
+      desired = [res.eval(u=arg) for arg in args]
+    with evaluable.hoisting(1 << 20) as cache:
+      actual = [res.eval(u=arg) for arg in args]
+    self.assertGreater(cache.hits, 0)
+    for a, d in zip(actual, desired):
+      self.assertAllAlmostEqual(a, d)
+
+class batched(TestCase):
+
+  def setUp(self):
+    super().setUp()
+    i = evaluable.Argument('i', (), int)
+    x = evaluable.Argument('x', (), float)
+    y = evaluable.Argument('y', (), float)
+    c = evaluable.Sin(evaluable.get(evaluable.Constant(numpy.arange(4.)), 0, i))
+    self.f = evaluable.Tuple((evaluable.loop_concatenate(evaluable.InsertAxis(c * x + y, 1), i, 4), y * 2))
+
+  def test_batched(self):
+    xs = numpy.array([1., 2., 3.])
+    actual = self.f.eval_batched(dict(x=xs), y=numpy.array(.5))
+    self.assertEqual(len(actual), 3)
+    for (loop, const), x in zip(actual, xs):
+      self.assertAllAlmostEqual(loop, numpy.sin(numpy.arange(4.)) * x + .5)
+      self.assertAllAlmostEqual(const, 1.)
+
+  def test_multiple(self):
+    xs = numpy.array([1., 2.])
+    ys = numpy.array([3., 4.])
+    for (loop, const), x, y in zip(self.f.eval_batched(dict(x=xs, y=ys)), xs, ys):
+      self.assertAllAlmostEqual(loop, numpy.sin(numpy.arange(4.)) * x + y)
+      self.assertAllAlmostEqual(const, y * 2)
+
+  def test_mismatch(self):
+    with self.assertRaises(ValueError):
+      self.f.eval_batched(dict(x=numpy.array([1., 2.]), y=numpy.array([1., 2., 3.])))
+
+  def test_broadcasting(self):
+    x = evaluable.Argument('x', (2,), float)
+    y = evaluable.Argument('y', (2,), float)
+    f = evaluable.Sin(x) * y + y
+    xs = numpy.array([[1., 2.], [3., 4.], [5., 6.]])
+    ys = numpy.array([.5, 1.5])
+    actual = f.eval_batched(dict(x=xs), y=ys)
+    for a, x in zip(actual, xs):
+      self.assertAllAlmostEqual(a, numpy.sin(x) * ys + ys)
+    # the members are evaluated at once, with a leading batch axis
+    self.assertIs(actual[0].base, actual[1].base)
+
 class memory(TestCase):
 
   def assertCollected(self, ref):
@@ -861,3 +1050,45 @@ class combine_loop_concatenates(TestCase):
     self.assertNotIn(A_, L2._Evaluable__args)
     desired = evaluable.Tuple((A_, evaluable.ArrayFromTuple(L2, 0, (9,), int)))
     self.assertEqual(actual, desired)
+
+class merge_loop_concatenates(TestCase):
+
+  def test_independent(self):
+    i = evaluable.Argument('i', (), int)
+    j = evaluable.Argument('j', (), int)
+    L1 = evaluable.LoopConcatenateCombined(((evaluable.InsertAxis(i, 1), i, i+1, 3),), i, 3)
+    L2 = evaluable.LoopConcatenateCombined(((evaluable.InsertAxis(j*2, 1), j, j+1, 4),), j, 4)
+    f = evaluable.Tuple((evaluable.ArrayFromTuple(L1, 0, (3,), int), evaluable.ArrayFromTuple(L2, 0, (4,), int)))
+    actual = f._merge_loop_concatenates()
+    M = evaluable.LoopConcatenateMerged((L1, L2))
+    self.assertEqual(actual, evaluable.Tuple((evaluable.ArrayFromTuple(M, 0, (3,), int), evaluable.ArrayFromTuple(M, 1, (4,), int))))
+    for maxprocs in 1, 2:
+      with self.subTest(maxprocs=maxprocs), parallel.maxprocs(maxprocs):
+        a, b = actual.eval()
+        self.assertAllEqual(a, [0, 1, 2])
+        self.assertAllEqual(b, [0, 2, 4, 6])
+
+  def test_dependent(self):
+    i = evaluable.Argument('i', (), int)
+    A = evaluable.LoopConcatenate(evaluable.InsertAxis(i, 1), i, i+1, 3, i, 3)
+    B = evaluable.LoopConcatenate(A, i*3, i*3+3, 9, i, 3)
+    f = evaluable.Tuple((A, B))._combine_loop_concatenates(set())
+    self.assertEqual(f._merge_loop_concatenates(), f)
+
+  def test_integral(self):
+    topo, geom = mesh.rectilinear([3,3])
+    basis = topo.basis('std', degree=1)
+    u = (basis * function.Argument('u', [len(basis)])).sum(-1)
+    res = topo.integral(basis * u**2 * function.J(geom), degree=2) + topo.boundary['left'].integral(basis * u * function.J(geom), degree=2)
+    arg = numpy.arange(len(basis), dtype=float)
+    desired = topo.integral(basis * u**2 * function.J(geom), degree=2).eval(u=arg) + topo.boundary['left'].integral(basis * u * function.J(geom), degree=2).eval(u=arg)
+    func = sample._optimized_for_numpy((res.as_evaluable_array(),))
+    self.assertEqual(sum(isinstance(op, evaluable.LoopConcatenateMerged) for op in func.dependencies), 1)
+    self.assertAllAlmostEqual(res.eval(u=arg), desired)
+
+  def test_pool_unpicklable(self):
+    i = evaluable.Argument('i', (), int)
+    body = evaluable.ElemwiseFromCallable(lambda i: numpy.array([i * 2]), i, (1,), int)
+    f = evaluable.LoopConcatenate(body, i, i+1, 4, i, 4)
+    with parallel.maxprocs(2), parallel.pool():
+      self.assertAllEqual(f.eval(), [0, 2, 4, 6])
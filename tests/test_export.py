@@ -1,5 +1,5 @@
 from nutils import testing, export
-import os, tempfile, pathlib, treelog
+import os, sys, tempfile, pathlib, treelog, xml.etree.ElementTree, zlib
 import numpy
 
 class mplfigure(testing.TestCase):
@@ -162,3 +162,156 @@ vtk(ndims=3, xtype='f4', ptype='i1', pshape=(3,))
 vtk(ndims=2, xtype='f4', ptype='i1', pshape=(2,2))
 vtk(ndims=3, xtype='f4', ptype='i1', pshape=(3,3))
 vtk(ndims=3, xtype='f4', ctype='i1', cshape=())
+
+class vtu(testing.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.outdir = pathlib.Path(self.enter_context(tempfile.TemporaryDirectory()))
+    self.enter_context(treelog.set(treelog.DataLog(str(self.outdir))))
+    self.x = numpy.array([[0,0],[1,0],[0,1],[1,1]], dtype=float)
+    self.tri = numpy.array([[0,1,2],[1,3,2]])
+
+  def read(self, filename):
+    data = (self.outdir/filename).read_bytes()
+    head, appended = data.split(b'<AppendedData encoding="raw">\n_', 1)
+    root = xml.etree.ElementTree.fromstring(head + b'</VTKFile>')
+    self.assertEqual(root.get('byte_order'), 'LittleEndian' if sys.byteorder == 'little' else 'BigEndian')
+    compressed = root.get('compressor') is not None
+    arrays = {}
+    for array in root.iter('DataArray'):
+      offset = int(array.get('offset'))
+      if compressed:
+        nblocks, = numpy.frombuffer(appended, dtype=numpy.uint64, count=1, offset=offset)
+        header = numpy.frombuffer(appended, dtype=numpy.uint64, count=3+int(nblocks), offset=offset)
+        offset += header.nbytes
+        blocks = []
+        for size in header[3:]:
+          blocks.append(zlib.decompress(appended[offset:offset+int(size)]))
+          offset += int(size)
+        raw = b''.join(blocks)
+        self.assertEqual(len(raw), (int(nblocks)-1) * int(header[1]) + (int(header[2]) or int(header[1])))
+      else:
+        size, = numpy.frombuffer(appended, dtype=numpy.uint64, count=1, offset=offset)
+        raw = appended[offset+8:offset+8+int(size)]
+      dtype = dict(Int8='i1', UInt8='u1', Int32='i4', Int64='i8', Float32='f4', Float64='f8')[array.get('type')]
+      arrays[array.get('Name')] = numpy.frombuffer(raw, dtype=dtype).reshape(-1, int(array.get('NumberOfComponents')))
+    return root, arrays
+
+  def test_simplex(self):
+    p = numpy.arange(8, dtype=numpy.int8).reshape(4, 2)
+    c = numpy.array([True, False])
+    self.assertEqual(export.vtu('test', self.tri, self.x, p=p, c=c), 'test.vtu')
+    root, arrays = self.read('test.vtu')
+    piece = root.find('UnstructuredGrid/Piece')
+    self.assertEqual(piece.get('NumberOfPoints'), '4')
+    self.assertEqual(piece.get('NumberOfCells'), '2')
+    self.assertEqual(arrays['Points'].tolist(), [[0,0,0],[1,0,0],[0,1,0],[1,1,0]])
+    self.assertEqual(arrays['connectivity'].ravel().tolist(), [0,1,2,1,3,2])
+    self.assertEqual(arrays['offsets'].ravel().tolist(), [3,6])
+    self.assertEqual(arrays['types'].ravel().tolist(), [5,5])
+    self.assertEqual(arrays['p'].tolist(), p.tolist())
+    self.assertEqual(arrays['c'].ravel().tolist(), [1,0])
+    self.assertEqual([array.get('Name') for array in root.iterfind('UnstructuredGrid/Piece/PointData/DataArray')], ['p'])
+    self.assertEqual([array.get('Name') for array in root.iterfind('UnstructuredGrid/Piece/CellData/DataArray')], ['c'])
+
+  def test_quad(self):
+    export.vtu('test', [[0,1,3,2]], self.x, celltype='quad')
+    root, arrays = self.read('test.vtu')
+    self.assertEqual(arrays['types'].ravel().tolist(), [9])
+    self.assertEqual(arrays['offsets'].ravel().tolist(), [4])
+
+  def test_zlib(self):
+    x = numpy.random.RandomState(0).uniform(size=(5000,3))
+    tri = numpy.arange(5000).reshape(-1, 4)
+    export.vtu('test', tri, x, compress='zlib', u=x[:,0])
+    root, arrays = self.read('test.vtu')
+    self.assertEqual(root.get('compressor'), 'vtkZLibDataCompressor')
+    self.assertEqual(arrays['Points'].tolist(), x.tolist())
+    self.assertEqual(arrays['connectivity'].ravel().tolist(), tri.ravel().tolist())
+    self.assertEqual(arrays['u'].ravel().tolist(), x[:,0].tolist())
+
+  def test_invalid(self):
+    with self.assertRaises(Exception):
+      export.vtu('test', [[0,1,3,2,0]], self.x)
+    with self.assertRaises(Exception):
+      export.vtu('test', self.tri, self.x, celltype='pentagon')
+    with self.assertRaises(Exception):
+      export.vtu('test', self.tri, self.x, u=numpy.zeros(3))
+
+  def test_pieces(self):
+    for piece in 1, 0:
+      self.assertEqual(export.vtu('test', self.tri, self.x, piece=piece, npieces=2, u=self.x), 'test.pvtu')
+    for piece in 0, 1:
+      root, arrays = self.read('test_{}.vtu'.format(piece))
+      self.assertEqual(arrays['u'].tolist(), self.x.tolist())
+    root = xml.etree.ElementTree.parse(str(self.outdir/'test.pvtu')).getroot()
+    self.assertEqual(root.get('type'), 'PUnstructuredGrid')
+    self.assertEqual([p.get('Source') for p in root.iterfind('PUnstructuredGrid/Piece')], ['test_0.vtu', 'test_1.vtu'])
+    self.assertEqual(root.find('PUnstructuredGrid/PPoints/PDataArray').get('NumberOfComponents'), '3')
+    u = root.find('PUnstructuredGrid/PPointData/PDataArray')
+    self.assertEqual((u.get('Name'), u.get('type'), u.get('NumberOfComponents')), ('u', 'Float64', '2'))
+
+  def test_pvd(self):
+    export.pvd('test', [(.5, 'test0.vtu'), (1, 'test1.vtu')])
+    root = xml.etree.ElementTree.parse(str(self.outdir/'test.pvd')).getroot()
+    self.assertEqual(root.get('type'), 'Collection')
+    self.assertEqual([(float(d.get('timestep')), d.get('file')) for d in root.iterfind('Collection/DataSet')], [(.5, 'test0.vtu'), (1., 'test1.vtu')])
+
+class timeseries(testing.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.outdir = pathlib.Path(self.enter_context(tempfile.TemporaryDirectory()))
+    self.x = numpy.array([[0,0],[1,0],[0,1],[1,1]], dtype=float)
+    self.tri = numpy.array([[0,1,2],[1,3,2]])
+
+  def index(self):
+    # the index is rewritten after every time step; the last one is complete
+    roots = [xml.etree.ElementTree.parse(str(path)).getroot() for path in self.outdir.glob('*.xdmf')]
+    return max(roots, key=lambda root: len(root.findall('Domain/Grid/Grid')))
+
+  def read(self, dataitem):
+    self.assertEqual(dataitem.get('Format'), 'Binary')
+    dtype = {('Float', '8'): 'f8', ('Int', '8'): 'i8', ('Int', '4'): 'i4', ('UChar', '1'): 'u1'}[dataitem.get('NumberType'), dataitem.get('Precision')]
+    shape = tuple(map(int, dataitem.get('Dimensions').split()))
+    with open(str(self.outdir/dataitem.text), 'rb') as f:
+      f.seek(int(dataitem.get('Seek')))
+      return numpy.fromfile(f, dtype=dtype, count=numpy.prod(shape)).reshape(shape)
+
+  def check_write(self):
+    u = numpy.arange(4, dtype=float)
+    with export.timeseries('test', self.tri, self.x) as series:
+      for i in range(3):
+        series.write(i/2, u=u, v=self.x*i, c=numpy.array([i, -i]), m=numpy.full((4,2,2), i))
+        u += 1 # the writer should have copied the data
+    grids = self.index().findall('Domain/Grid/Grid')
+    self.assertEqual([float(grid.find('Time').get('Value')) for grid in grids], [0, .5, 1])
+    for i, grid in enumerate(grids):
+      topology = grid.find('Topology')
+      self.assertEqual(topology.get('TopologyType'), 'Triangle')
+      self.assertEqual(self.read(topology.find('DataItem')).tolist(), self.tri.tolist())
+      self.assertEqual(self.read(grid.find('Geometry/DataItem')).tolist(), [[0,0,0],[1,0,0],[0,1,0],[1,1,0]])
+      attributes = {attribute.get('Name'): attribute for attribute in grid.iterfind('Attribute')}
+      self.assertEqual({name: (a.get('AttributeType'), a.get('Center')) for name, a in attributes.items()}, dict(u=('Scalar', 'Node'), v=('Vector', 'Node'), c=('Scalar', 'Cell'), m=('Matrix', 'Node')))
+      self.assertEqual(self.read(attributes['u'].find('DataItem')).tolist(), (numpy.arange(4)+i).tolist())
+      self.assertEqual(self.read(attributes['v'].find('DataItem')).tolist(), [[x*i, y*i, 0] for x, y in self.x])
+      self.assertEqual(self.read(attributes['c'].find('DataItem')).tolist(), [i, -i])
+      self.assertEqual(self.read(attributes['m'].find('DataItem')).tolist(), numpy.full((4,2,2), i).tolist())
+    # the mesh is stored only once
+    self.assertEqual(len({grid.find('Topology/DataItem').text for grid in grids}), 1)
+
+  def test_write(self):
+    with treelog.set(treelog.DataLog(str(self.outdir))):
+      self.check_write()
+
+  def test_write_html(self):
+    with treelog.HtmlLog(str(self.outdir)) as htmllog, treelog.set(htmllog):
+      self.check_write()
+
+  def test_invalid(self):
+    with treelog.set(treelog.DataLog(str(self.outdir))), export.timeseries('test', self.tri, self.x) as series:
+      with self.assertRaises(Exception):
+        series.write(0, u=numpy.zeros(3))
+    with self.assertRaises(Exception):
+      series.write(1, u=numpy.zeros(4))
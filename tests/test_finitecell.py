@@ -291,6 +291,17 @@ class leveltopo(TestCase):
     self.assertEqual(tuple(trimtopoA.transforms), tuple(trimtopoB.transforms))
     self.assertEqual(tuple(trimtopoA.opposites), tuple(trimtopoB.opposites))
 
+  def test_parallel(self):
+    domain2 = self.domain1.refined
+    basis = self.domain0.basis('std', degree=1)
+    level = basis.dot((numpy.arange(len(basis))%2)-.5)
+    trimtopoA = self.domain0.trim(level, maxrefine=2)
+    with parallel.maxprocs(2):
+      trimtopoB = self.domain0.trim(level, maxrefine=2)
+      trimtopoC = self.domain0.trim(level, maxrefine=2, leveltopo=domain2)
+    self.assertEqual(tuple(trimtopoA.references), tuple(trimtopoB.references))
+    self.assertEqual(tuple(trimtopoA.references), tuple(trimtopoC.references))
+
   def test_uniformfail(self):
     with self.assertRaises(Exception):
       domain2 = self.domain1.refined
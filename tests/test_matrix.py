@@ -167,6 +167,32 @@ class Solver(testing.TestCase):
         res = numpy.linalg.norm((self.matrix @ lhs)[1:-1])
         self.assertLess(res, args.get('atol', 1e-10))
 
+  def test_factorize(self):
+    for args in self.args:
+      with self.subTest(args.get('solver', 'direct')), self.matrix.factorize(**dict(dict(solver='arnoldi'), **args)) as factorization:
+        for i in range(3):
+          rhs = numpy.arange(self.n) + i
+          lhs = factorization.solve(rhs)
+          res = numpy.linalg.norm(self.matrix @ lhs - rhs)
+          self.assertLess(res, args.get('atol', 1e-10))
+
+  def test_factorize_constraints(self):
+    cons = numpy.empty(self.n)
+    cons[:] = numpy.nan
+    cons[0] = 10
+    cons[-1] = 20
+    factorization = self.matrix.factorize(constrain=cons)
+    for rhs in numpy.zeros(self.n), numpy.ones(self.n):
+      lhs = factorization.solve(rhs)
+      self.assertEqual(lhs[0], cons[0])
+      self.assertEqual(lhs[-1], cons[-1])
+      self.assertAllAlmostEqual(lhs, self.matrix.solve(rhs, constrain=cons))
+    lhs = factorization.solve(numpy.ones((self.n, 2)))
+    self.assertAllAlmostEqual(lhs, numpy.stack([self.matrix.solve(numpy.ones(self.n), constrain=cons)]*2, axis=1))
+    factorization.release()
+    with self.assertRaises(matrix.MatrixError):
+      factorization.solve(numpy.ones(self.n))
+
   def test_submatrix(self):
     rows = self.n//2 + numpy.array([0, 1])
     cols = self.n//2 + numpy.array([-1, 0, 2])
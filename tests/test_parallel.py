@@ -1,8 +1,36 @@
-import unittest, os, multiprocessing, time, sys, warnings as _builtin_warnings
+import unittest, os, signal, multiprocessing, time, sys, warnings as _builtin_warnings
 from nutils import parallel, testing, warnings
 
 canfork = hasattr(os, 'fork')
 
+def _fill(indices, arrays, offset):
+  values, pids, *unused = arrays
+  for i in indices:
+    values[i] = i + offset
+    pids[i] = os.getpid()
+    time.sleep(.01)
+
+def _fail(indices, arrays, mainpid):
+  for i in indices:
+    time.sleep(.01)
+    if os.getpid() != mainpid:
+      1/0
+
+class _Flaky:
+  # Loop function that fails to unpickle in worker processes while `fail` is set.
+
+  def __init__(self, mainpid):
+    self.mainpid = mainpid
+    self.fail = True
+
+  def __setstate__(self, state):
+    if state['fail'] and os.getpid() != state['mainpid']:
+      raise Exception('unpickling failed')
+    self.__dict__.update(state)
+
+  def __call__(self, indices, arrays):
+    _fill(indices, arrays, 0.)
+
 @unittest.skipIf(sys.platform == 'darwin', 'fork is unreliable (in combination with matplotlib)')
 class Test(testing.TestCase):
 
@@ -58,3 +86,119 @@ class Test(testing.TestCase):
         a[i] = 1
         time.sleep(.01)
     self.assertEqual(a.tolist(), [1]*len(a))
+
+  def test_map(self):
+    def func(i):
+      time.sleep(.01)
+      return i**2, os.getpid()
+    squares, pids = zip(*parallel.map(func, range(32)))
+    self.assertEqual(list(squares), [i**2 for i in range(32)])
+    self.assertEqual(len(set(pids)), 3 if canfork else 1)
+
+  def test_map_serial(self):
+    with parallel.maxprocs(1):
+      self.assertEqual(parallel.map(lambda i: (i, os.getpid()), range(4)), [(i, os.getpid()) for i in range(4)])
+
+  @unittest.skipIf(not canfork, 'fork is not available on this system')
+  def test_map_failinchild(self):
+    def func(i):
+      time.sleep(.01)
+      return 1/0 if i == 16 else i
+    with self.assertRaises(Exception):
+      parallel.map(func, range(32))
+
+  def test_loop(self):
+    values, pids = parallel.loop('test', 32, _fill, [(32, float), (32, int)], .5)
+    self.assertEqual(values.tolist(), [i + .5 for i in range(32)])
+    self.assertEqual(len(set(pids)), 3 if canfork else 1)
+
+  def test_pool(self):
+    with parallel.pool() as pool:
+      if canfork:
+        self.assertEqual(pool.nprocs, 3)
+      workers = set()
+      for n, extra in (8, 0), (32, 0), (32, 1<<20): # reuse workers and grow buffer
+        values, pids, unused = parallel.loop('test', n, _fill, [(n, float), (n, int), (extra, float)], 1.)
+        self.assertEqual(values.tolist(), [i + 1. for i in range(n)])
+        workers.update(pids)
+      self.assertEqual(len(workers), 3 if canfork else 1)
+
+  @unittest.skipIf(not canfork, 'fork is not available on this system')
+  def test_pool_failtounpickle(self):
+    func = _Flaky(os.getpid())
+    with parallel.pool() as pool:
+      with self.assertRaisesRegex(Exception, 'pool task failed in 2 out of 3 processes'):
+        parallel.loop('test', 32, func, [(32, float), (32, int)])
+      func.fail = False
+      values, pids = parallel.loop('test', 32, func, [(32, float), (32, int)])
+      self.assertEqual(values.tolist(), list(range(32)))
+    self.assertEqual(pool._funcs, {})
+
+  @unittest.skipIf(not hasattr(os, 'waitid'), 'waitid is not available on this system')
+  def test_pool_workerdied(self):
+    with parallel.pool() as pool:
+      pid = pool._workers[0][0]
+      os.kill(pid, signal.SIGKILL)
+      os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT) # wait for the worker to die, leaving it to be reaped by the pool
+      with self.assertWarns(warnings.NutilsWarning):
+        values, pids = parallel.loop('test', 32, _fill, [(32, float), (32, int)], 0.)
+      self.assertEqual(values.tolist(), list(range(32)))
+      self.assertIsNone(parallel._pool.value)
+      values, pids = parallel.loop('test', 32, _fill, [(32, float), (32, int)], 1.)
+      self.assertEqual(values.tolist(), [i + 1. for i in range(32)])
+
+  def test_pool_unpicklable(self):
+    offset = 2.
+    def fill(indices, arrays): # local functions cannot be pickled
+      values, = arrays
+      for i in indices:
+        values[i] = i + offset
+    with parallel.pool():
+      values, = parallel.loop('test', 32, fill, [(32, float)])
+    self.assertEqual(values.tolist(), [i + 2. for i in range(32)])
+
+  def test_pool_serial(self):
+    with parallel.maxprocs(1), parallel.pool() as pool:
+      self.assertIsNone(pool)
+
+  @unittest.skipIf(not canfork, 'fork is not available on this system')
+  def test_pool_failinchild(self):
+    with parallel.pool():
+      with self.assertRaisesRegex(Exception, 'pool task failed in 2 out of 3 processes'):
+        parallel.loop('test', 32, _fail, [], os.getpid())
+      values, pids = parallel.loop('test', 32, _fill, [(32, float), (32, int)], 0.)
+      self.assertEqual(values.tolist(), list(range(32)))
+
+class Spawn(testing.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.enter_context(parallel.maxprocs(3))
+    self.enter_context(parallel.startmethod('spawn'))
+
+  def test_pool(self):
+    with parallel.pool() as pool:
+      self.assertEqual(pool.nprocs, 3)
+      workers = set()
+      for n, extra in (8, 0), (32, 0), (32, 1<<20): # reuse workers and grow buffer
+        values, pids, unused = parallel.loop('test', n, _fill, [(n, float), (n, int), (extra, float)], 1.)
+        self.assertEqual(values.tolist(), [i + 1. for i in range(n)])
+        workers.update(pids)
+      self.assertEqual(len(workers), 3)
+      self.assertIn(os.getpid(), workers)
+
+  def test_pool_failinchild(self):
+    with parallel.pool():
+      parallel.loop('test', 32, _fill, [(32, float), (32, int)], 0.) # import this module in the workers
+      with self.assertRaisesRegex(Exception, 'pool task failed in 2 out of 3 processes'):
+        parallel.loop('test', 32, _fail, [], os.getpid())
+      values, pids = parallel.loop('test', 32, _fill, [(32, float), (32, int)], 0.)
+      self.assertEqual(values.tolist(), list(range(32)))
+
+  def test_fork(self):
+    with parallel.fork() as procid:
+      self.assertEqual(procid, 0)
+
+  def test_invalid(self):
+    with self.assertRaises(ValueError):
+      parallel.startmethod('thread')
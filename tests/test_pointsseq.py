@@ -20,6 +20,9 @@ class Common:
   def test_iter(self):
     self.assertEqual(tuple(self.seq), tuple(self.check))
 
+  def test_offsets(self):
+    self.assertAllEqual(self.seq.offsets, numpy.cumsum([0]+[p.npoints for p in self.check]))
+
   def _op_or_meth(self, op, name):
     for name, func in (op, functools.partial(getattr(operator, op), self.seq)), (name, getattr(self.seq, name)):
       with self.subTest(name):
@@ -19,6 +19,36 @@ class rectilinear(TestCase):
     area = self.gauss2.integral(function.asarray(1)).eval()
     self.assertLess(abs(area-2), 1e-15)
 
+  def test_integrate_pool(self):
+    basis = self.domain.basis('std', degree=1)
+    u = (basis * function.Argument('u', [len(basis)])).sum(-1)
+    funcs = basis * u**2, function.outer(basis) * u
+    arguments = dict(u=numpy.arange(len(basis), dtype=float))
+    desired = self.gauss2.integrate(funcs, arguments=arguments)
+    with parallel.maxprocs(2), parallel.pool():
+      for i in range(2):
+        actual = self.gauss2.integrate(funcs, arguments=arguments)
+        self.assertAllAlmostEqual(actual[0], desired[0])
+        self.assertAllAlmostEqual(actual[1].export('dense'), desired[1].export('dense'))
+
+  def test_integrate_batched(self):
+    basis = self.domain.basis('std', degree=1)
+    u = (basis * function.Argument('u', [len(basis)])).sum(-1)
+    funcs = basis * u**2, function.outer(basis) * u, function.outer(basis), u
+    args = numpy.random.RandomState(0).normal(size=(3, len(basis)))
+    vec, mat, const, scalar = self.gauss2.integrate_batched(funcs, arguments=dict(u=args))
+    self.assertEqual(vec.shape, (3, len(basis)))
+    self.assertEqual(len(mat), 3)
+    self.assertEqual(scalar.shape, (3,))
+    for i, arg in enumerate(args):
+      desired = self.gauss2.integrate(funcs, arguments=dict(u=arg))
+      self.assertAllAlmostEqual(vec[i], desired[0])
+      self.assertAllAlmostEqual(mat[i].export('dense'), desired[1].export('dense'))
+      self.assertAllAlmostEqual(const[i].export('dense'), desired[2].export('dense'))
+      self.assertAllAlmostEqual(scalar[i], desired[3])
+    with self.assertRaises(ValueError):
+      self.gauss2.integrate_batched(funcs, arguments=dict(u=args[0]))
+
   def test_eval(self):
     x = self.bezier3.eval(self.geom)
     self.assertEqual(x.shape, (self.bezier3.npoints,)+self.geom.shape)
@@ -38,6 +68,18 @@ class rectilinear(TestCase):
     self.assertEqual(subset2.npoints, 4)
     self.assertEqual(subset1, subset2)
 
+  def test_custom_index(self):
+    nelems = self.bezier2.nelems
+    index = tuple(numpy.arange(self.bezier2.npoints).reshape(nelems, -1)[::-1] + 1)
+    custom = sample.Sample.new(self.bezier2.transforms, self.bezier2.points, index)
+    self.assertAllEqual(custom.tri, numpy.concatenate([index[ielem].take(points.tri) for ielem, points in enumerate(self.bezier2.points)]))
+    self.assertAllEqual(custom.hull, numpy.concatenate([index[ielem].take(points.hull) for ielem, points in enumerate(self.bezier2.points)]))
+    mask = numpy.zeros(custom.npoints+1, dtype=bool)
+    mask[1] = True
+    subset = custom.subset(mask)
+    self.assertEqual(subset.nelems, 1)
+    self.assertEqual(subset.transforms[0][0], self.bezier2.transforms[0][1])
+
   def test_asfunction(self):
     func = self.geom[0]**2 - self.geom[1]**2
     values = self.gauss2.eval(func)
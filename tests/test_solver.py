@@ -1,6 +1,7 @@
 from nutils import solver, mesh, function, cache, types, numeric, warnings, sample, sparse
 from nutils.testing import *
 import numpy, contextlib, tempfile, itertools, logging
+from unittest import mock
 
 @contextlib.contextmanager
 def tmpcache():
@@ -99,6 +100,12 @@ class navierstokes(TestCase):
   def test_newton_medianbased(self):
     self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, linesearch=solver.MedianBased()).solve(tol=self.tol, maxiter=2))
 
+  def test_newton_backtracking(self):
+    self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, linesearch=solver.Backtracking()).solve(tol=self.tol, maxiter=4))
+
+  def test_newton_secantbased(self):
+    self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, linesearch=solver.SecantBased()).solve(tol=self.tol, maxiter=2))
+
   def test_newton_relax0(self):
     self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, relax0=.1).solve(tol=self.tol, maxiter=5))
 
@@ -111,6 +118,28 @@ class navierstokes(TestCase):
   def test_newton_iter(self):
     _test_recursion_cache(self, lambda: ((self.frozen(lhs), info.resnorm) for lhs, info in solver.newton(self.dofs, residual=self.residual, constrain=self.cons)))
 
+  def test_newton_refresh(self):
+    with self.assertLogs('nutils', logging.INFO) as cm:
+      self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, refresh=3).solve(tol=self.tol, maxiter=10))
+    self.assertTrue(any('reusing jacobian' in msg for msg in cm.output))
+
+  def test_newton_refreshratio(self):
+    with self.assertLogs('nutils', logging.INFO) as cm:
+      self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, refresh=float('inf'), refreshratio=1e-3).solve(tol=self.tol, maxiter=10))
+    self.assertTrue(any('refreshing jacobian: residual ratio' in msg for msg in cm.output))
+
+  def test_newton_refresh_noreassembly(self):
+    evaluated = set()
+    eval_integrals_sparse = sample.eval_integrals_sparse
+    def wrapper(*funcs, **arguments):
+      key = tuple(sorted((name, numpy.asarray(value).tobytes()) for name, value in arguments.items()))
+      for func in funcs:
+        self.assertNotIn((func, key), evaluated, 'integral assembled twice for the same arguments')
+        evaluated.add((func, key))
+      return eval_integrals_sparse(*funcs, **arguments)
+    with mock.patch.object(sample, 'eval_integrals_sparse', wrapper):
+      self.assert_resnorm(solver.newton(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, refresh=float('inf'), refreshratio=1e-3).solve(tol=self.tol, maxiter=10))
+
   def test_pseudotime(self):
     self.assert_resnorm(solver.pseudotime(self.dofs, residual=self.residual, arguments=self.arguments, constrain=self.cons, inertia=self.inertia, timestep=1).solve(tol=self.tol, maxiter=12))
 
@@ -155,9 +184,18 @@ class finitestrain(TestCase):
   def test_newton_boolcons(self):
     self.assert_resnorm(solver.newton('dofs', residual=self.residual, constrain=self.boolcons).solve(tol=self.tol, maxiter=7))
 
+  def test_newton_backtracking(self):
+    self.assert_resnorm(solver.newton('dofs', residual=self.residual, constrain=self.cons, linesearch=solver.Backtracking()).solve(tol=self.tol, maxiter=12))
+
+  def test_newton_secantbased(self):
+    self.assert_resnorm(solver.newton('dofs', residual=self.residual, constrain=self.cons, linesearch=solver.SecantBased()).solve(tol=self.tol, maxiter=12))
+
   def test_newton_iter(self):
     _test_recursion_cache(self, lambda: ((types.frozenarray(lhs), info.resnorm) for lhs, info in solver.newton('dofs', residual=self.residual, constrain=self.cons)))
 
+  def test_newton_refresh(self):
+    self.assert_resnorm(solver.newton('dofs', residual=self.residual, constrain=self.cons, refresh=float('inf'), refreshratio=.1).solve(tol=self.tol, maxiter=20))
+
   def test_minimize(self):
     self.assert_resnorm(solver.minimize('dofs', energy=self.energy, constrain=self.cons).solve(tol=self.tol, maxiter=12))
 
@@ -190,6 +228,11 @@ class optimize(TestCase):
     cons = solver.optimize('dofs', err, droptol=1e-15, tol=1e-15)
     numpy.testing.assert_almost_equal(cons, numpy.take([1,numpy.nan], [0,1,1,0,1,1,0,1,1]), decimal=15)
 
+  def test_nonlinear_backtracking(self):
+    err = self.domain.boundary['bottom'].integral('(u + .25 u^3 - 1.25)^2 d:geom' @ self.ns, degree=6)
+    cons = solver.optimize('dofs', err, droptol=1e-15, tol=1e-15, linesearch=solver.Backtracking())
+    numpy.testing.assert_almost_equal(cons, numpy.take([1,numpy.nan], [0,1,1,0,1,1,0,1,1]), decimal=15)
+
   def test_nonlinear_multipleroots(self):
     err = self.domain.boundary['bottom'].integral('(u + u^2 - .75)^2' @ self.ns, degree=2)
     cons = solver.optimize('dofs', err, droptol=1e-15, lhs0=numpy.ones(len(self.ns.ubasis)), tol=1e-10)
@@ -237,6 +280,9 @@ class burgers(TestCase):
   def test_resume_withscaling(self):
     _test_recursion_cache(self, lambda: map(types.frozenarray, solver.impliciteuler('dofs', residual=self.residual, inertia=self.inertia, lhs0=self.lhs0, timestep=100)))
 
+  def test_resume_adaptive(self):
+    _test_recursion_cache(self, lambda: map(types.frozenarray, solver.adaptivethetamethod('dofs', residual=self.residual, inertia=self.inertia, lhs0=self.lhs0, timestep=.1, theta=.5, timesteptol=1e-2)))
+
 
 class theta_time(TestCase):
 
@@ -260,3 +306,32 @@ class theta_time(TestCase):
 
   def test_cranknicolson(self):
     self.check(solver.cranknicolson, theta=0.5)
+
+  def check_adaptive(self, theta, timestep, places):
+    ns = function.Namespace()
+    topo, ns.x = mesh.rectilinear([1])
+    ns.u_n = '?u_n + <0>_n'
+    inertia = topo.integral('?u_n d:x' @ ns, degree=0)
+    residual = topo.integral('-<1>_n sin(?t) d:x' @ ns, degree=0)
+    timesteps = []
+    for i, lhs in zip(range(8), solver.adaptivethetamethod(target=('u',), residual=(residual,), inertia=(inertia,), timestep=timestep, theta=theta, timesteptol=1e-5, arguments=dict(u=numpy.array([0.])), timetarget='t', timesteptarget='dt')):
+      with self.subTest(i=i):
+        self.assertAllAlmostEqual(lhs['u'], [1-numpy.cos(lhs['t'])], places=places)
+      timesteps.append(float(lhs['dt']))
+    self.assertGreater(timesteps[-1], timesteps[0])
+
+  def test_adaptive_impliciteuler(self):
+    self.check_adaptive(theta=1, timestep=.001, places=4)
+
+  def test_adaptive_cranknicolson(self):
+    self.check_adaptive(theta=.5, timestep=.01, places=4)
+
+  def test_adaptive_rejection(self):
+    ns = function.Namespace()
+    topo, ns.x = mesh.rectilinear([1])
+    inertia = topo.integral('?u d:x' @ ns, degree=0)
+    residual = topo.integral('?u d:x' @ ns, degree=0)
+    with self.assertLogs('nutils', logging.INFO) as cm:
+      for i, lhs in zip(range(4), solver.adaptivethetamethod('u', residual=residual, inertia=inertia, timestep=1., theta=.5, timesteptol=1e-4, lhs0=numpy.array(1.))):
+        pass
+    self.assertTrue(any('exceeds tolerance' in msg for msg in cm.output))
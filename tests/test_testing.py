@@ -1,6 +1,7 @@
 from nutils.testing import *
 from nutils import numeric
 import numpy
+import tracemalloc
 
 
 class almostequal64(TestCase):
@@ -36,3 +37,42 @@ If this is expected, update the base64 string to:
     self.assertEqual(str(cm.exception), '''failed to decode data: Incorrect padding
 If this is expected, update the base64 string to:
 ''' + self.desired)
+
+class budget(TestCase):
+
+  def test_time(self):
+    with self.assertBudget(time=1., per=10):
+      pass
+    with self.assertRaisesRegex(AssertionError, '^time budget exceeded'):
+      with self.assertBudget(time=0., per=10):
+        pass
+
+  def test_memory(self):
+    with self.assertBudget(memory=10000, per=10):
+      a = numpy.zeros(1000, dtype=numpy.uint8)
+    with self.assertRaisesRegex(AssertionError, '^memory budget exceeded'):
+      with self.assertBudget(memory=10, per=10):
+        a = numpy.zeros(1000, dtype=numpy.uint8)
+
+  def test_memory_tracing(self):
+    tracemalloc.start()
+    try:
+      a = numpy.zeros(100000, dtype=numpy.uint8)
+      del a
+      with self.assertBudget(memory=1000, per=10):
+        a = numpy.zeros(1000, dtype=numpy.uint8)
+      self.assertTrue(tracemalloc.is_tracing())
+    finally:
+      tracemalloc.stop()
+
+class evaluations(TestCase):
+
+  def test_integrate(self):
+    from nutils import mesh, function
+    topo, geom = mesh.rectilinear([4,4])
+    basis = topo.basis('std', degree=1)
+    with count_evaluations() as counter:
+      topo.integrate(basis * function.J(geom), degree=2)
+    self.assertEqual(counter['iteration'], 16)
+    self.assertEqual(counter['ElemwiseFromCallable'], 16)
+    self.assertNotIn('eval', counter)
@@ -1,6 +1,6 @@
 from nutils.testing import *
 import nutils.types
-import inspect, pickle, itertools, ctypes, stringly, tempfile, io, os
+import inspect, pickle, itertools, ctypes, stringly, tempfile, io, os, sys
 import numpy
 
 class apply_annotations(TestCase):
@@ -244,6 +244,34 @@ class CacheMeta(TestCase):
     with self.assertRaises(AttributeError):
       del t.x
 
+  def test_iscached(self):
+
+    for withslots in False, True:
+      with self.subTest(withslots=withslots):
+
+        class T(metaclass=nutils.types.CacheMeta):
+          if withslots:
+            __slots__ = ()
+          __cache__ = 'x',
+          @property
+          def x(self):
+            return 1
+
+        class U(T):
+          if withslots:
+            __slots__ = ()
+          @property
+          def x(self):
+            return 2
+
+        t = T()
+        self.assertFalse(nutils.types.iscached(t, 'x'))
+        t.x
+        self.assertTrue(nutils.types.iscached(t, 'x'))
+        u = U()
+        u.x
+        self.assertFalse(nutils.types.iscached(u, 'x'))
+
   def test_method_without_args(self):
 
     for withslots in False, True:
@@ -981,6 +1009,19 @@ class ImmutableFamily(TestCase):
     self.assertEqual(nutils.types.nutils_hash(T(1, 2)).hex(), '8c3ba8f0d9eb054ab192f4e4e2ba7442564bdf85')
     self.assertEqual(nutils.types.nutils_hash(T1(1, 2)).hex(), 'bab4ee65b5189f544a4242f0e386af76cfa6e31d')
 
+  def test_nutils_hash_deep(self):
+    class T(self.cls):
+      def __init__(self, x, y):
+        pass
+
+    def nested(x):
+      for i in range(sys.getrecursionlimit()):
+        x = T((x,), nutils.types.frozendict({i: nutils.types.frozenmultiset([x])}))
+      return x
+
+    self.assertEqual(nutils.types.nutils_hash(nested(0)).hex(), nutils.types.nutils_hash(nested(0)).hex())
+    self.assertNotEqual(nutils.types.nutils_hash(nested(0)).hex(), nutils.types.nutils_hash(nested(1)).hex())
+
   @parametrize.enable_if(lambda cls: cls is nutils.types.Singleton)
   def test_deduplication(self):
     class T(self.cls):